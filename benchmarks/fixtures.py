@@ -0,0 +1,677 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+"""Generate a synthetic legacy database to benchmark the migration.
+
+The objects are stored with the same class names and attribute layout
+as the legacy Indico objects, so the migration reads them exactly like
+a real database.  The output directory contains the main database
+(``Data.fs``), the room booking database (``rb.fs``), the archive with
+the attachment files, the room photos and a ``fixture.json`` manifest
+with the number of objects which have been created.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import json
+import os
+import random
+import sys
+import types
+from collections import defaultdict
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import click
+import pytz
+import transaction
+from BTrees.IOBTree import IOBTree
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from persistent.mapping import PersistentMapping
+from PIL import Image
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+
+from indico.util.console import cformat
+
+
+click.disable_unicode_literals_warning = True
+
+# legacy classes whose instances are stored as separate database records
+PERSISTENT_CLASSES = {'AbstractMgr', 'Abstract', 'AdminList', 'Avatar', 'Category', 'ConfDisplayMgr', 'Conference',
+                      'ConferenceSchedule', 'Contribution', 'Counter', 'GeneralField', 'GeneralSectionForm', 'Group',
+                      'Link', 'LocalFile', 'Location', 'LogHandler', 'MaKaCInfo', 'Material',
+                      'MaterialLocalRepository', 'Minutes', 'PersonalDataForm', 'Registrant', 'RegistrationForm',
+                      'Reservation', 'Room', 'Session', 'SessionSlot', 'SlotSchedule', 'Track'}
+# a bcrypt hash, so the migration does not have to hash any plaintext passwords
+PASSWORD_HASH = b'$2b$12$1nEDs9g8LQSF3IDhY8kE1eLOaVPmnGXBAd/pqCf5UAfKMk0szNJZ2'
+FIRST_NAMES = ['Alice', 'Bob', 'Carla', 'Dmitri', 'Eva', 'Fabio', 'Greta', 'Hiro', 'Ines', 'Jonas', 'Karin', 'Luis']
+LAST_NAMES = ['Meyer', 'Rossi', 'Novak', 'Dupont', 'Ivanova', 'Tanaka', 'Silva', 'Jensen', 'Kowalski', 'Garcia']
+AFFILIATIONS = ['CERN', 'DESY', 'Fermilab', 'KEK', 'INFN', 'IN2P3', '']
+EQUIPMENT = ['Projector', 'Whiteboard', 'Microphone', 'Computer']
+EVENT_TYPES = ['meeting', 'lecture', 'conference']
+MINUTES = b'<p>Minutes of the meeting</p><ul><li>Item one</li><li>Item two</li></ul>'
+
+_legacy_classes = {}
+
+
+def _legacy_module(name):
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+    module = sys.modules[name] = types.ModuleType(str(name))
+    parent, __, child = name.rpartition('.')
+    if parent:
+        setattr(_legacy_module(parent), str(child), module)
+    return module
+
+
+def _legacy_class(path):
+    """Get a class which is pickled like the legacy class `path`."""
+    try:
+        return _legacy_classes[path]
+    except KeyError:
+        pass
+    module_name, __, name = path.rpartition('.')
+    attrs = {str('__module__'): str(module_name)}
+    if name in PERSISTENT_CLASSES:
+        cls = type(str(name), (Persistent,), attrs)
+    else:
+        # legacy non-persistent classes are old-style classes
+        cls = types.ClassType(str(name), (), attrs)
+    setattr(_legacy_module(module_name), str(name), cls)
+    _legacy_classes[path] = cls
+    return cls
+
+
+def _legacy_value(value):
+    """Convert text to the utf-8 encoded strings used by legacy Indico."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_legacy_value(x) for x in value]
+    elif isinstance(value, tuple):
+        return tuple(_legacy_value(x) for x in value)
+    elif type(value) is dict:
+        return {_legacy_value(k): _legacy_value(v) for k, v in value.iteritems()}
+    return value
+
+
+def _new(path, **attrs):
+    obj = _legacy_class(path)()
+    for name, value in attrs.iteritems():
+        setattr(obj, str(name), _legacy_value(value))
+    return obj
+
+
+def _open_db(path):
+    db = DB(FileStorage(path))
+    return db, db.open().root()
+
+
+class FixtureGenerator(object):
+    """Create the legacy databases and the files they reference.
+
+    :param output_dir: The directory to create the fixture in
+    :param seed: The seed for the random number generator
+    :param file_size: The size of each attachment file in bytes
+    :param duplicate_ratio: The probability of an attachment file
+                            having the same content as a previous one
+    :param batch_size: The number of conferences to commit after
+    """
+
+    def __init__(self, output_dir, seed=0, file_size=4096, duplicate_ratio=0, batch_size=50):
+        self.output_dir = output_dir
+        self.archive_dir = os.path.join(output_dir, 'archive')
+        self.photo_dir = os.path.join(output_dir, 'photos')
+        self.random = random.Random(seed)
+        self.file_size = file_size
+        self.duplicate_ratio = duplicate_ratio
+        self.batch_size = batch_size
+        self.counts = defaultdict(int)
+        self.avatars = []
+        self.categories = []
+        self._contents = []
+        self.db, self.root = _open_db(os.path.join(output_dir, 'Data.fs'))
+        self.rb_db, self.rb_root = _open_db(os.path.join(output_dir, 'rb.fs'))
+        self.repository = _new('MaKaC.fileRepository.MaterialLocalRepository',
+                               _MaterialLocalRepository__files=OOBTree())
+        self.root['local_repositories'] = PersistentMapping({'main': self.repository})
+
+    def close(self):
+        transaction.commit()
+        self.db.close()
+        self.rb_db.close()
+
+    def _commit(self):
+        transaction.commit()
+        self.root._p_jar.cacheMinimize()
+        self.rb_root._p_jar.cacheMinimize()
+
+    def _dt(self, start_year=2005, end_year=2017):
+        start = datetime(start_year, 1, 1, tzinfo=pytz.utc)
+        days = (datetime(end_year, 12, 31, tzinfo=pytz.utc) - start).days
+        return start + timedelta(days=self.random.randrange(days), hours=self.random.randrange(8, 18))
+
+    def _name(self):
+        return self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES)
+
+    def _ac(self, **kwargs):
+        attrs = {'_accessProtection': 0, '_hideFromUnauthorizedUsers': False, 'allowed': [], 'managers': [],
+                 'managersEmail': [], 'submitters': [], 'requiredDomains': [], 'contactInfo': ''}
+        attrs.update(kwargs)
+        return _new('MaKaC.accessControl.AccessController', **attrs)
+
+    def _file_content(self):
+        if self._contents and self.random.random() < self.duplicate_ratio:
+            return self.random.choice(self._contents)
+        # drawn from the seeded generator so the same seed always results in the same files
+        content = bytes(bytearray(self.random.getrandbits(8) for __ in xrange(self.file_size)))
+        if len(self._contents) < 100:
+            self._contents.append(content)
+        return content
+
+    def _image(self, size, format_):
+        buf = BytesIO()
+        color = tuple(self.random.randrange(256) for __ in xrange(3))
+        Image.new('RGB', size, color).save(buf, format_)
+        return buf.getvalue()
+
+    def _local_file(self, id_, name, filename, dt, content=None):
+        if content is None:
+            content = self._file_content()
+        self.counts['files'] += 1
+        self.counts['file_bytes'] += len(content)
+        archived_id = str(self.counts['files'])
+        path = os.path.join(dt.strftime('%Y'), dt.strftime('%m'), dt.strftime('%d'), archived_id, filename)
+        os.makedirs(os.path.join(self.archive_dir, os.path.dirname(path)))
+        with open(os.path.join(self.archive_dir, path), 'wb') as f:
+            f.write(content)
+        self.repository._MaterialLocalRepository__files[archived_id] = _legacy_value(path)
+        return _new('MaKaC.conference.LocalFile', id=id_, name=name, description='', fileName=filename,
+                    _Resource__ac=self._ac(), _LocalFile__archivedId=archived_id,
+                    _LocalFile__repository=self.repository)
+
+    def _materials(self, num_files, dt, with_link=False):
+        resources = {}
+        for i in xrange(num_files):
+            resources[str(i)] = self._local_file(str(i), 'File {}'.format(i + 1), 'file-{}.pdf'.format(i + 1), dt)
+        if with_link:
+            resources[str(num_files)] = _new('MaKaC.conference.Link', id=str(num_files), name='Website',
+                                             description='', url='https://example.com/', _Resource__ac=self._ac())
+        if not resources:
+            return {}
+        material = _new('MaKaC.conference.Material', id='0', title='Slides', description='',
+                        _Material__ac=self._ac(), _Material__resources=resources, _modificationDS=dt)
+        return {'0': material}
+
+    def _minutes(self, dt):
+        minutes_file = self._local_file('minutes', 'Minutes', 'minutes.html', dt, content=MINUTES)
+        return _new('MaKaC.conference.Minutes', id='minutes', title='Minutes', description='',
+                    _Material__ac=self._ac(), _Material__resources={'minutes': minutes_file}, file=minutes_file,
+                    _modificationDS=dt)
+
+    def _person(self, path, affiliation_attr='_affiliation', **kwargs):
+        first_name, last_name = self._name()
+        if self.avatars and self.random.random() < 0.5:
+            email = self.random.choice(self.avatars).email
+        else:
+            self.counts['external_persons'] += 1
+            email = 'person{}@example.net'.format(self.counts['external_persons'])
+        attrs = {'_firstName': first_name, '_surName': last_name, '_email': email, '_title': '', '_address': '',
+                 affiliation_attr: self.random.choice(AFFILIATIONS)}
+        attrs.update(kwargs)
+        return _new(path, **attrs)
+
+    def create_globals(self):
+        root = self.root
+        root['MaKaCInfo'] = PersistentMapping({'main': _new(
+            'MaKaC.common.info.MaKaCInfo', _title='Benchmark Indico', _organisation='Benchmark', _timezone='UTC',
+            _lang='en_GB', _notifyAccountCreation=False, _newsActive=False,
+            _socialAppConfig={'active': False, 'facebook': {}},
+            _ip_based_acl_mgr=_new('MaKaC.common.info.IPBasedACLMgr', _full_access_acl=set()),
+            _styleMgr=_new('MaKaC.webinterface.common.StyleManager',
+                           _defaultEventStylesheet={'meeting': 'standard', 'simple_event': 'lecture',
+                                                    'conference': 'conference'})
+        )})
+        root['adminlist'] = _new('MaKaC.accessControl.AdminList', _AdminList__list=[])
+        root['plugins'] = PersistentMapping({'RoomBooking': _new('MaKaC.plugins.base.PluginType', _PluginBase__options={
+            name: _new('MaKaC.plugins.base.PluginOption', _PluginOption__value=value)
+            for name, value in (('AuthorisedUsersGroups', []), ('Managers', []), ('assistanceNotificationEmails', []),
+                                ('notificationHour', 6), ('notificationBefore', 0))
+        })})
+        root['modules'] = PersistentMapping({
+            'upcoming_events': _new('MaKaC.modules.upcoming.UpcomingEventsModule', _maxEvents=10, _objects=[]),
+            'scheduler': _new('MaKaC.modules.scheduler.SchedulerModule',
+                              _waitingQueue=_new('MaKaC.modules.scheduler.TaskQueue', _container={}))
+        })
+        root['DefaultRoomBookingLocation'] = b'Default'
+        root['RoomBookingLocationList'] = [_new('MaKaC.rb_location.Location', friendlyName='Default', _aspects={})]
+        root['webfactoryregistry'] = OOBTree()
+        root['displayRegistery'] = OOBTree()
+        root['conferences'] = OOBTree()
+
+    def create_avatars(self, count, merged_ratio):
+        avatars = self.root['avatars'] = OOBTree()
+        for i in xrange(1, count + 1):
+            first_name, last_name = self._name()
+            avatar = _new('MaKaC.user.Avatar', id=str(i), _mergeTo=None, _mergeFrom=[], status='activated',
+                          name=first_name, surName=last_name, email='user{}@example.com'.format(i),
+                          secondaryEmails=['user{}@example.org'.format(i)] if i % 10 == 0 else [], title='',
+                          telephone=['+41 22 767 {:04d}'.format(i % 10000)],
+                          organisation=[self.random.choice(AFFILIATIONS)], address=[''], timezone='UTC',
+                          _lang='en_GB', displayTZMode='Event Timezone', linkedTo={'category': {'favorite': []}},
+                          identities=[_new('MaKaC.authentication.LocalAuthentication.LocalIdentity',
+                                           login='user{}'.format(i), password=PASSWORD_HASH, algorithm='bcrypt')],
+                          personalInfo=_new('MaKaC.user.PersonalInfo', _showPastEvents=False,
+                                            _basket=_new('MaKaC.common.basket.Basket', _users={})))
+            avatars[avatar.id] = avatar
+            self.avatars.append(avatar)
+        for avatar in self.random.sample(self.avatars, int(count * merged_ratio)):
+            target = self.random.choice(self.avatars)
+            if target is avatar or target._mergeTo is not None:
+                continue
+            avatar._mergeTo = target
+            target._mergeFrom.append(avatar)
+            target._p_changed = True
+            self.counts['merged_avatars'] += 1
+        for avatar in self.avatars[:10]:
+            for favorite in self.random.sample(self.avatars, min(5, count)):
+                avatar.personalInfo._basket._users[favorite.id] = favorite
+        self.root['adminlist']._AdminList__list = self.avatars[:2]
+        self.counts['avatars'] = count
+        self._commit()
+
+    def create_groups(self, count):
+        groups = self.root['groups'] = OOBTree()
+        for i in xrange(1, count + 1):
+            members = self.random.sample(self.avatars, min(len(self.avatars), self.random.randrange(1, 50)))
+            groups[str(i)] = _new('MaKaC.user.Group', id=str(i), name='Group {}'.format(i), members=members)
+        self.counts['groups'] = count
+        self._commit()
+
+    def _category(self, id_, name, parent, order):
+        icon = None
+        if id_ != '0' and self.random.random() < 0.2:
+            # most legacy icons are not 16x16 and thus need to be resized
+            size = self.random.choice([(16, 16), (32, 32), (64, 48)])
+            icon = self._local_file(id_, 'icon', 'icon.png', self._dt(), content=self._image(size, 'PNG'))
+            self.counts['category_icons'] += 1
+        category = _new('MaKaC.conference.Category', id=id_, name=name, description='', _order=order,
+                        _visibility=999, _notifyCreationList='', _timezone='UTC', _icon=icon,
+                        _defaultStyle={'simple_event': '', 'meeting': ''}, subcategories={}, materials={},
+                        _Category__ac=self._ac(), _Category__confCreationRestricted=True,
+                        _Category__confCreators=[])
+        if parent is not None:
+            parent.subcategories[id_] = category
+            parent._p_changed = True
+        return category
+
+    def create_categories(self, count, fanout):
+        root_category = self.root['rootCategory'] = self._category('0', 'Home', None, 0)
+        self.categories = [root_category]
+        for i in xrange(1, count):
+            parent = self.categories[(i - 1) // fanout]
+            self.categories.append(self._category(str(i), 'Category {}'.format(i), parent,
+                                                  len(parent.subcategories)))
+        for avatar in self.random.sample(self.avatars, len(self.avatars) // 10):
+            avatar.linkedTo['category']['favorite'].append(self.random.choice(self.categories))
+            avatar._p_changed = True
+        self.counts['categories'] = count
+        self._commit()
+
+    def _regform(self, event_type, start_dt):
+        pd_form = _new('MaKaC.registration.PersonalDataForm', _title='Personal Data', _description='')
+        fields = []
+        for i, (caption, pd_field) in enumerate([('First Name', 'firstName'), ('Last Name', 'surname'),
+                                                 ('Email', 'email'), ('Institution', 'institution')]):
+            fields.append(_new('MaKaC.registration.GeneralField', _id=str(i), _caption=caption,
+                               _input=_new('MaKaC.registration.TextInput'), _mandatory=True, _pdField=pd_field,
+                               _parent=pd_form, _billable=False, _price=0))
+        pd_form._sortedFields = fields
+        general_form = _new('MaKaC.registration.GeneralSectionForm', _title='Additional information',
+                            _description='', _id='0')
+        dinner = _new('MaKaC.registration.GeneralField', _id='0', _caption='Conference dinner',
+                      _input=_new('MaKaC.registration.CheckboxInput'), _mandatory=False, _parent=general_form,
+                      _billable=False, _price=0)
+        general_form._sortedFields = [dinner]
+        active = event_type == 'conference'
+        start_reg = (start_dt - timedelta(days=60)).replace(tzinfo=None)
+        regform = _new('MaKaC.registration.RegistrationForm', title='Registration', announcement='', contactInfo='',
+                       startRegistrationDate=start_reg, usersLimit=0, activated=active,
+                       endRegistrationDate=(start_dt - timedelta(days=1)).replace(tzinfo=None) if active else start_reg,
+                       notification=_new('MaKaC.registration.Notification', _ccList=[], _toList=[]),
+                       _sortedForms=[pd_form, general_form], _statuses={}, _currency='EUR')
+        return regform, fields, general_form, dinner
+
+    def _registrants(self, count, start_dt, fields, general_form, dinner):
+        registrants = {}
+        for i in xrange(count):
+            if self.avatars and self.random.random() < 0.5:
+                avatar = self.random.choice(self.avatars)
+                first_name, last_name, email = avatar.name, avatar.surName, avatar.email
+            else:
+                avatar = None
+                first_name, last_name = self._name()
+                self.counts['external_persons'] += 1
+                email = 'person{}@example.net'.format(self.counts['external_persons'])
+            values = [first_name, last_name, email, self.random.choice(AFFILIATIONS)]
+            pd_items = {field._id: _new('MaKaC.registration.MiscellaneousInfoSimpleItem', _generalField=field,
+                                        _value=value, _billable=False, _price=0)
+                        for field, value in zip(fields, values)}
+            general_items = {dinner._id: _new('MaKaC.registration.MiscellaneousInfoSimpleItem', _generalField=dinner,
+                                              _value=self.random.choice(['yes', 'no']), _billable=False, _price=0)}
+            miscellaneous = {
+                'pd': _new('MaKaC.registration.MiscellaneousInfoGroup', _responseItems=pd_items),
+                general_form._id: _new('MaKaC.registration.MiscellaneousInfoGroup', _responseItems=general_items)
+            }
+            registrants[str(i)] = _new(
+                'MaKaC.registration.Registrant', _id=str(i), _firstName=first_name, _surname=last_name, _email=email,
+                _registrationDate=start_dt - timedelta(days=self.random.randrange(2, 60)),
+                _randomId=self.random.getrandbits(32), _avatar=avatar, _sessions=[], _socialEvents=[],
+                _accommodation=_new('MaKaC.registration.Accommodation', _accommodationType=None),
+                _reasonParticipation='', _miscellaneous=miscellaneous, _statuses={}, _total=0, _transactionInfo=None
+            )
+        self.counts['registrants'] += count
+        return registrants
+
+    def _abstracts(self, count, start_dt, tracks):
+        submission_start = (start_dt - timedelta(days=120)).replace(tzinfo=None)
+        submission_end = (start_dt - timedelta(days=30)).replace(tzinfo=None)
+        content_field = _new('MaKaC.review.AbstractField', _id='content', _active=True, _isMandatory=True,
+                             _maxLength=0)
+        amgr = _new('MaKaC.review.AbstractMgr', _activated=bool(count), _submissionStartDate=submission_start,
+                    _submissionEndDate=submission_end if count else submission_start, _abstracts={}, _notifTpls={},
+                    _notifTplsOrder=[], _announcement='',
+                    _abstractFieldsMgr=_new('MaKaC.review.AbstractFieldsMgr', _fields=[content_field]))
+        for i in xrange(1, count + 1):
+            submitted_dt = start_dt - timedelta(days=self.random.randrange(31, 120))
+            track = self.random.choice(tracks) if tracks else None
+            if track is not None and self.random.random() < 0.5:
+                status = _new('MaKaC.review.AbstractStatusAccepted', _contribType=None, _track=track,
+                              _responsible=self.random.choice(self.avatars), _date=submitted_dt.replace(tzinfo=None))
+            else:
+                status = _new('MaKaC.review.AbstractStatusSubmitted', _date=submitted_dt.replace(tzinfo=None))
+            amgr._abstracts[str(i)] = _new(
+                'MaKaC.review.Abstract', _id=str(i), _title='Abstract {}'.format(i), _currentStatus=status,
+                _submitter=_new('MaKaC.review.Submitter', _user=self.random.choice(self.avatars)),
+                _submissionDate=submitted_dt, _modificationDate=submitted_dt,
+                _fields={'content': 'The content of abstract {}.'.format(i)}, _contribTypes=[None],
+                _contribution=None, _attachments={}, _intComments=[], _trackJudgementsHistorical={},
+                _tracks={track.id: track} if track is not None else {},
+                _notifLog=_new('MaKaC.review.NotificationLog', _entries=[]),
+                _primaryAuthors=[self._person('MaKaC.review.AbstractParticipation', '_affilliation',
+                                              _telephone='')],
+                _coAuthors=[self._person('MaKaC.review.AbstractParticipation', '_affilliation', _telephone='')],
+                _speakers=[]
+            )
+        self.counts['abstracts'] += count
+        return amgr
+
+    def _contribution(self, id_, start_dt, duration, tracks, files):
+        contrib = _new('MaKaC.conference.Contribution', id=id_, title='Contribution {}'.format(id_),
+                       _fields={'content': 'The description of contribution {}.'.format(id_)}, _status=None,
+                       duration=duration, startDate=start_dt, _boardNumber='', _keywords='',
+                       _track=self.random.choice(tracks) if tracks else None, _type=None, _submitters=[],
+                       _submittersEmail=[], _Contribution__ac=self._ac(), _subConts=[], minutes=None,
+                       _speakers=[self._person('MaKaC.conference.ContributionParticipation', _phone='')],
+                       _primaryAuthors=[self._person('MaKaC.conference.ContributionParticipation', _phone='')],
+                       _coAuthors=[], materials=self._materials(files, start_dt))
+        self.counts['contributions'] += 1
+        return contrib
+
+    def _timetable(self, conf, num_contributions, files, tracks):
+        """Create the contributions, a session and a break of a conference.
+
+        The first half of the contributions are scheduled in a session
+        block, followed by a break and the remaining contributions.
+        """
+        entries = []
+        contributions = {}
+        sessions = {}
+        duration = timedelta(minutes=20)
+        start_dt = conf.startDate
+        in_session = num_contributions // 2 if num_contributions >= 4 else 0
+        if in_session:
+            session = _new('MaKaC.conference.Session', id='0', title='Session', description='', _code='no code',
+                           _ttType='standard', _contributionDuration=duration, _textColor='#202020',
+                           _color='#e3f2d3', _coordinators={}, _coordinatorsEmail=[], _Session__ac=self._ac(),
+                           materials={}, minutes=None)
+            slot = _new('MaKaC.conference.SessionSlot', id='0', session=session, title='',
+                        duration=duration * in_session, startDate=start_dt,
+                        _conveners=[self._person('MaKaC.conference.SlotChair', _phone='')])
+            slot_entries = []
+            for i in xrange(in_session):
+                contrib = self._contribution(str(i), start_dt, duration, tracks, files)
+                contributions[contrib.id] = contrib
+                slot_entries.append(_new('MaKaC.schedule.ContribSchEntry', _LinkedTimeSchEntry__owner=contrib))
+                start_dt += duration
+            slot._schedule = _new('MaKaC.schedule.SlotSchedule', _entries=slot_entries)
+            sessions[session.id] = session
+            entries.append(_new('MaKaC.schedule.LinkedTimeSchEntry', _LinkedTimeSchEntry__owner=slot))
+            entries.append(_new('MaKaC.schedule.BreakTimeSchEntry', title='Coffee break', description='',
+                                duration=timedelta(minutes=15), startDate=start_dt, _color='#90c0f0',
+                                _textColor='#202020', places=[], rooms=[]))
+            start_dt += timedelta(minutes=15)
+        for i in xrange(in_session, num_contributions):
+            contrib = self._contribution(str(i), start_dt, duration, tracks, files)
+            contributions[contrib.id] = contrib
+            entries.append(_new('MaKaC.schedule.ContribSchEntry', _LinkedTimeSchEntry__owner=contrib))
+            start_dt += duration
+        conf.contributions = contributions
+        conf.sessions = sessions
+        conf._Conference__schedule = _new('MaKaC.schedule.ConferenceSchedule', _entries=entries)
+        conf.endDate = max(conf.endDate, start_dt)
+
+    def _display_manager(self):
+        def _link(class_, name, caption, **kwargs):
+            return _new('MaKaC.webinterface.displayMgr.{}'.format(class_), _name=name, _caption=caption,
+                        _active=True, _listLink=[], **kwargs)
+
+        menu = _new('MaKaC.webinterface.displayMgr.Menu', _listLink=[
+            _link('SystemLink', 'overview', 'Overview'),
+            _link('SystemLink', 'timetable', 'Timetable'),
+            _link('SystemLink', 'contributionList', 'Contribution List'),
+            _link('Spacer', 'spacer', ''),
+            _link('SystemLink', 'registrationForm', 'Registration'),
+            _link('SystemLink', 'registrants', 'Participant List'),
+            _link('ExternLink', 'link0', 'Website', _URL='https://example.com/')
+        ])
+        return _new('MaKaC.webinterface.displayMgr.ConfDisplayMgr', _menu=menu, _defaultstyle='',
+                    _imagesMngr=_new('MaKaC.webinterface.displayMgr.ImagesManager', _picList={}),
+                    _styleMngr=_new('MaKaC.webinterface.displayMgr.StyleManager', _css=None, _usingTemplate=None),
+                    _format=_new('MaKaC.webinterface.displayMgr.Format',
+                                 _data={'titleTextColor': '', 'titleBgColor': ''}),
+                    _tickerTape=_new('MaKaC.webinterface.displayMgr.TickerTape', _enabledNowPlaying=False,
+                                     _text='', _enabledSimpleText=False),
+                    _searchEnabled=True, _displayNavigationBar=True, _showSocialApps=True)
+
+    def _conference(self, id_, event_type, num_contributions, num_registrants, num_abstracts, files):
+        start_dt = self._dt()
+        end_dt = start_dt + (timedelta(days=self.random.randrange(1, 4)) if event_type == 'conference'
+                             else timedelta(hours=2))
+        category = self.random.choice(self.categories[1:] or self.categories)
+        creator = self.random.choice(self.avatars)
+        conf = _new(
+            'MaKaC.conference.Conference', id=id_, title='{} {}'.format(event_type.title(), id_),
+            description='<p>The description of event {}.</p>'.format(id_), timezone='UTC', startDate=start_dt,
+            endDate=end_dt, _closed=False, _creationDS=start_dt - timedelta(days=90), _visibility=999,
+            _keywords='', _screenStartDate=None, _screenEndDate=None, contactInfo='', alarmList={},
+            _sortUrlTag='', _accessKey='', _pendingQueuesMgr=None, _Conference__owners=[category],
+            _Conference__creator=creator, _Conference__registrars=[], _chairs=[],
+            _Conference__ac=self._ac(managers=[creator]),
+            places=[_new('MaKaC.common.Location.CustomLocation', name='Main Building', address='')],
+            rooms=[_new('MaKaC.common.Location.CustomRoom', name='Room {}'.format(self.random.randrange(1, 100)))],
+            _supportInfo=_new('MaKaC.conference.SupportInfo', _caption='Support', _email='', _telephone=''),
+            _modPay=_new('MaKaC.epayment.EPayment', activated=False),
+            _logHandler=_new('MaKaC.common.log.LogHandler', _logLists={'emailLog': [], 'actionLog': [
+                _new('MaKaC.common.log.ActionLogItem', _responsibleUser=creator, _module='Timetable',
+                     _logDate=start_dt.replace(tzinfo=None) - timedelta(days=1),
+                     _logInfo={'subject': 'Created the timetable'})
+            ]}),
+            _logo=None, programDescription='', _contribTypes={},
+            _boa=_new('MaKaC.conference.BOAConfig', _text='', _sortBy='number'), minutes=None,
+            materials=self._materials(files, start_dt, with_link=True)
+        )
+        if event_type == 'meeting':
+            conf._chairs = [self._person('MaKaC.conference.ConferenceChair', _phone='')]
+            conf.minutes = self._minutes(start_dt)
+        if event_type == 'conference':
+            if self.random.random() < 0.5:
+                conf._logo = self._local_file('logo', 'logo', 'logo.png', start_dt,
+                                              content=self._image((200, 100), 'PNG'))
+                self.counts['event_logos'] += 1
+            conf.program = [_new('MaKaC.conference.Track', id=str(i), title='Track {}'.format(i), description='',
+                                 _code='T{}'.format(i), _coordinators=[]) for i in xrange(3)]
+        else:
+            conf.program = []
+        conf.abstractMgr = self._abstracts(num_abstracts if event_type == 'conference' else 0, start_dt,
+                                           conf.program)
+        regform, fields, general_form, dinner = self._regform(event_type, start_dt)
+        conf._registrationForm = regform
+        conf._registrants = (self._registrants(num_registrants, start_dt, fields, general_form, dinner)
+                             if regform.activated else {})
+        self._timetable(conf, num_contributions, files, conf.program)
+        return conf
+
+    def create_conferences(self, count, num_contributions, num_registrants, num_abstracts, files):
+        conferences = self.root['conferences']
+        with click.progressbar(xrange(count), label='Conferences') as bar:
+            for i in bar:
+                conf_id = str(i)
+                event_type = EVENT_TYPES[i % len(EVENT_TYPES)]
+                conferences[conf_id] = self._conference(conf_id, event_type, num_contributions, num_registrants,
+                                                        num_abstracts, files)
+                if event_type == 'meeting':
+                    self.root['webfactoryregistry'][conf_id] = _new('MaKaC.webinterface.meeting.WebFactory')
+                elif event_type == 'lecture':
+                    self.root['webfactoryregistry'][conf_id] = _new('MaKaC.webinterface.simple_event.WebFactory')
+                self.root['displayRegistery'][conf_id] = self._display_manager()
+                self.counts['conferences'] += 1
+                self.counts['conferences_' + event_type] += 1
+                if i % self.batch_size == self.batch_size - 1:
+                    self._commit()
+        self._commit()
+
+    def create_counters(self):
+        self.root['counters'] = PersistentMapping({
+            'CONFERENCE': _new('MaKaC.common.Counter.Counter', _Counter__count=self.counts['conferences']),
+            'CATEGORY': _new('MaKaC.common.Counter.Counter', _Counter__count=self.counts['categories'])
+        })
+        self._commit()
+
+    def create_rooms(self, count, photos):
+        self.rb_root['CustomAttributesList'] = PersistentMapping({'Default': []})
+        self.rb_root['RoomBlocking'] = OOBTree({'Blockings': IOBTree()})
+        rooms = self.rb_root['Rooms'] = IOBTree()
+        for i in xrange(1, count + 1):
+            room = _new('MaKaC.plugins.RoomBooking.default.room.Room', id=i, _locationName='Default',
+                        _equipment='`'.join(self.random.sample(EQUIPMENT, self.random.randrange(len(EQUIPMENT)))),
+                        avaibleVC=[], _name='', site='Meyrin', division='', building=str(1 + i // 20),
+                        floor=str(i % 5), roomNr='{:03d}'.format(i), capacity=self.random.randrange(5, 200),
+                        resvsNeedConfirmation=i % 5 == 0, resvStartNotificationBefore=None,
+                        responsibleId=self.random.choice(self.avatars).id, isActive=True, isReservable=True)
+            rooms[i] = room
+            if photos:
+                name = 'Default-{}-{}-{}.jpg'.format(room.building, room.floor, room.roomNr)
+                for subdir, size in (('large_photos', (800, 600)), ('small_photos', (160, 120))):
+                    with open(os.path.join(self.photo_dir, subdir, name), 'wb') as f:
+                        f.write(self._image(size, 'JPEG'))
+                self.counts['room_photos'] += 1
+        self.counts['rooms'] = count
+        self._commit()
+
+    def create_reservations(self, count):
+        reservations = self.rb_root['Reservations'] = IOBTree()
+        rooms = list(self.rb_root['Rooms'].itervalues())
+        for i in xrange(1, count + 1):
+            start_dt = self._dt().replace(tzinfo=None)
+            weekly = self.random.random() < 0.2
+            end_dt = start_dt + (timedelta(weeks=4, hours=1) if weekly else timedelta(hours=1))
+            avatar = self.random.choice(self.avatars)
+            reservations[i] = _new('MaKaC.plugins.RoomBooking.default.reservation.Reservation', id=i,
+                                   room=self.random.choice(rooms), _utcCreatedDT=start_dt - timedelta(days=7),
+                                   _utcStartDT=start_dt, _utcEndDT=end_dt, repeatability=1 if weekly else None,
+                                   bookedForId=avatar.id, bookedForName='{} {}'.format(avatar.name, avatar.surName),
+                                   createdBy=avatar.id, isCancelled=False, isConfirmed=True, isRejected=False,
+                                   reason='Meeting')
+            if i % 1000 == 0:
+                self._commit()
+        self.counts['reservations'] = count
+        self._commit()
+
+
+@click.command()
+@click.argument('output-dir', type=click.Path(file_okay=False))
+@click.option('--avatars', type=click.IntRange(1), default=1000, show_default=True, help="Number of users")
+@click.option('--merged-ratio', type=float, default=0.02, show_default=True,
+              help="Fraction of users which have been merged into another user")
+@click.option('--groups', type=click.IntRange(0), default=20, show_default=True, help="Number of groups")
+@click.option('--categories', type=click.IntRange(1), default=50, show_default=True,
+              help="Number of categories (including the root category)")
+@click.option('--category-fanout', type=click.IntRange(1), default=5, show_default=True,
+              help="Number of subcategories per category")
+@click.option('--conferences', type=click.IntRange(0), default=300, show_default=True,
+              help="Number of events (meetings, lectures and conferences in equal parts)")
+@click.option('--contributions', type=click.IntRange(0), default=10, show_default=True,
+              help="Number of contributions per event")
+@click.option('--registrants', type=click.IntRange(0), default=20, show_default=True,
+              help="Number of registrants per conference")
+@click.option('--abstracts', type=click.IntRange(0), default=10, show_default=True,
+              help="Number of abstracts per conference")
+@click.option('--files', type=click.IntRange(0), default=1, show_default=True,
+              help="Number of attachment files per event and per contribution")
+@click.option('--file-size', type=click.IntRange(0), default=4096, show_default=True,
+              help="Size of each attachment file in bytes")
+@click.option('--duplicate-ratio', type=float, default=0, show_default=True,
+              help="Fraction of attachment files which have the same content as another one")
+@click.option('--rooms', type=click.IntRange(1), default=50, show_default=True, help="Number of rooms")
+@click.option('--room-photos/--no-room-photos', default=True, show_default=True, help="Create room photos")
+@click.option('--reservations', type=click.IntRange(0), default=2000, show_default=True,
+              help="Number of room reservations")
+@click.option('--seed', type=int, default=0, show_default=True, help="Seed for the random number generator")
+def main(output_dir, avatars, merged_ratio, groups, categories, category_fanout, conferences, contributions,
+         registrants, abstracts, files, file_size, duplicate_ratio, rooms, room_photos, reservations, seed):
+    if os.path.exists(output_dir) and os.listdir(output_dir):
+        raise click.UsageError('The output directory must be empty')
+    for path in ('archive', os.path.join('photos', 'large_photos'), os.path.join('photos', 'small_photos')):
+        if not os.path.exists(os.path.join(output_dir, path)):
+            os.makedirs(os.path.join(output_dir, path))
+
+    generator = FixtureGenerator(output_dir, seed, file_size, duplicate_ratio)
+    generator.create_globals()
+    print(cformat('%[cyan]Creating users and groups'))
+    generator.create_avatars(avatars, merged_ratio)
+    generator.create_groups(groups)
+    print(cformat('%[cyan]Creating categories'))
+    generator.create_categories(categories, category_fanout)
+    generator.create_conferences(conferences, contributions, registrants, abstracts, files)
+    generator.create_counters()
+    print(cformat('%[cyan]Creating rooms and reservations'))
+    generator.create_rooms(rooms, room_photos)
+    generator.create_reservations(reservations)
+    generator.close()
+
+    with open(os.path.join(output_dir, 'fixture.json'), 'wb') as f:
+        json.dump({'seed': seed, 'counts': generator.counts}, f, indent=2, sort_keys=True)
+    for name, count in sorted(generator.counts.iteritems()):
+        print(cformat('%[white!]{:>10}%[reset] {}').format(count, name))
+
+
+if __name__ == '__main__':
+    main()
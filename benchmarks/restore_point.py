@@ -0,0 +1,116 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+"""Compare the YAML and binary restore point formats.
+
+The restore point is built from the users and categories of an
+already-migrated database, the same way the global namespace looks
+after the user and category migration steps.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+import click
+import yaml
+
+from indico.core.db import db
+from indico.util.console import cformat
+
+from indico_migrate.logger import StdoutLogger
+from indico_migrate.migrate import _load_yaml_restore_point, setup
+from indico_migrate.namespaces import dump_restore_point, load_restore_point
+from indico_migrate.util import UnbreakingDB, get_storage
+
+
+click.disable_unicode_literals_warning = True
+
+
+def _build_restore_point(limit):
+    users = db.m.User.query.order_by(db.m.User.id).limit(limit).all()
+    categories = db.m.Category.query.all()
+    favorites = defaultdict(set)
+    for user in users:
+        for category in user.favorite_categories:
+            favorites[unicode(category.id)].add(user)
+    ns = {
+        'avatar_merged_user': {unicode(user.id): user for user in users},
+        'users_by_primary_email': {user.email: user for user in users},
+        'users_by_secondary_email': {email: user for user in users for email in user.secondary_emails},
+        'users_by_email': {email: user for user in users for email in user.all_emails},
+        'legacy_category_ids': {unicode(category.id): category for category in categories},
+        'user_favorite_categories': favorites
+    }
+    return {'namespaces': {'global_ns': ns}, 'steps': ['UserImporter', 'CategoryImporter']}
+
+
+def _measure(func, *args):
+    db.session.expunge_all()
+    start = time.time()
+    rv = func(*args)
+    return time.time() - start, rv
+
+
+@click.command()
+@click.argument('sqlalchemy-uri')
+@click.argument('zodb-uri')
+@click.option('--users', type=int, help="Only include the given number of users")
+def main(sqlalchemy_uri, zodb_uri, users):
+    logger = StdoutLogger(True)
+    zodb_root = UnbreakingDB(get_storage(zodb_uri, read_only=True, quiet=True)).open().root()
+    app, __ = setup(logger, zodb_root, sqlalchemy_uri, restore=True)
+    with app.app_context():
+        data = _build_restore_point(users)
+        print(cformat('%[white!]{}%[reset] users, %[white!]{}%[reset] categories').format(
+            len(data['namespaces']['global_ns']['avatar_merged_user']),
+            len(data['namespaces']['global_ns']['legacy_category_ids'])))
+
+        def _dump_yaml(fd):
+            yaml.dump(data, fd)
+
+        def _load_yaml(fd):
+            return _load_yaml_restore_point(logger, fd, zodb_root)
+
+        def _dump_binary(fd):
+            dump_restore_point(data, fd)
+
+        def _load_binary(fd):
+            return load_restore_point(fd, zodb_root)
+
+        for name, dump, load in (('YAML', _dump_yaml, _load_yaml), ('binary', _dump_binary, _load_binary)):
+            fd, path = tempfile.mkstemp(prefix='indico-migrate-restore-')
+            os.close(fd)
+            try:
+                with open(path, 'wb') as f:
+                    dump_time, __ = _measure(dump, f)
+                with open(path, 'rb') as f:
+                    load_time, loaded = _measure(load, f)
+                size = os.path.getsize(path)
+            finally:
+                os.unlink(path)
+            assert len(loaded['namespaces']['global_ns']['avatar_merged_user']) == \
+                len(data['namespaces']['global_ns']['avatar_merged_user'])
+            print(cformat('%[cyan!]{:<8}%[reset] size: %[white!]{:>10.1f} KiB%[reset]  save: %[white!]{:>8.2f}s'
+                          '%[reset]  load: %[white!]{:>8.2f}s%[reset]').format(
+                              name, size / 1024, dump_time, load_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+"""Migrate a benchmark fixture and record the throughput of each step.
+
+The fixture is created using ``fixtures.py``.  The migration runs in a
+separate process with ``--profile`` enabled, and the time spent in each
+top-level step is combined with the number of objects in the fixture.
+When a baseline from a previous run is given, steps which became slower
+than allowed are reported as regressions.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+
+import click
+
+from indico.core.db import db
+from indico.core.db.sqlalchemy.util.management import delete_all_tables
+from indico.util.console import cformat
+
+from indico_migrate.logger import StdoutLogger
+from indico_migrate.migrate import setup
+from indico_migrate.util import UnbreakingDB, get_storage
+
+
+click.disable_unicode_literals_warning = True
+
+# the fixture count used to calculate the throughput of each step
+STEP_ITEMS = OrderedDict([
+    ('GlobalPreEventsImporter', None),
+    ('UserImporter', 'avatars'),
+    ('RoomsLocationsImporter', 'rooms'),
+    ('CategoryImporter', 'categories'),
+    ('EventImporter', 'conferences'),
+    ('RoomBookingsImporter', 'reservations'),
+    ('GlobalPostEventsImporter', None),
+    ('EventSeriesImporter', 'conferences'),
+    ('GlobalBadgePosterImporter', None)
+])
+
+
+def _zodb_uri(path):
+    return 'file://{}'.format(os.path.abspath(path))
+
+
+def _reset_database(sqlalchemy_uri, fixture_dir):
+    zodb_root = UnbreakingDB(get_storage(_zodb_uri(os.path.join(fixture_dir, 'Data.fs')), read_only=True,
+                                         quiet=True)).open().root()
+    app, __ = setup(StdoutLogger(True), zodb_root, sqlalchemy_uri, restore=True)
+    with app.app_context():
+        delete_all_tables(db)
+    zodb_root._p_jar.db().close()
+
+
+def _run_migration(sqlalchemy_uri, fixture_dir, migrate_args, log):
+    tmpdir = tempfile.mkdtemp(prefix='indico-migrate-benchmark-')
+    profile_path = os.path.join(tmpdir, 'profile.txt')
+    args = [sys.executable, '-c', 'from indico_migrate.cli import main; main()',
+            sqlalchemy_uri, _zodb_uri(os.path.join(fixture_dir, 'Data.fs')),
+            '--rb-zodb-uri', _zodb_uri(os.path.join(fixture_dir, 'rb.fs')),
+            '--archive-dir', os.path.abspath(os.path.join(fixture_dir, 'archive')),
+            '--photo-path', os.path.abspath(os.path.join(fixture_dir, 'photos')),
+            '--storage-backend', 'legacy', '--default-email', 'noreply@example.com', '--default-currency', 'EUR',
+            '--no-gui', '--profile', profile_path] + list(migrate_args)
+    try:
+        subprocess.check_call(args, stdout=log, stderr=subprocess.STDOUT if log else None)
+        with open(profile_path + '.json', 'rb') as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def _get_results(profile, counts):
+    steps = OrderedDict()
+    for name, duration in profile['steps'].iteritems():
+        key = STEP_ITEMS.get(name)
+        items = counts.get(key, 0) if key else None
+        steps[name] = {'time': duration, 'items': items,
+                       'throughput': items / duration if items and duration else None}
+    event_steps = OrderedDict((step_id, {'time': data['time'], 'calls': data['calls']})
+                              for step_id, data in profile['event_steps'].iteritems())
+    return {'counts': counts, 'steps': steps, 'event_steps': event_steps, 'db_settings': profile.get('db_settings'),
+            'total': sum(step['time'] for step in steps.itervalues())}
+
+
+def _best_results(runs):
+    """Combine multiple runs, keeping the fastest time of each step."""
+    best = runs[0]
+    for results in runs[1:]:
+        for section in ('steps', 'event_steps'):
+            for name, data in results[section].iteritems():
+                if name not in best[section] or data['time'] < best[section][name]['time']:
+                    best[section][name] = data
+    best['total'] = sum(step['time'] for step in best['steps'].itervalues())
+    return best
+
+
+def _find_regressions(results, baseline, tolerance, min_time):
+    regressions = []
+    for section in ('steps', 'event_steps'):
+        for name, data in results[section].iteritems():
+            old = baseline[section].get(name)
+            if old is None or max(old['time'], data['time']) < min_time:
+                continue
+            if data['time'] > old['time'] * (1 + tolerance):
+                regressions.append((name, old['time'], data['time']))
+    return regressions
+
+
+def _print_results(results, baseline):
+    print(cformat('%[white!]{:<28} {:>10} {:>10} {:>12} {:>9}').format('step', 'time', 'items', 'items/s', 'change'))
+    for name, step in results['steps'].iteritems():
+        old = baseline['steps'].get(name) if baseline else None
+        change = '{:+.1%}'.format(step['time'] / old['time'] - 1) if old and old['time'] else ''
+        print('{:<28} {:>9.2f}s {:>10} {:>12} {:>9}'.format(
+            name, step['time'], step['items'] if step['items'] is not None else '',
+            '{:.1f}'.format(step['throughput']) if step['throughput'] else '', change))
+    print(cformat('%[white!]{:<28} {:>9.2f}s').format('total', results['total']))
+    print()
+    print(cformat('%[white!]{:<28} {:>10} {:>10} {:>12}').format('event step', 'time', 'calls', 'average'))
+    for step_id, step in results['event_steps'].iteritems():
+        print('{:<28} {:>9.2f}s {:>10} {:>11.4f}s'.format(step_id, step['time'], step['calls'],
+                                                          step['time'] / (step['calls'] or 1)))
+
+
+@click.command(context_settings={'ignore_unknown_options': True})
+@click.argument('sqlalchemy-uri')
+@click.argument('fixture-dir', type=click.Path(exists=True, file_okay=False))
+@click.argument('migrate-args', nargs=-1, type=click.UNPROCESSED)
+@click.option('--output', '-o', type=click.File('wb'), help="Save the results to the given JSON file")
+@click.option('--baseline', '-b', type=click.File('rb'), help="Compare the results with a previous JSON file")
+@click.option('--tolerance', type=float, default=0.1, show_default=True,
+              help="Relative slowdown of a step which is reported as a regression")
+@click.option('--min-time', type=float, default=1, show_default=True,
+              help="Ignore steps which take less than the given number of seconds")
+@click.option('--repeat', type=click.IntRange(1), default=1, show_default=True,
+              help="Run the migration multiple times and keep the fastest time of each step")
+@click.option('--reset', is_flag=True, help="Delete all tables in the database before each run")
+@click.option('--log', type=click.File('wb', lazy=False), help="Write the output of the migration to the given file")
+def main(sqlalchemy_uri, fixture_dir, migrate_args, output, baseline, tolerance, min_time, repeat, reset, log):
+    """Benchmark the migration of a fixture.
+
+    Any MIGRATE_ARGS are passed on to indico-migrate, e.g. to run the
+    benchmark with `--event-workers 4`.  The database needs to be empty
+    unless `--reset` is used.
+    """
+    if repeat > 1 and not reset:
+        raise click.UsageError('--repeat requires --reset')
+    with open(os.path.join(fixture_dir, 'fixture.json'), 'rb') as f:
+        counts = json.load(f)['counts']
+    runs = []
+    for i in xrange(repeat):
+        if reset:
+            _reset_database(sqlalchemy_uri, fixture_dir)
+        print(cformat('%[cyan]Running migration ({}/{})').format(i + 1, repeat))
+        runs.append(_get_results(_run_migration(sqlalchemy_uri, fixture_dir, migrate_args, log), counts))
+    results = _best_results(runs)
+    results['migrate_args'] = list(migrate_args)
+
+    baseline_results = json.load(baseline) if baseline else None
+    _print_results(results, baseline_results)
+    if output:
+        json.dump(results, output, indent=2)
+    if baseline_results:
+        regressions = _find_regressions(results, baseline_results, tolerance, min_time)
+        print()
+        if not regressions:
+            print(cformat('%[green!]No regressions'))
+            return
+        for name, old_time, new_time in regressions:
+            print(cformat('%[red!]Regression:%[reset] {} took %[white!]{:.2f}s%[reset] instead of {:.2f}s').format(
+                name, new_time, old_time))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, unicode_literals
+
+import mmap
+import os
+import stat
+import tempfile
+import threading
+import time
+from array import array
+from Queue import Queue
+
+
+class ArchiveIndex(object):
+    """An index of all files in the archive dirs.
+
+    Finding a legacy file with a non-ASCII name may take several
+    ``stat`` calls and a directory listing, which adds up to a lot of
+    round trips when the archive is on a network filesystem.  Instead,
+    the archive dirs are walked once at the beginning of the migration
+    (using multiple threads, which mostly wait for the filesystem) and
+    all lookups use the index.
+
+    The paths are stored sorted in an anonymous temporary file which is
+    memory-mapped, along with an array of their offsets.  This keeps the
+    index small and lets the event worker processes share it.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.directories = 0
+        self.errors = 0
+        self.duration = 0
+        self._file = None
+        self._data = None
+        self._offsets = None
+
+    @property
+    def enabled(self):
+        return self._offsets is not None
+
+    def build(self, archive_dirs, workers=4):
+        """Walk the archive dirs and build the index.
+
+        :param archive_dirs: The paths of the archive dirs
+        :param workers: The number of threads walking the directories
+        """
+        start = time.time()
+        entries = self._walk([os.path.normpath(bytes(path)) for path in archive_dirs], workers)
+        entries.sort()
+        self._file = tempfile.TemporaryFile(prefix='indico-migrate-archive-')
+        self._offsets = array(b'L')
+        pos = 0
+        for path, size, mtime in entries:
+            record = b'{}\0{}\0{!r}'.format(path, size, mtime)
+            self._offsets.append(pos)
+            self._file.write(record)
+            pos += len(record)
+        self._offsets.append(pos)
+        self._file.flush()
+        # an empty file cannot be mapped
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if pos else b''
+        self.files = len(entries)
+        self.duration = time.time() - start
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._data:
+            self._data.close()
+        self._file.close()
+        self._file = self._data = self._offsets = None
+
+    def format_stats(self):
+        msg = ('Indexed %[cyan]{}%[reset] files in %[cyan]{}%[reset] directories in {:.1f}s'
+               .format(self.files, self.directories, self.duration))
+        if self.errors:
+            msg += ' (%[yellow!]{}%[reset] directories could not be read)'.format(self.errors)
+        return msg
+
+    def exists(self, path):
+        """Check if a file exists, like `os.path.exists`."""
+        return self.stat(path) is not None
+
+    def stat(self, path):
+        """Get the size and modification time of a file.
+
+        :return: A ``(size, mtime)`` tuple or ``None`` if the file is not
+                 in the index
+        """
+        path = os.path.normpath(path)
+        i = self._bisect(path)
+        if i == len(self._offsets) - 1:
+            return None
+        record_path, size, mtime = self._get_record(i)
+        if record_path != path:
+            return None
+        return int(size), float(mtime)
+
+    def listdir(self, path):
+        """Get the names of the files and directories in a directory.
+
+        Unlike `os.listdir`, this does not fail if the directory does not
+        exist, and it does not include empty directories.
+        """
+        prefix = os.path.join(os.path.normpath(path), b'')
+        names = set()
+        for i in xrange(self._bisect(prefix), len(self._offsets) - 1):
+            record_path = self._get_record(i)[0]
+            if not record_path.startswith(prefix):
+                break
+            names.add(record_path[len(prefix):].split(b'/', 1)[0])
+        return sorted(names)
+
+    def _get_record(self, i):
+        return self._data[self._offsets[i]:self._offsets[i + 1]].split(b'\0')
+
+    def _bisect(self, path):
+        """Get the position of the first record whose path is not less than `path`."""
+        lo = 0
+        hi = len(self._offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get_record(mid)[0] < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _walk(self, archive_dirs, workers):
+        pending = Queue()
+        results = []
+        errors = []
+        lock = threading.Lock()
+        for path in archive_dirs:
+            pending.put((path, frozenset()))
+
+        def _process(path, parents, entries):
+            # symlinked directories are followed just like `os.path.exists` does, but one pointing to a
+            # directory containing it (identified by device and inode) would make us loop forever
+            try:
+                st = os.stat(path)
+                names = os.listdir(path)
+            except OSError:
+                return False
+            parents |= {(st.st_dev, st.st_ino)}
+            for name in names:
+                child = os.path.join(path, name)
+                try:
+                    st = os.stat(child)
+                except OSError:
+                    # broken symlink
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    if (st.st_dev, st.st_ino) not in parents:
+                        pending.put((child, parents))
+                else:
+                    entries.append((child, st.st_size, st.st_mtime))
+            return True
+
+        def _worker():
+            entries = []
+            directories = failed = 0
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+                try:
+                    if _process(item[0], item[1], entries):
+                        directories += 1
+                    else:
+                        failed += 1
+                except Exception as exc:
+                    with lock:
+                        errors.append(exc)
+                finally:
+                    # otherwise the caller would wait forever
+                    pending.task_done()
+            with lock:
+                results.extend(entries)
+                self.directories += directories
+                self.errors += failed
+
+        threads = [threading.Thread(target=_worker, name='archive-index-{}'.format(i)) for i in xrange(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        pending.join()
+        for thread in threads:
+            pending.put(None)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+
+archive_index = ArchiveIndex()
@@ -79,6 +79,14 @@ class AttachmentMixin(LocalFileImporterMixin):
                     else:
                         self.print_success('- %[cyan!]{}'.format(attachment.title))
 
+    def prefetch_attachments(self, obj, group=None):
+        """Start hashing the files attached to a legacy object."""
+        self.prefetch_local_files((resource
+                                   for material, resources in self._iter_attachments(obj)
+                                   for resource in resources
+                                   if resource.__class__.__name__ != 'Link'),
+                                  group=group)
+
     def _iter_event_materials(self):
         for material, resources in self._iter_attachments(self.conf):
             yield self.event, material, resources, {'event': self.event}
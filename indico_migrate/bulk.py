@@ -0,0 +1,439 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time
+from io import BytesIO
+from Queue import Queue
+
+from sqlalchemy import event, inspect
+
+from indico.core.db import db
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _format_array_item(value):
+    if value is None:
+        return 'NULL'
+    return '"{}"'.format(_format_scalar(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def _format_scalar(value):
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value)
+    elif isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
+def format_copy_value(value):
+    """Format a value for the text format of ``COPY``.
+
+    :param value: A value which has already been processed by the bind
+                  processor of its column type
+    """
+    if value is None:
+        return '\\N'
+    elif isinstance(value, (list, tuple)):
+        # bind processors return python lists for ARRAY columns; JSON values are already strings at this point
+        return _escape('{{{}}}'.format(','.join(_format_array_item(x) for x in value)))
+    return _escape(_format_scalar(value))
+
+
+class CopyPipelineError(Exception):
+    """Writing a batch of rows in the background failed.
+
+    :param writer: The `BulkWriter` the batch belongs to
+    :param rows: The number of rows in the batch
+    :param context: A description of what was being migrated when the
+                    batch was added, e.g. the conference
+    :param exc: The original exception
+    """
+
+    def __init__(self, writer, rows, context, exc):
+        where = ' ({})'.format(context) if context else ''
+        msg = 'Writing {} rows into {} failed{}: {!r}'.format(rows, writer.table.fullname, where, exc)
+        super(CopyPipelineError, self).__init__(msg)
+        self.context = context
+        self.original = exc
+
+
+class BulkWriter(object):
+    """Insert rows into a table using ``COPY FROM STDIN``.
+
+    Rows are buffered and written in the same transaction as everything
+    done through the ORM.  Before writing them, the session is flushed,
+    so rows may reference objects added using the ORM; any model
+    instance used as a value is replaced with its primary key.  Rows
+    referencing an object which has not been inserted yet (e.g. because
+    it has not been added to the session so far) are kept until it has
+    been inserted; if that did not happen by the time the transaction is
+    committed, an error is raised.
+
+    Columns which are not specified use their Python-side default, or
+    are left out of the ``COPY`` if they only have a server-side default.
+    The primary key of tables with a serial ``id`` column is taken from its
+    sequence when adding the row, so it can be referenced right away.
+
+    :param model: The model whose table the rows are inserted into
+    :param batch_size: The number of rows written using a single ``COPY``
+                       and the number of IDs taken from the sequence at
+                       once
+    :param pipeline: A `CopyPipeline` used to write the rows in the
+                     background
+    """
+
+    def __init__(self, model, batch_size=5000, pipeline=None):
+        self.model = model
+        self.table = model.__table__
+        self.batch_size = batch_size
+        self.pipeline = pipeline
+        self.columns = list(self.table.c)
+        self.rows = []
+        self.written = 0
+        self._deferred = []
+        self._statements = {}
+        self._ids = []
+        pk = list(self.table.primary_key)
+        if len(pk) == 1 and pk[0].autoincrement and isinstance(pk[0].type, db.Integer):
+            self.serial_column = pk[0]
+            self.sequence_name = '{}.{}_{}_seq'.format(self.table.schema, self.table.name, self.serial_column.name)
+        else:
+            self.serial_column = self.sequence_name = None
+
+    def add(self, **values):
+        """Add a row.
+
+        If the session is not inside a `no_autoflush` block, the rows are
+        written as soon as there are enough of them to fill a batch.
+        Otherwise they are written when the transaction is committed.
+
+        :return: The ID of the new row if the table has a serial ``id``
+                 column which has not been specified explicitly.
+        """
+        unknown = values.viewkeys() - {col.key for col in self.columns}
+        if unknown:
+            raise ValueError('Unknown columns for {}: {}'.format(self.table.fullname, ', '.join(sorted(unknown))))
+        rv = None
+        if self.serial_column is not None and values.get(self.serial_column.key) is None:
+            rv = values[self.serial_column.key] = self._next_id()
+        self.rows.append(values)
+        if len(self.rows) >= self.batch_size and db.session.autoflush:
+            self.flush()
+        return rv
+
+    def add_object(self, obj, **values):
+        """Add a row using the column attributes of a model instance.
+
+        This is meant for instances which are never added to the session
+        but only created to apply the logic of their model (e.g. attribute
+        listeners or password hashing).  Columns whose attribute has not
+        been set use their default.
+
+        :param obj: An instance of the writer's model
+        :param values: Values for columns which are not set on `obj`, e.g.
+                       foreign keys set using a relationship
+        """
+        mapper = inspect(self.model)
+        data = inspect(obj).dict
+        for column in self.columns:
+            key = mapper.get_property_by_column(column).key
+            if key in data:
+                values.setdefault(column.key, data[key])
+        return self.add(**values)
+
+    def flush(self, context=None, final=False):
+        """Write all buffered rows to the database.
+
+        When using a pipeline, the rows are only handed over to it and
+        written by its thread while we continue.
+
+        :param context: A description of what is being migrated, used
+                        when the pipeline fails to write the rows
+        :param final: Whether the transaction is about to be committed,
+                      so rows referencing an object which has not been
+                      inserted cannot be written anymore
+        """
+        if not self.rows and not self._deferred:
+            return
+        # rows may reference objects which have not been inserted yet
+        db.session.flush()
+        ready = []
+        deferred = []
+        for row in self._deferred + self.rows:
+            if all(inspect(value).persistent for value in row.itervalues() if isinstance(value, db.Model)):
+                ready.append(row)
+            else:
+                deferred.append(row)
+        self.rows = []
+        self._deferred = deferred
+        if final and deferred:
+            raise ValueError('{} rows for {} reference objects which have not been inserted: {!r}'
+                             .format(len(deferred), self.table.fullname, deferred[0]))
+        if not ready:
+            return
+        connection = db.session.connection().connection
+        batches = OrderedDict()
+        for row in ready:
+            columns = self._get_columns(row)
+            batches.setdefault(columns, []).append(self._get_values(columns, row))
+        for columns, rows in batches.iteritems():
+            for i in xrange(0, len(rows), self.batch_size):
+                if self.pipeline is not None:
+                    self.pipeline.put(self, connection, columns, rows[i:i + self.batch_size], context)
+                else:
+                    self.copy(connection, columns, rows[i:i + self.batch_size])
+        self.written += len(ready)
+
+    def copy(self, connection, columns, rows):
+        """Write rows using ``COPY``.
+
+        :param connection: The DBAPI connection to use
+        :param columns: The columns to write as returned by `_get_columns`
+        :param rows: A list of rows as returned by `_get_values`
+        """
+        sql, processors = self._prepare(columns)
+        buf = BytesIO()
+        for values in rows:
+            buf.write(self._format_row(values, processors).encode('utf-8'))
+        buf.seek(0)
+        connection.cursor().copy_expert(sql, buf)
+
+    def discard(self):
+        """Discard all buffered rows, e.g. after a rollback."""
+        # the sequence is not transactional, so the IDs we already got can still be used
+        self.rows = []
+        self._deferred = []
+
+    def _next_id(self):
+        if not self._ids:
+            query = db.text('SELECT nextval(:seq) FROM generate_series(1, :n)')
+            self._ids = [id_ for id_, in db.session.execute(query, {'seq': self.sequence_name, 'n': self.batch_size})]
+            self._ids.reverse()
+        return self._ids.pop()
+
+    def _prepare(self, columns):
+        try:
+            return self._statements[columns]
+        except KeyError:
+            pass
+        dialect = db.engine.dialect
+        preparer = dialect.identifier_preparer
+        sql = 'COPY {} ({}) FROM STDIN'.format(preparer.format_table(self.table),
+                                               ', '.join(preparer.quote(col.name) for col in columns))
+        processors = [col.type.dialect_impl(dialect).bind_processor(dialect) for col in columns]
+        rv = self._statements[columns] = sql, processors
+        return rv
+
+    def _get_columns(self, row):
+        # sending NULL for a column would bypass its server default
+        return tuple(col for col in self.columns
+                     if col.key in row or col.default is not None or col.server_default is None)
+
+    def _get_value(self, column, row):
+        try:
+            value = row[column.key]
+        except KeyError:
+            default = column.default
+            if default is None or default.is_sequence:
+                return None
+            return default.arg(None) if default.is_callable else default.arg
+        return value.id if isinstance(value, db.Model) else value
+
+    def _get_values(self, columns, row):
+        return [self._get_value(column, row) for column in columns]
+
+    def _format_row(self, values, processors):
+        formatted = []
+        for value, processor in zip(values, processors):
+            if processor is not None:
+                value = processor(value)
+            formatted.append(format_copy_value(value))
+        return '\t'.join(formatted) + '\n'
+
+
+class CopyPipeline(object):
+    """Write the rows of bulk writers in a background thread.
+
+    While a batch of rows is being formatted and sent to the database,
+    the migration can already continue reading the next objects from the
+    ZODB.  The batches are written using the connection of the
+    transaction they belong to, so they are still committed or rolled
+    back together with everything else.  psycopg2 does not let two
+    threads use a connection at the same time, so anything the session
+    sends to the database simply waits for the ``COPY`` in progress.
+
+    :param depth: The number of batches which may be waiting to be
+                  written; adding more batches blocks until one of them
+                  has been written
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.queue = Queue(maxsize=depth)
+        self.error = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='copy-pipeline')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """The number of batches waiting to be written."""
+        return self.queue.qsize()
+
+    def put(self, writer, connection, columns, rows, context=None):
+        self._check_error()
+        self.queue.put((self._generation, writer, connection, columns, rows, context))
+
+    def wait(self):
+        """Wait until all pending batches have been written."""
+        self.queue.join()
+        self._check_error()
+
+    def discard(self):
+        """Skip all pending batches, e.g. because of a rollback.
+
+        If a batch is being written, this waits until it is done, so
+        nothing is written after the transaction has been rolled back.
+        """
+        with self._lock:
+            self._generation += 1
+            self.error = None
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _check_error(self):
+        if self.error is not None:
+            # the transaction is broken anyway; it needs to be rolled back
+            raise self.error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                generation, writer, connection, columns, rows, context = item
+                with self._lock:
+                    if generation != self._generation or self.error is not None:
+                        continue
+                    try:
+                        writer.copy(connection, columns, rows)
+                    except Exception as exc:
+                        # by the time the error is raised we are probably migrating something else
+                        self.error = CopyPipelineError(writer, len(rows), context, exc)
+            finally:
+                self.queue.task_done()
+
+
+class BulkWriterRegistry(object):
+    """Keep track of the bulk writers of all tables.
+
+    The rows of all writers are written right before the session is
+    committed and discarded when it is rolled back.
+    """
+
+    def __init__(self):
+        self.writers = OrderedDict()
+        self.pipeline = None
+
+    def get(self, model):
+        try:
+            return self.writers[model]
+        except KeyError:
+            writer = self.writers[model] = BulkWriter(model, pipeline=self.pipeline)
+            return writer
+
+    def flush(self, context=None, final=False):
+        for writer in self.writers.itervalues():
+            writer.flush(context, final)
+
+    def wait(self):
+        """Wait until the pipeline has written everything."""
+        if self.pipeline is not None:
+            self.pipeline.wait()
+
+    def start_pipeline(self, depth):
+        """Write the rows of all writers using a `CopyPipeline`.
+
+        :param depth: The number of batches which may be waiting to be
+                      written
+        """
+        self.pipeline = CopyPipeline(depth)
+        for writer in self.writers.itervalues():
+            writer.pipeline = self.pipeline
+        if not event.contains(db.engine, 'rollback', _discard_pipeline):
+            event.listen(db.engine, 'rollback', _discard_pipeline)
+
+    def stop_pipeline(self, discard=False):
+        """Stop the pipeline once everything has been written.
+
+        :param discard: Whether to skip the pending batches instead,
+                        e.g. because the migration failed
+        """
+        if discard:
+            self.pipeline.discard()
+        self.pipeline.stop()
+        self.pipeline = None
+        for writer in self.writers.itervalues():
+            writer.pipeline = None
+
+    def reset(self):
+        """Forget all writers, e.g. in a child process.
+
+        The IDs which have already been taken from the sequences must not
+        be used by more than one process.
+        """
+        self.writers.clear()
+
+    def discard(self):
+        for writer in self.writers.itervalues():
+            writer.discard()
+
+
+bulk_writers = BulkWriterRegistry()
+
+
+@event.listens_for(db.session, 'before_commit')
+def _flush_bulk_writers(session):
+    bulk_writers.flush(final=True)
+    bulk_writers.wait()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_bulk_writers(session):
+    bulk_writers.discard()
+
+
+def _discard_pipeline(conn):
+    # rows which have not been written yet must not end up in the next transaction
+    if bulk_writers.pipeline is not None:
+        bulk_writers.pipeline.discard()
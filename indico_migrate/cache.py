@@ -0,0 +1,141 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, unicode_literals
+
+import resource
+import sys
+from collections import Counter
+
+
+def get_rss():
+    """Get the resident set size of the current process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # without procfs the peak RSS is the best we can get
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _get_storage_cache_stats(conn):
+    """Get the number of hits and misses of the ZEO client cache."""
+    cache = getattr(conn.db().storage, '_cache', None)
+    if cache is None or not hasattr(cache, 'getStats'):
+        return 0, 0
+    adds, __, __, __, accesses = cache.getStats()
+    # every record which is not in the cache is added to it after loading it from the server
+    return accesses, adds
+
+
+class ZODBCacheManager(object):
+    """Keep the ZODB object cache from using too much memory.
+
+    Without a memory limit, the cache is flushed every `flush_interval`
+    items.  Otherwise the memory usage of the process is checked every
+    `check_interval` items; when it gets close to the limit, the cache
+    is shrunk to its target size and, if this is not enough, all objects
+    in it are turned into ghosts.
+
+    Statistics about the cache are collected for each top-level step.
+
+    :param memory_limit: The maximum RSS of the process in bytes
+    :param check_interval: Number of items after which the memory usage
+                           is checked
+    :param flush_interval: Number of items after which the cache is
+                           flushed if there is no memory limit
+    :param threshold: The fraction of `memory_limit` at which the cache
+                      is shrunk
+    """
+
+    def __init__(self, memory_limit=None, check_interval=100, flush_interval=5000, threshold=0.9):
+        self.memory_limit = memory_limit
+        self.check_interval = check_interval
+        self.flush_interval = flush_interval
+        self.threshold = threshold
+        self.stats = Counter()
+        self._items = 0
+        self._floor = 0
+        self._step_start = None
+
+    def fork(self):
+        """Create a cache manager with the same settings but no statistics.
+
+        This is meant to be used in a child process, whose statistics
+        are then merged into the ones of the parent process.
+        """
+        return ZODBCacheManager(self.memory_limit, self.check_interval, self.flush_interval, self.threshold)
+
+    def tick(self, conn):
+        """Shrink the cache of `conn` if needed; called after each item."""
+        self._items += 1
+        if self.memory_limit is None:
+            if self._items % self.flush_interval == 0:
+                conn.sync()
+                self.stats['flushes'] += 1
+            return
+        elif self._items % self.check_interval:
+            return
+        rss = get_rss()
+        self.stats['peak_rss'] = max(self.stats['peak_rss'], rss)
+        # memory freed by python is not always returned to the OS, so we only act
+        # if the process grew since the last time we shrunk the cache
+        limit = self.memory_limit * self.threshold
+        if rss < limit or rss < self._floor + self.memory_limit * (1 - self.threshold) / 2:
+            return
+        conn.cacheGC()
+        self.stats['gcs'] += 1
+        rss = get_rss()
+        if rss >= limit:
+            conn.cacheMinimize()
+            self.stats['minimizations'] += 1
+            rss = get_rss()
+        self._floor = rss
+
+    def _snapshot(self, conn):
+        hits, misses = _get_storage_cache_stats(conn)
+        return Counter({'loads': conn._load_count, 'storage_cache_hits': hits, 'storage_cache_misses': misses})
+
+    def start_step(self, conn):
+        self.stats = Counter()
+        self._step_start = self._snapshot(conn)
+
+    def end_step(self, conn):
+        """Get the statistics of the current step."""
+        stats = self._snapshot(conn)
+        stats.subtract(self._step_start)
+        stats.update(self.stats)
+        stats['peak_rss'] = max(self.stats['peak_rss'], get_rss())
+        stats['cached_objects'] = conn._cache.cache_non_ghost_count
+        return dict(stats)
+
+    def export(self, conn):
+        """Export the statistics collected so far, e.g. to send them to another process."""
+        return self.end_step(conn)
+
+    def merge(self, data):
+        """Merge statistics exported by another cache manager."""
+        for key in ('loads', 'storage_cache_hits', 'storage_cache_misses', 'flushes', 'gcs', 'minimizations'):
+            self.stats[key] += data.get(key, 0)
+
+    @staticmethod
+    def format_stats(stats):
+        return ('ZODB cache: %[cyan]{}%[reset] objects loaded, %[cyan]{}%[reset] storage cache hits, '
+                '%[cyan]{}%[reset] misses, {} GCs, {} minimizations, peak RSS %[cyan]{:.1f}%[reset] MiB'
+                .format(stats.get('loads', 0), stats.get('storage_cache_hits', 0),
+                        stats.get('storage_cache_misses', 0), stats.get('gcs', 0), stats.get('minimizations', 0),
+                        stats.get('peak_rss', 0) / 1024 / 1024))
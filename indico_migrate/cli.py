@@ -61,6 +61,10 @@ def except_hook(exc_class, exception, tb):
 @click.option('--rb-zodb-uri', required=False, help="ZODB URI for the room booking database")
 @click.option('--photo-path', type=click.Path(exists=True, file_okay=False),
               help="path to the folder containing room photos")
+@click.option('--photo-workers', type=click.IntRange(1), default=4,
+              help="Number of threads reading room photos (and of processes generating thumbnails)")
+@click.option('--regenerate-thumbnails', is_flag=True, default=False,
+              help="Generate the missing thumbnails of rooms which have a large photo")
 @click.option('--reference-type', 'reference_types', multiple=True,
               help="Reference types ('report numbers'). Can be used multiple times to specify multiple reference types")
 @click.option('--default-currency', required=True, help="currency unit to use by default")
@@ -68,10 +72,72 @@ def except_hook(exc_class, exception, tb):
               help="Migrate broken events that have no category and would usually be skipped. "
                    "They will be added to a new 'Lost & Found' top-level category which needs to be checked "
                    "(and possibly deleted) manually.")
+@click.option('--user-workers', type=click.IntRange(1), default=1,
+              help="Number of processes used to convert the legacy users. Each process reads its own chunks of "
+                   "avatars using a separate ZODB connection.")
+@click.option('--dedup-files', is_flag=True, default=False,
+              help="Let all migrated files with the same content use the storage file (or symlink) of the first of "
+                   "them instead of their own one")
+@click.option('--archive-index-workers', type=click.IntRange(0), default=0,
+              help="Number of threads used to build an index of all files in the archive dirs before migrating "
+                   "anything (0 to look up each file on disk when needed)")
+@click.option('--hash-workers', type=click.IntRange(0), default=0,
+              help="Number of threads computing the size and checksum of archived files in the background (0 to "
+                   "compute them when needed)")
+@click.option('--checksum-cache', type=click.Path(dir_okay=False),
+              help="File in which the checksums of archived files are kept between migrations. Files whose size and "
+                   "modification time did not change since a previous run are not read again.")
+@click.option('--image-workers', type=click.IntRange(0), default=0,
+              help="Number of processes used to convert category icons and event logos while the migration "
+                   "continues (0 to convert them in the migration process)")
+@click.option('--event-workers', type=click.IntRange(1), default=1,
+              help="Number of processes used to migrate events. Each process migrates a range of conference IDs "
+                   "using its own ZODB and database connections.")
+@click.option('--prefetch-events', type=click.IntRange(0), default=0,
+              help="Number of upcoming conferences whose data is loaded from the ZODB in a background thread while "
+                   "migrating events. This is mostly useful with a ZEO server.")
+@click.option('--prescan', type=click.File('rb'),
+              help="JSON file created by indico-migrate-prescan. The estimated amount of work of each conference is "
+                   "used for the progress of the event migration and to balance the --event-workers.")
+@click.option('--storage-order', is_flag=True, default=False,
+              help="Migrate users and events in the order in which they are stored in the ZODB file instead of by ID. "
+                   "This turns most reads into sequential ones but only works with a FileStorage.")
+@click.option('--pipeline-depth', type=click.IntRange(0), default=0,
+              help="Number of batches of rows which may wait to be written to the database by a background thread "
+                   "while the next events are read from the ZODB")
+@click.option('--timetable-check-workers', type=click.IntRange(0), default=1,
+              help="Number of connections used to check the consistency of all timetables after migrating the "
+                   "events (0 to skip the check)")
+@click.option('--memory-limit', type=click.IntRange(1),
+              help="Memory (in MiB) each migration process should stay below. The ZODB cache is shrunk whenever the "
+                   "memory usage gets close to it instead of flushing it every 5000 items.")
+@click.option('--fast-load', is_flag=True, default=False,
+              help="Drop all secondary indexes and foreign keys before migrating the data and recreate them at the "
+                   "end of the migration")
+@click.option('--index-workers', type=click.IntRange(1), default=4,
+              help="Number of indexes to create at the same time at the end of a --fast-load migration")
+@click.option('--fast-session', is_flag=True, default=False,
+              help="Use database settings which speed up loading lots of data (e.g. synchronous_commit=off) and send "
+                   "batched inserts in a single round trip")
+@click.option('--pg-setting', 'pg_settings', multiple=True, metavar='NAME=VALUE',
+              help="Additional PostgreSQL setting to use with --fast-session. Can be used multiple times.")
+@click.option('--delta-state', type=click.Path(dir_okay=False),
+              help="Save the migration state to the given file after a successful migration and record the serials "
+                   "of all conferences, so that later runs can use --delta")
+@click.option('--delta', is_flag=True, default=False,
+              help="Reuse an already-migrated database and only migrate the events of conferences which are new or "
+                   "have changed since the migration which saved --delta-state")
+@click.option('--profile', type=click.Path(dir_okay=False),
+              help="Measure the time spent in each migration step and write a report to the given file (and a JSON "
+                   "version of it to FILE.json) when the migration ends")
+@click.option('--profile-python', is_flag=True, default=False,
+              help="Also collect cProfile data while running the migration steps and save it to FILE.prof")
+@click.option('--profile-slowest', type=click.IntRange(1), default=10,
+              help="Number of slowest conferences to list for each event migration step")
 @click.option('--debug', is_flag=True, default=False, help="Open debug shell if there is an error")
 @click.option('--no-gui', is_flag=True, default=False, help="Don't run the GUI")
-@click.option('--save-restore', type=click.File('w'), help="Save a restore point to the given file in case of failure")
-@click.option('--restore-file', type=click.File('r'), help="Restore migration from a file (enables debug)")
+@click.option('--save-restore', type=click.File('wb'), help="Save a restore point to the given file in case of failure")
+@click.option('--restore-file', type=click.File('rb'), help="Restore migration from a file (enables debug)")
 def cli(sqlalchemy_uri, zodb_uri, rb_zodb_uri, verbose, dblog, debug, restore_file, no_gui, **kwargs):
     """
     This script migrates your database from ZODB/Indico 1.2 to PostgreSQL (2.0).
@@ -82,6 +148,24 @@ def cli(sqlalchemy_uri, zodb_uri, rb_zodb_uri, verbose, dblog, debug, restore_fi
 
     from indico_migrate.importer import Importer
 
+    if kwargs['delta'] and not kwargs['delta_state']:
+        raise click.UsageError('--delta requires --delta-state')
+    if kwargs['delta'] and restore_file:
+        raise click.UsageError('--delta cannot be used together with --restore-file')
+    if kwargs['delta'] and kwargs['fast_load']:
+        raise click.UsageError('--delta cannot be used together with --fast-load')
+    if kwargs['pg_settings'] and not kwargs['fast_session']:
+        raise click.UsageError('--pg-setting requires --fast-session')
+    try:
+        kwargs['pg_settings'] = dict(setting.split('=', 1) for setting in kwargs['pg_settings'])
+    except ValueError:
+        raise click.UsageError('--pg-setting must be NAME=VALUE')
+    if kwargs['profile_python'] and not kwargs['profile']:
+        raise click.UsageError('--profile-python requires --profile')
+    if kwargs['dedup_files'] and kwargs['avoid_storage_check']:
+        raise click.UsageError('--dedup-files needs the checksums of the files, so it cannot be used together with '
+                               '--avoid-storage-check')
+
     if restore_file:
         debug = True
 
@@ -118,8 +202,8 @@ def cli(sqlalchemy_uri, zodb_uri, rb_zodb_uri, verbose, dblog, debug, restore_fi
     else:
         logger = StdoutLogger(not verbose)
 
-    migrate(logger, zodb_root, rb_zodb_uri, sqlalchemy_uri, verbose=verbose, dblog=dblog, restore_file=restore_file,
-            debug=debug, **kwargs)
+    migrate(logger, zodb_root, rb_zodb_uri, sqlalchemy_uri, zodb_uri=zodb_uri, verbose=verbose, dblog=dblog,
+            restore_file=restore_file, debug=debug, **kwargs)
 
 
 def main():
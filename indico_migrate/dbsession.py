@@ -0,0 +1,88 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from psycopg2.extras import execute_batch
+from sqlalchemy import event
+
+
+#: Settings used by all connections of a ``--fast-session`` migration.
+#: Nothing in the migration needs a commit to survive a crash of the
+#: database server: a failed migration has to be resumed anyway.
+FAST_SESSION_SETTINGS = OrderedDict([
+    ('synchronous_commit', 'off'),
+    ('work_mem', '64MB'),
+    ('maintenance_work_mem', '1GB'),
+])
+
+
+class FastSessionProfile(object):
+    """Apply load-friendly settings to the database connections.
+
+    The settings are applied to every connection of the engine, and
+    `executemany` calls (used by SQLAlchemy when inserting multiple rows
+    whose primary keys are known) send the rows in pages instead of
+    using one round trip per row.
+
+    :param settings: A dict of PostgreSQL settings to apply in addition
+                     to (or instead of) `FAST_SESSION_SETTINGS`
+    :param page_size: The number of rows sent at once by `executemany`
+    """
+
+    def __init__(self, settings=None, page_size=100):
+        self.settings = OrderedDict(FAST_SESSION_SETTINGS)
+        self.settings.update(settings or {})
+        self.page_size = page_size
+        self.before = None
+        self.after = None
+
+    def apply(self, engine):
+        """Apply the profile to all connections of `engine`."""
+        self.before = self._get_settings(engine)
+        event.listen(engine, 'connect', self._on_connect)
+        # connections which have already been opened do not have the settings yet
+        engine.dispose()
+        engine.dialect.do_executemany = self._do_executemany
+        # only the row count of the last page is available
+        engine.dialect.supports_sane_multi_rowcount = False
+        self.after = self._get_settings(engine)
+
+    def get_report(self):
+        return OrderedDict((name, {'before': self.before[name], 'after': self.after[name]})
+                           for name in self.settings)
+
+    def format_report(self):
+        return '\n'.join('{:<24} {:>12} -> %[cyan]{}%[reset]'.format(name, data['before'], data['after'])
+                         for name, data in self.get_report().iteritems())
+
+    def _get_settings(self, engine):
+        with engine.connect() as conn:
+            return OrderedDict((name, conn.execute('SELECT current_setting(%s)', (name,)).scalar())
+                               for name in self.settings)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in self.settings.iteritems():
+            cursor.execute('SELECT set_config(%s, %s, false)', (name, value))
+        cursor.close()
+        # otherwise the settings would be lost when the pool rolls back the connection
+        dbapi_connection.commit()
+
+    def _do_executemany(self, cursor, statement, parameters, context=None):
+        execute_batch(cursor, statement, parameters, page_size=self.page_size)
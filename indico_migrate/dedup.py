@@ -0,0 +1,84 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, unicode_literals
+
+from collections import Counter
+
+
+class ContentIndex(object):
+    """Keep track of archived files with the same content.
+
+    Files are identified by their MD5 checksum and size.  The first file
+    with a given content is the canonical one; all other files with the
+    same content are counted as duplicates.
+
+    :param deduplicate: Whether duplicates should use the storage file of
+                        the canonical file instead of their own one
+    """
+
+    def __init__(self, deduplicate=False):
+        self.deduplicate = deduplicate
+        self.stats = Counter()
+        self._files = {}
+
+    def find(self, md5, size):
+        """Get the storage location of the canonical file with some content.
+
+        :return: A ``(storage_backend, storage_file_id)`` tuple or ``None``
+        """
+        return self._files.get((md5, size))
+
+    def add(self, md5, size, location):
+        """Register a migrated file.
+
+        :param md5: The MD5 checksum of the file
+        :param size: The size of the file
+        :param location: A ``(storage_backend, storage_file_id)`` tuple
+        """
+        self.stats['files'] += 1
+        self.stats['bytes'] += size
+        if (md5, size) in self._files:
+            self.stats['duplicates'] += 1
+            self.stats['duplicate_bytes'] += size
+        else:
+            self._files[(md5, size)] = location
+
+    def fork(self):
+        """Prepare the index for being used in a child process.
+
+        The statistics collected so far belong to the parent process.
+        """
+        self.stats = Counter()
+
+    def export(self):
+        """Export the statistics, e.g. to send them to another process."""
+        return dict(self.stats)
+
+    def merge(self, data):
+        """Merge statistics exported by the index of another process."""
+        self.stats.update(data)
+
+    def format_stats(self):
+        msg = ('Archived files: %[cyan]{}%[reset] files ({:.1f} MiB), %[cyan]{}%[reset] of them duplicates '
+               '({:.1f} MiB)').format(self.stats['files'], self.stats['bytes'] / 1024 / 1024,
+                                      self.stats['duplicates'], self.stats['duplicate_bytes'] / 1024 / 1024)
+        if self.deduplicate:
+            return msg + '; %[green!]the duplicates use the storage files of the first file with the same content'
+        return msg + '; these could be saved using --dedup-files'
+
+
+content_index = ContentIndex()
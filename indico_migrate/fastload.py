@@ -0,0 +1,173 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import threading
+import time
+from Queue import Empty, Queue
+
+from indico.core.db import db
+
+
+# indexes which are neither unique nor used by a constraint
+_INDEX_QUERY = '''
+    SELECT quote_ident(n.nspname) || '.' || quote_ident(i.relname), pg_get_indexdef(i.oid)
+    FROM pg_index x
+    JOIN pg_class i ON (i.oid = x.indexrelid)
+    JOIN pg_class t ON (t.oid = x.indrelid)
+    JOIN pg_namespace n ON (n.oid = t.relnamespace)
+    WHERE n.nspname IN :schemas AND NOT x.indisprimary AND NOT x.indisunique AND
+          NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+    ORDER BY 1
+'''
+
+# foreign keys which only check the references; the ones which cascade
+# deletes or updates (or set the references to NULL or their default) are
+# kept, since dropping them would leave orphaned rows behind
+_FOREIGN_KEY_QUERY = '''
+    SELECT quote_ident(n.nspname) || '.' || quote_ident(t.relname), quote_ident(c.conname),
+           pg_get_constraintdef(c.oid)
+    FROM pg_constraint c
+    JOIN pg_class t ON (t.oid = c.conrelid)
+    JOIN pg_namespace n ON (n.oid = t.relnamespace)
+    WHERE n.nspname IN :schemas AND c.contype = 'f' AND
+          c.confdeltype IN ('a', 'r') AND c.confupdtype IN ('a', 'r')
+    ORDER BY 1, 2
+'''
+
+
+class DeferredSchemaObjects(object):
+    """Drop secondary indexes and foreign keys while loading the data.
+
+    Maintaining the indexes and checking the foreign keys on every
+    insert is much more expensive than creating them once all the data
+    is there.  Primary keys and unique indexes are kept since the
+    migration relies on them, and so are foreign keys with an action
+    (e.g. ``ON DELETE CASCADE``) since rows deleted during the migration
+    (e.g. an unused Lost & Found category) rely on them as well.
+
+    The statements needed to recreate everything are stored in a table,
+    so the objects are also recreated when resuming a failed migration.
+
+    :param logger: The logger used to report the progress
+    """
+
+    table = 'indico_migrate_deferred_ddl'
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.schemas = tuple(sorted({table.schema for table in db.metadata.tables.itervalues() if table.schema}))
+
+    def has_pending(self):
+        """Check if there are objects which need to be recreated."""
+        if not db.engine.execute(db.text('SELECT to_regclass(:table)'), table=self.table).scalar():
+            return False
+        return db.engine.execute(db.text('SELECT EXISTS (SELECT 1 FROM {})'.format(self.table))).scalar()
+
+    def drop(self):
+        # an open transaction would keep us from getting the locks needed to drop anything
+        db.session.commit()
+        start = time.time()
+        with db.engine.begin() as conn:
+            conn.execute(db.text('CREATE TABLE IF NOT EXISTS {} (name VARCHAR PRIMARY KEY, kind VARCHAR NOT NULL, '
+                                 'definition VARCHAR NOT NULL)'.format(self.table)))
+            objects = []
+            for table, name, definition in conn.execute(db.text(_FOREIGN_KEY_QUERY), schemas=self.schemas):
+                objects.append(('{}.{}'.format(table, name), 'constraint',
+                                'ALTER TABLE {} ADD CONSTRAINT {} {}'.format(table, name, definition),
+                                'ALTER TABLE {} DROP CONSTRAINT {}'.format(table, name)))
+            for name, definition in conn.execute(db.text(_INDEX_QUERY), schemas=self.schemas):
+                objects.append((name, 'index', definition, 'DROP INDEX {}'.format(name)))
+            for name, kind, definition, drop in objects:
+                conn.execute(db.text('INSERT INTO {} (name, kind, definition) VALUES (:name, :kind, :definition)'
+                                     .format(self.table)), name=name, kind=kind, definition=definition)
+                conn.execute(drop)
+        self.logger.print_info('Dropped %[cyan]{}%[reset] indexes and %[cyan]{}%[reset] foreign keys in {:.1f}s'
+                               .format(sum(1 for x in objects if x[1] == 'index'),
+                                       sum(1 for x in objects if x[1] == 'constraint'), time.time() - start),
+                               always=True)
+
+    def rebuild(self, workers=4):
+        """Recreate all dropped objects.
+
+        Indexes are created in parallel, using one connection for each
+        of them.  Foreign keys are added afterwards, one at a time, since
+        adding them locks both tables involved.
+
+        :param workers: The number of indexes created at the same time
+        :return: ``True`` if everything has been recreated
+        """
+        db.session.commit()
+        rows = db.engine.execute(db.text('SELECT name, kind, definition FROM {} ORDER BY name'
+                                         .format(self.table))).fetchall()
+        indexes = [(name, definition) for name, kind, definition in rows if kind == 'index']
+        constraints = [(name, definition) for name, kind, definition in rows if kind == 'constraint']
+        start = time.time()
+        self.logger.print_info('Creating %[cyan]{}%[reset] indexes using {} connections'
+                               .format(len(indexes), workers), always=True)
+        failed = self._run_parallel(indexes, workers)
+        self.logger.print_info('Adding %[cyan]{}%[reset] foreign keys'.format(len(constraints)), always=True)
+        failed += self._run_parallel(constraints, 1)
+        if not failed:
+            db.engine.execute(db.text('DROP TABLE {}'.format(self.table)))
+            self.logger.print_success('Recreated all indexes and foreign keys in %[cyan]{:.1f}s'
+                                      .format(time.time() - start), always=True)
+            return True
+        self.logger.print_error('%[red!]{} indexes or foreign keys could not be created; they are recreated when '
+                                'running the migration again'.format(failed))
+        return False
+
+    def _run_parallel(self, objects, workers):
+        """Execute the definitions of `objects` in parallel and report the time each one takes."""
+        engine = db.engine
+        pending = Queue()
+        for obj in objects:
+            pending.put(obj)
+        results = Queue()
+
+        def _worker():
+            while True:
+                try:
+                    name, definition = pending.get_nowait()
+                except Empty:
+                    return
+                start = time.time()
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(definition)
+                        conn.execute(db.text('DELETE FROM {} WHERE name = :name'.format(self.table)), name=name)
+                except Exception as exc:
+                    results.put((name, time.time() - start, exc))
+                else:
+                    results.put((name, time.time() - start, None))
+
+        threads = [threading.Thread(target=_worker, name='index-worker-{}'.format(i)) for i in xrange(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        failed = 0
+        for __ in objects:
+            name, duration, error = results.get()
+            if error is None:
+                self.logger.print_success('Created %[cyan]{}%[reset] in {:.1f}s'.format(name, duration), always=True)
+            else:
+                failed += 1
+                self.logger.print_error('%[red!]Could not create %[reset]%[red]{}%[red!]:%[reset] {}'
+                                        .format(name, error))
+        for thread in threads:
+            thread.join()
+        return failed
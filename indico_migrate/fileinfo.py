@@ -0,0 +1,320 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, unicode_literals
+
+import hashlib
+import os
+import threading
+from collections import Counter, defaultdict
+from Queue import Queue
+
+from indico_migrate.archive import archive_index
+
+
+def get_file_md5(path, chunk_size=1024*1024):
+    checksum = hashlib.md5()
+    with open(path, 'rb') as fileobj:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            checksum.update(chunk)
+    return unicode(checksum.hexdigest())
+
+
+class ChecksumCache(object):
+    """Remember the checksums of archived files across migrations.
+
+    The checksums are stored in an append-only file, with one line for
+    each file that has been hashed.  A checksum is only used as long as
+    the size and modification time of the file are still the same;
+    otherwise the file is hashed again and a new line is appended.
+
+    The file is opened in append mode and every line is written at once,
+    so the event worker processes can share it.
+
+    :param path: The path of the cache file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stats = Counter()
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+    def open(self):
+        """Load the cached checksums and open the file for appending."""
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        md5, size, mtime, path = line.rstrip(b'\n').split(b'\t', 3)
+                        self._entries[path.decode('string_escape')] = (int(size), float(mtime), md5.decode('ascii'))
+                    except ValueError:
+                        # most likely the last line of a migration which was killed
+                        continue
+        self._file = open(self.path, 'ab')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def fork(self):
+        """Prepare the cache for being used in a child process.
+
+        The statistics collected so far belong to the parent process.
+        """
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def get(self, path, size, mtime, record_stats=True):
+        """Get the checksum of a file if it has not changed.
+
+        :param path: The path of the file
+        :param size: The current size of the file
+        :param mtime: The current modification time of the file
+        :param record_stats: Whether to count the lookup as a hit or miss
+        :return: The MD5 checksum or ``None``
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[:2] == (size, mtime):
+                if record_stats:
+                    self.stats['hits'] += 1
+                    self.stats['bytes_saved'] += size
+                return entry[2]
+            if record_stats:
+                self.stats['misses'] += 1
+            return None
+
+    def add(self, path, size, mtime, md5):
+        line = b'\t'.join([md5.encode('ascii'), bytes(size), repr(mtime), path.encode('string_escape')]) + b'\n'
+        with self._lock:
+            self._entries[path] = (size, mtime, md5)
+            self._file.write(line)
+            # a partially buffered line would end up being written by a child process as well
+            self._file.flush()
+
+    def export(self):
+        """Export the statistics, e.g. to send them to another process."""
+        return dict(self.stats)
+
+    def merge(self, data):
+        """Merge statistics exported by the cache of another process."""
+        self.stats.update(data)
+
+    def format_stats(self):
+        return ('Checksum cache: %[cyan]{}%[reset] hits, %[cyan]{}%[reset] misses, %[cyan]{:.1f}%[reset] MiB not read'
+                .format(self.stats['hits'], self.stats['misses'], self.stats['bytes_saved'] / 1024 / 1024))
+
+
+class FileInfoService(object):
+    """Get the size and MD5 checksum of archived files in the background.
+
+    Files can be submitted as soon as their paths are known (e.g. for
+    upcoming conferences) and are hashed by a pool of threads, which
+    spend most of their time waiting for the disk anyway.  When the
+    migration needs the information of a file, it only waits for it if
+    it is not ready yet; files which have not been submitted are hashed
+    right away.  Files can be submitted as part of a group (e.g. the
+    conference they belong to), so the information of files which were
+    never requested can be dropped once the group has been migrated.
+
+    :param workers: The number of threads hashing files; with ``0``
+                    files are only hashed when their information is
+                    requested
+    :param chunk_size: The size of the buffer used to read the files
+    :param checksum_cache: A `ChecksumCache` used to avoid hashing files
+                           which have not changed since a previous run
+    """
+
+    def __init__(self, workers=0, chunk_size=8 * 1024 * 1024, checksum_cache=None):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.checksum_cache = checksum_cache
+        self._reset()
+
+    @property
+    def enabled(self):
+        """Whether submitted files are hashed in the background."""
+        return bool(self._threads)
+
+    def start(self, workers=None):
+        """Start the threads hashing the submitted files.
+
+        :param workers: The number of threads to use instead of the one
+                        specified when creating the service
+        """
+        if workers is not None:
+            self.workers = workers
+        for i in xrange(self.workers):
+            thread = threading.Thread(target=self._run, name='file-info-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for __ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._reset()
+
+    def reset(self):
+        """Forget all submitted files and start new threads.
+
+        This is needed in a child process since threads do not survive
+        a fork.
+        """
+        self._reset()
+        if self.checksum_cache is not None:
+            self.checksum_cache.fork()
+        self.start()
+
+    def submit(self, path, group=None):
+        """Start hashing a file in the background.
+
+        :param path: The path of the file
+        :param group: The group the file belongs to, see `discard`
+        """
+        if not self.enabled:
+            return
+        with self._condition:
+            if group is not None:
+                self._owners[path] = group
+                self._groups[group].add(path)
+            # it may still be needed by a later group
+            self._dropped.discard(path)
+            if path in self._results:
+                return
+            self._results[path] = None
+        self._queue.put(path)
+
+    def discard(self, group):
+        """Forget the files of a group which have not been requested.
+
+        Files which have been submitted again by another group since
+        then are kept.
+
+        :param group: The group passed to `submit`
+        """
+        with self._condition:
+            for path in self._groups.pop(group, ()):
+                if self._owners.get(path) != group:
+                    continue
+                del self._owners[path]
+                if path not in self._results:
+                    continue
+                elif self._results[path] is None:
+                    # still being hashed; the worker drops the result
+                    self._dropped.add(path)
+                else:
+                    del self._results[path]
+
+    def get(self, path):
+        """Get the size and checksum of a file.
+
+        Errors (e.g. a missing file) are raised just like when reading
+        the file directly, even if they happened in a worker thread.
+
+        :param path: The path of the file
+        :return: A ``(size, md5)`` tuple
+        """
+        with self._condition:
+            submitted = path in self._results
+            self._dropped.discard(path)
+            while submitted and self._results[path] is None:
+                self._condition.wait()
+            if submitted:
+                size, md5, error = self._results.pop(path)
+                self._owners.pop(path, None)
+        if not submitted:
+            return self._get_info(path)
+        if error is not None:
+            raise error
+        return size, md5
+
+    def peek(self, path):
+        """Get the checksum of a file if it is known without reading it.
+
+        This is the case if the file has already been hashed in the
+        background or if its checksum is in the checksum cache.
+
+        :param path: The path of the file
+        :return: The MD5 checksum or ``None``
+        """
+        with self._condition:
+            result = self._results.get(path)
+        if result is not None and result[2] is None:
+            return result[1]
+        if self.checksum_cache is None:
+            return None
+        try:
+            size, mtime = self._stat(path)
+        except OSError:
+            return None
+        return self.checksum_cache.get(path, size, mtime, record_stats=False)
+
+    def _reset(self):
+        self._queue = Queue()
+        self._condition = threading.Condition()
+        self._results = {}
+        self._owners = {}
+        self._groups = defaultdict(set)
+        self._dropped = set()
+        self._threads = []
+
+    def _stat(self, path):
+        info = archive_index.stat(path) if archive_index.enabled else None
+        if info is None:
+            st = os.stat(path)
+            info = st.st_size, st.st_mtime
+        return info
+
+    def _get_info(self, path):
+        size, mtime = self._stat(path)
+        md5 = self.checksum_cache.get(path, size, mtime) if self.checksum_cache is not None else None
+        if md5 is None:
+            md5 = get_file_md5(path, self.chunk_size)
+            if self.checksum_cache is not None:
+                self.checksum_cache.add(path, size, mtime, md5)
+        return size, md5
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            try:
+                size, md5 = self._get_info(path)
+            except Exception as exc:
+                # raised by `get`; the thread must keep going or `get` would wait forever
+                result = None, None, exc
+            else:
+                result = size, md5, None
+            with self._condition:
+                if path in self._dropped:
+                    self._dropped.remove(path)
+                    del self._results[path]
+                else:
+                    self._results[path] = result
+                self._condition.notify_all()
+
+
+file_info = FileInfoService()
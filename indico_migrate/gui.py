@@ -113,14 +113,18 @@ class GUILogger(BaseLogger):
         self.gui.stop()
         super(GUILogger, self).fatal_error(message)
 
-    def progress_iterator(self, description, iterable, total, get_id, get_title, print_every=10):
+    def progress_iterator(self, description, iterable, total, get_id, get_title, print_every=10, get_weight=None,
+                          get_status=None, count=None):
         start_time = time.time()
         progress_bar = self.gui.create_progress_bar(description)
+        done = 0
         for n, elem in enumerate(iterable, 1):
+            done += get_weight(elem) if get_weight is not None else 1
             if n % print_every == 0:
                 elapsed = time.time() - start_time  # seconds
-                eta = int((total - n) * elapsed / n)
-                progress_bar.set_state(n * 100 / total, get_id(elem)[:12], eta)
+                eta = max(0, int((total - done) * elapsed / done))
+                progress_bar.set_state(min(100, done * 100 / total), get_id(elem)[:12], eta,
+                                       get_status() if get_status is not None else None)
             yield elem
         progress_bar.remove()
 
@@ -164,12 +168,12 @@ class StepProgressBar(object):
         self.gui = gui
         gui.redraw()
 
-    def set_state(self, progress, elem_id, eta):
+    def set_state(self, progress, elem_id, eta, status=None):
         m, s = divmod(eta, 60)
         h, m = divmod(m, 60)
 
         self.progress_bar.set_completion(progress)
-        self.id_text.set_text([' ', '{:8}'.format(elem_id)])
+        self.id_text.set_text([' ', '{:8}'.format(elem_id)] + ([' ', ('eta', status)] if status else []))
         self.eta_text.set_text([('eta', '{:2d}:{:02d}:{:02d}'.format(h, m, s)), ('box', ' left... ')])
         self.gui.redraw()
 
@@ -0,0 +1,173 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import multiprocessing
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+from indico.core.db import db
+from indico.util.string import crc32
+
+from indico_migrate.fileinfo import file_info
+from indico_migrate.util import convert_to_unicode
+
+
+def process_image(path, label, size=None):
+    """Convert an image to PNG.
+
+    This runs in the worker processes of an `ImageProcessor`, so it
+    neither logs anything nor returns anything which is not picklable.
+
+    :param path: The path of the image file
+    :param label: The name of the image used in warnings, e.g. ``'Logo'``
+    :param size: A ``(width, height)`` tuple to resize the image to
+    :return: A dict containing the warnings and either the error which
+             kept the image from being converted or the PNG data and its
+             size, hash and content type
+    """
+    warnings = []
+    try:
+        image = Image.open(path)
+    except IOError as e:
+        return {'warnings': warnings, 'error': 'Cannot open {}: {}'.format(convert_to_unicode(path), e)}
+
+    if image.mode == 'CMYK':
+        warnings.append('{} is a CMYK {}; converting to RGB'.format(label, image.format))
+        # this may result in wrong colors, but there's not much we can do...
+        image = image.convert('RGB')
+
+    if size is not None and image.size != size:
+        warnings.append('{} is {}x{}; resizing to {}x{}'.format(label, image.size[0], image.size[1], *size))
+        image = image.resize(size, Image.ANTIALIAS)
+
+    image_bytes = BytesIO()
+    try:
+        image.save(image_bytes, 'PNG')
+    except Exception as e:
+        return {'warnings': warnings, 'error': 'Cannot write PNG {}: {}'.format(label.lower(), e)}
+    content = image_bytes.getvalue()
+    return {'warnings': warnings, 'error': None, 'content': content,
+            'size': len(content), 'hash': crc32(content), 'content_type': 'image/png'}
+
+
+def make_thumbnail(data, size):
+    """Create a JPEG thumbnail of an image.
+
+    :param data: The data of the image
+    :param size: The maximum ``(width, height)`` of the thumbnail; the
+                 aspect ratio of the image is preserved
+    :return: The JPEG data or ``None`` if the image could not be read
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail(size, Image.ANTIALIAS)
+        thumbnail_bytes = BytesIO()
+        image.save(thumbnail_bytes, 'JPEG')
+    except IOError:
+        return None
+    return thumbnail_bytes.getvalue()
+
+
+class _ImmediateResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class ImageProcessor(object):
+    """Convert images to PNG in worker processes.
+
+    Images are submitted as soon as their paths are known and their
+    results are only collected when they are needed, so decoding and
+    re-encoding them happens while the migration continues.  Results
+    are cached by the path and, if it is known without reading the file
+    (e.g. from the checksum cache), the MD5 of the source file, so an
+    image used in many places (e.g. the same logo in all events of a
+    series) is converted only once.
+
+    :param workers: The number of worker processes; with ``0`` (or when
+                    running in a process which may not have children)
+                    the images are converted right away when submitted
+    :param cache_size: The number of results kept in the cache
+    """
+
+    def __init__(self, workers=0, cache_size=1000):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.submitted = 0
+        self.cache_hits = 0
+        self._cache = OrderedDict()
+        self._pool = None
+
+    def start(self):
+        """Start the worker processes.
+
+        The session is committed before, since the workers must not
+        inherit any database connections.
+        """
+        if not self.workers or multiprocessing.current_process().daemon:
+            return
+        db.session.commit()
+        db.engine.dispose()
+        self._pool = multiprocessing.Pool(self.workers)
+
+    def stop(self):
+        if self._pool is None:
+            return
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+
+    def submit(self, path, label, size=None):
+        """Start converting an image.
+
+        :param path: The path of the image file
+        :param label: The name of the image used in warnings
+        :param size: A ``(width, height)`` tuple to resize the image to
+        :return: An object whose ``get()`` method returns the result of
+                 `process_image` once it is available
+        """
+        self.submitted += 1
+        # reading the whole file here would block the migration, so the checksum is only used if already known
+        md5 = file_info.peek(path)
+        keys = [('path', path, label, size)]
+        if md5 is not None:
+            keys.append(('md5', md5, label, size))
+        result = next((self._cache.pop(key) for key in keys if key in self._cache), None)
+        if result is not None:
+            self.cache_hits += 1
+        elif self._pool is not None:
+            result = self._pool.apply_async(process_image, (path, label, size))
+        else:
+            result = _ImmediateResult(process_image(path, label, size))
+        for key in keys:
+            self._cache.pop(key, None)
+            self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def format_stats(self):
+        return ('Converted %[cyan]{}%[reset] images ({} reused from the cache)'
+                .format(self.submitted - self.cache_hits, self.cache_hits))
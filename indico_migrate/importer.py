@@ -25,6 +25,8 @@ from indico.core.db.sqlalchemy import db
 from indico.core.db.sqlalchemy.protection import ProtectionMode
 from indico.modules.groups import GroupProxy
 
+from indico_migrate.bulk import bulk_writers
+from indico_migrate.cache import ZODBCacheManager
 from indico_migrate.logger import logger_proxy
 from indico_migrate.util import convert_to_unicode
 
@@ -35,6 +37,11 @@ class Importer(object):
     #: Specify plugins that need to be loaded for the import (e.g. to access its .settings property)
     plugins = frozenset()
 
+    #: The `MigrationProfiler` used in ``--profile`` mode
+    _profiler = None
+    #: The `ZODBCacheManager` keeping the ZODB cache in check
+    _cache_manager = ZODBCacheManager()
+
     print_info = logger_proxy('info')
     print_success = logger_proxy('success')
     print_warning = logger_proxy('warning')
@@ -68,20 +75,38 @@ class Importer(object):
     def global_ns(self):
         return Importer._global_ns
 
+    @property
+    def profiler(self):
+        return Importer._profiler
+
+    @property
+    def cache_manager(self):
+        return Importer._cache_manager
+
     def __repr__(self):
         return '<{}({})>'.format(type(self).__name__, self.sqlalchemy_uri)
 
-    def flushing_iterator(self, iterable, n=5000):
-        """Iterates over `iterable` and flushes the ZODB cache every `n` items.
+    def flushing_iterator(self, iterable):
+        """Iterates over `iterable` and keeps the ZODB cache in check.
+
+        Depending on the settings of the cache manager, the cache is
+        flushed after a fixed number of items or when the memory usage
+        gets close to the limit.
 
         :param iterable: an iterable object
-        :param n: number of items to flush after
         """
         conn = self.zodb_root._p_jar
-        for i, item in enumerate(iterable, 1):
+        for item in iterable:
             yield item
-            if i % n == 0:
-                conn.sync()
+            self.cache_manager.tick(conn)
+
+    def bulk_writer(self, model):
+        """Get the `BulkWriter` used to insert rows of `model` using COPY.
+
+        This is meant for tables which receive many rows that are never
+        accessed through the ORM during the migration.
+        """
+        return bulk_writers.get(model)
 
     def convert_principal(self, old_principal):
         """Converts a legacy principal to PrincipalMixin style"""
@@ -156,11 +181,21 @@ class Importer(object):
 class TopLevelMigrationStep(Importer):
     def run(self):
         start = time.time()
+        conn = self.zodb_root._p_jar
+        self.cache_manager.start_step(conn)
         self.pre_migrate()
         try:
-            self.migrate()
+            if self.profiler is None:
+                self.migrate()
+            else:
+                with self.profiler.measure_step(type(self).__name__):
+                    self.migrate()
         finally:
             self.post_migrate()
+        cache_stats = self.cache_manager.end_step(conn)
+        if self.profiler is not None:
+            self.profiler.record_cache_stats(type(self).__name__, cache_stats)
+        self.print_log(ZODBCacheManager.format_stats(cache_stats))
         self.print_log('%[cyan]{:.06f} seconds%[reset]\a'.format((time.time() - start)))
 
     def pre_migrate(self):
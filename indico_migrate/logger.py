@@ -119,8 +119,41 @@ class StdoutLogger(BaseLogger):
     def print_step(self, msg):
         self.print_msg('%[cyan,blue] > %[cyan!,blue]', '{:<30}'.format(msg), always=True)
 
-    def progress_iterator(self, description, iterable, total, get_id, get_title, print_every=10):
+    def progress_iterator(self, description, iterable, total, get_id, get_title, print_every=10, get_weight=None,
+                          get_status=None, count=None):
+        # the weight is not supported by the plain console output, so it needs the number of items instead
+        if get_weight is not None and count is not None:
+            total = count
+        if get_status is not None:
+            _get_title = get_title
+
+            def get_title(elem):
+                return '[{}] {}'.format(get_status(), _get_title(elem))
         return verbose_iterator(iterable, total, get_id, get_title, print_every=print_every)
 
     def set_success(self):
         self.print_success('%[green!]Migration finished!', always=True)
+
+
+class QueueLogger(BaseLogger):
+    """Logger used inside worker processes.
+
+    Messages are not printed but sent to the parent process through
+    `queue`, which is responsible for displaying them using the real
+    logger.
+    """
+
+    def __init__(self, queue, quiet):
+        super(QueueLogger, self).__init__(quiet)
+        self.queue = queue
+
+    def print_msg(self, icon, msg, always=False, prefix='', event_id=''):
+        if always or not self.quiet:
+            self.queue.put(('msg', (icon, msg, always, prefix, event_id)))
+
+    def print_step(self, msg):
+        pass
+
+    def progress_iterator(self, description, iterable, total, get_id, get_title, print_every=10, get_weight=None,
+                          get_status=None, count=None):
+        return iterable
@@ -38,7 +38,15 @@ from indico.modules.oauth.models.applications import SystemAppType, OAuthApplica
 from indico.util.console import cformat
 from indico.web.flask.wrappers import IndicoFlask
 
+from indico_migrate.archive import archive_index
+from indico_migrate.cache import ZODBCacheManager
+from indico_migrate.dbsession import FastSessionProfile
+from indico_migrate.dedup import content_index
+from indico_migrate.fastload import DeferredSchemaObjects
+from indico_migrate.fileinfo import ChecksumCache, file_info
+from indico_migrate.namespaces import is_binary_restore_point, load_restore_point
 from indico_migrate.paste import ask_to_paste, get_full_stack
+from indico_migrate.profiling import MigrationProfiler
 from indico_migrate.util import MigrationStateManager, UnbreakingDB, get_storage
 
 
@@ -58,10 +66,22 @@ def _zodb_powered_loader(_zodb_root):
     return _ZODBLoader
 
 
+def _load_yaml_restore_point(logger, restore_file, zodb_root):
+    """Load a restore point saved in the legacy YAML format."""
+    # preload some data, so that we don't have to
+    # retrieve it from the DB later
+    all_users = db.m.User.query.all()
+    all_categories = db.m.Category.query.all()
+    logger.print_info('{} users, {} categories preloaded'.format(len(all_users), len(all_categories)), always=True)
+    return yaml.load(restore_file, Loader=_zodb_powered_loader(zodb_root))
+
+
 def migrate(logger, zodb_root, zodb_rb_uri, sqlalchemy_uri, verbose=False, dblog=False, restore_file=None, **kwargs):
+    from indico_migrate.importer import Importer
     from indico_migrate.steps.badges_posters import GlobalBadgePosterImporter
     from indico_migrate.steps.event_series import EventSeriesImporter
     from indico_migrate.steps.events import EventImporter
+    from indico_migrate.steps.events.delta import record_delta_state
     from indico_migrate.steps.categories import CategoryImporter
     from indico_migrate.steps.global_post_events import GlobalPostEventsImporter
     from indico_migrate.steps.global_pre_events import GlobalPreEventsImporter
@@ -71,29 +91,66 @@ def migrate(logger, zodb_root, zodb_rb_uri, sqlalchemy_uri, verbose=False, dblog
     steps = (GlobalPreEventsImporter, UserImporter, RoomsLocationsImporter, CategoryImporter, EventImporter,
              RoomBookingsImporter, GlobalPostEventsImporter, EventSeriesImporter, GlobalBadgePosterImporter)
 
-    app, tz = setup(logger, zodb_root, sqlalchemy_uri, dblog=dblog, restore=(restore_file is not None))
+    delta = kwargs.get('delta', False)
+    delta_state = kwargs.get('delta_state')
+    if delta:
+        # the series and global post-event data may involve the events which have been migrated again
+        steps = (EventImporter, GlobalPostEventsImporter, EventSeriesImporter)
+
+    app, tz = setup(logger, zodb_root, sqlalchemy_uri, dblog=dblog, restore=(restore_file is not None or delta))
 
     default_group_provider = kwargs.pop('default_group_provider')
     save_restore = kwargs.pop('save_restore')
+    profile = kwargs.pop('profile', None)
+    profile_python = kwargs.pop('profile_python', False)
+    profile_slowest = kwargs.pop('profile_slowest', 10)
+    if profile:
+        Importer._profiler = MigrationProfiler(profile_slowest, profile_python)
+    memory_limit = kwargs.pop('memory_limit', None)
+    Importer._cache_manager = ZODBCacheManager(memory_limit * 1024 * 1024 if memory_limit else None)
+    fast_load = kwargs.pop('fast_load', False)
+    index_workers = kwargs.pop('index_workers', 4)
+    fast_session = kwargs.pop('fast_session', False)
+    pg_settings = kwargs.pop('pg_settings', None)
+    hash_workers = kwargs.get('hash_workers', 0)
+    checksum_cache = kwargs.pop('checksum_cache', None)
+    archive_index_workers = kwargs.pop('archive_index_workers', 0)
+    content_index.deduplicate = kwargs.pop('dedup_files', False)
     debug = kwargs.get('debug', False)
 
     with app.app_context():
+        session_profile = None
+        if fast_session:
+            session_profile = FastSessionProfile(pg_settings)
+            session_profile.apply(db.engine)
+            logger.print_info('Using fast-load database settings:\n' + session_profile.format_report(), always=True)
         try:
             if restore_file:
                 logger.print_info('loading restore file %[cyan!]{}'.format(restore_file.name), always=True)
-                import time
-                time.sleep(1)
-                # preload some data, so that we don't have to
-                # retrieve it from the DB later
-                all_users = db.m.User.query.all()
-                all_categories = db.m.Category.query.all()
-                logger.print_info('{} users, {} categories preloaded'.format(len(all_users), len(all_categories)),
-                                  always=True)
-                data = yaml.load(restore_file, Loader=_zodb_powered_loader(zodb_root))
+                if is_binary_restore_point(restore_file):
+                    data = load_restore_point(restore_file, zodb_root)
+                else:
+                    data = _load_yaml_restore_point(logger, restore_file, zodb_root)
                 MigrationStateManager.load_restore_point(data)
+            elif delta:
+                logger.print_info('loading delta state %[cyan!]{}'.format(delta_state), always=True)
+                with open(delta_state, 'rb') as f:
+                    MigrationStateManager.load_restore_point(load_restore_point(f, zodb_root))
+
+            deferred = DeferredSchemaObjects(logger)
+            if fast_load:
+                deferred.drop()
+            if archive_index_workers:
+                logger.print_info('Indexing the archive dirs', always=True)
+                archive_index.build(kwargs['archive_dir'], archive_index_workers)
+                logger.print_info(archive_index.format_stats(), always=True)
+            if checksum_cache:
+                file_info.checksum_cache = ChecksumCache(checksum_cache)
+                file_info.checksum_cache.open()
+            file_info.start(hash_workers)
 
             for step in steps:
-                if MigrationStateManager.has_already_run(step):
+                if MigrationStateManager.has_already_run(step) and not delta:
                     logger.print_info('Skipping previously-run step {}...'.format(step.__name__), always=True)
                     continue
                 if step in (RoomsLocationsImporter, RoomBookingsImporter):
@@ -104,7 +161,21 @@ def migrate(logger, zodb_root, zodb_rb_uri, sqlalchemy_uri, verbose=False, dblog
                 else:
                     step(logger, app, sqlalchemy_uri, zodb_root, verbose, dblog, default_group_provider, tz,
                          **kwargs).run()
-                MigrationStateManager.register_step(step)
+                if not MigrationStateManager.has_already_run(step):
+                    MigrationStateManager.register_step(step)
+            # this also takes care of what a previous --fast-load run failed to recreate
+            if deferred.has_pending():
+                logger.print_step('Indexes')
+                if Importer._profiler is not None:
+                    with Importer._profiler.measure_step('DeferredSchemaObjects'):
+                        deferred.rebuild(index_workers)
+                else:
+                    deferred.rebuild(index_workers)
+            if delta_state:
+                with open(delta_state, 'wb') as f:
+                    MigrationStateManager.save_restore_point(f)
+                # only recorded now, so the database and the state file always belong to the same run
+                record_delta_state(zodb_root)
             logger.set_success()
             logger.shutdown()
         except Exception as exc:
@@ -127,7 +198,22 @@ def migrate(logger, zodb_root, zodb_rb_uri, sqlalchemy_uri, verbose=False, dblog
             if not ask_to_paste(logger.buffer):
                 raise
         finally:
+            file_info.stop()
+            archive_index.close()
+            if content_index.stats['files']:
+                logger.print_info(content_index.format_stats(), always=True)
+            if file_info.checksum_cache is not None:
+                file_info.checksum_cache.close()
+                logger.print_info(file_info.checksum_cache.format_stats(), always=True)
+            if session_profile is not None:
+                # the report ends up in the log file, which is easier to find than the initial message
+                logger.print_info('Database settings used for the migration:\n' + session_profile.format_report(),
+                                  always=True)
+                if profile:
+                    Importer._profiler.record_db_settings(session_profile.get_report())
             logger.save_to_disk()
+            if profile:
+                Importer._profiler.write_report(profile)
 
 
 def db_has_data():
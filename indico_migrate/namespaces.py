@@ -18,6 +18,7 @@ from __future__ import unicode_literals
 
 from collections import defaultdict
 
+import msgpack
 from persistent import Persistent
 from yaml import Dumper, Loader
 
@@ -52,6 +53,120 @@ Loader.add_constructor('!sqlalchemy', sqlalchemy_constructor)
 Loader.add_constructor('!zodb', zodb_constructor)
 
 
+#: Header written at the beginning of binary restore points
+RESTORE_POINT_HEADER = b'\x89INDICO-MIGRATE\x01'
+
+EXT_SQLALCHEMY = 1
+EXT_ZODB = 2
+EXT_SET = 3
+
+
+class _ModelReference(object):
+    """Placeholder for a database object until it has been loaded."""
+
+    __slots__ = ('model', 'id')
+
+    def __init__(self, model, id_):
+        self.model = model
+        self.id = id_
+
+    def __eq__(self, other):
+        return isinstance(other, _ModelReference) and (self.model, self.id) == (other.model, other.id)
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return hash((self.model, self.id))
+
+
+def _pack_default(obj):
+    if isinstance(obj, db.Model):
+        return msgpack.ExtType(EXT_SQLALCHEMY, msgpack.packb([obj.__class__.__name__, obj.id], use_bin_type=True))
+    elif isinstance(obj, Persistent):
+        return msgpack.ExtType(EXT_ZODB, obj._p_oid)
+    elif isinstance(obj, (set, frozenset)):
+        return msgpack.ExtType(EXT_SET, _packb(list(obj)))
+    raise TypeError('Cannot serialize {!r}'.format(obj))
+
+
+def _packb(obj):
+    return msgpack.packb(obj, default=_pack_default, use_bin_type=True)
+
+
+def dump_restore_point(data, fd):
+    """Write restore point data to a file in the binary format.
+
+    Database objects and ZODB objects are stored as references which
+    are resolved when the restore point is loaded.
+    """
+    fd.write(RESTORE_POINT_HEADER)
+    fd.write(_packb(data))
+
+
+def is_binary_restore_point(fd):
+    """Check whether a restore point file uses the binary format."""
+    pos = fd.tell()
+    header = fd.read(len(RESTORE_POINT_HEADER))
+    fd.seek(pos)
+    return header == RESTORE_POINT_HEADER
+
+
+def load_restore_point(fd, zodb_root, chunk_size=5000):
+    """Read restore point data from a file in the binary format.
+
+    All references to database objects are collected while unpacking
+    and then loaded using one query per model and chunk of IDs.
+
+    :param fd: The file to read from
+    :param zodb_root: The ZODB root used to resolve ZODB references
+    :param chunk_size: The maximum number of IDs per query
+    """
+    references = defaultdict(set)
+
+    def _ext_hook(code, data):
+        if code == EXT_SQLALCHEMY:
+            model, id_ = msgpack.unpackb(data, raw=False)
+            if id_ is None:
+                # object was never persisted
+                return None
+            references[model].add(id_)
+            return _ModelReference(model, id_)
+        elif code == EXT_ZODB:
+            return zodb_root._p_jar[data]
+        elif code == EXT_SET:
+            return set(_unpackb(data))
+        return msgpack.ExtType(code, data)
+
+    def _unpackb(data):
+        return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, use_list=False)
+
+    header = fd.read(len(RESTORE_POINT_HEADER))
+    if header != RESTORE_POINT_HEADER:
+        raise ValueError('Not a binary restore point')
+    data = _unpackb(fd.read())
+    objects = {}
+    for model_name, ids in references.viewitems():
+        model = getattr(db.m, model_name)
+        ids = sorted(ids)
+        objects[model_name] = objs = {}
+        for i in xrange(0, len(ids), chunk_size):
+            objs.update((obj.id, obj) for obj in model.query.filter(model.id.in_(ids[i:i + chunk_size])))
+    return _resolve_references(data, objects)
+
+
+def _resolve_references(obj, objects):
+    if isinstance(obj, _ModelReference):
+        return objects[obj.model].get(obj.id)
+    elif isinstance(obj, dict):
+        return {_resolve_references(k, objects): _resolve_references(v, objects) for k, v in obj.iteritems()}
+    elif isinstance(obj, tuple):
+        return tuple(_resolve_references(x, objects) for x in obj)
+    elif isinstance(obj, set):
+        return {_resolve_references(x, objects) for x in obj}
+    return obj
+
+
 STORE_MAP = {
     'setdict': lambda: defaultdict(set)
 }
@@ -70,4 +185,11 @@ class SharedNamespace(object):
         return {k: store for k, store in self._stores.viewitems()}
 
     def load(self, data):
-        self._stores.update(data)
+        for key, value in data.viewitems():
+            store = self._stores.get(key)
+            if isinstance(store, dict) and type(value) is not type(store):
+                # restore the original container type (e.g. defaultdicts)
+                store.clear()
+                store.update(value)
+            else:
+                self._stores[key] = value
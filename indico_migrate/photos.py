@@ -0,0 +1,210 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, unicode_literals
+
+import os
+import sys
+import time
+from collections import Counter, OrderedDict
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from PIL import Image
+
+from indico.core.db import db
+
+from indico_migrate.images import make_thumbnail
+
+
+def _read_photo(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except EnvironmentError:
+        return None
+
+
+def _get_image_size(path):
+    # only the header of the image is read
+    try:
+        return Image.open(path).size
+    except IOError:
+        return None
+
+
+def _make_thumbnail(args):
+    return make_thumbnail(*args)
+
+
+class RoomPhotoLoader(object):
+    """Load the photos of rooms in batches.
+
+    Each photo directory is listed only once, so there is no need to try
+    opening the photos of rooms which do not have any.  The photos which
+    exist are read by multiple threads, one batch at a time while the
+    rooms are being migrated, so only the photos of a single batch are
+    kept in memory.  Rooms which only have a large photo can get a
+    thumbnail generated from it.
+
+    :param photo_path: The directory containing the ``large_photos`` and
+                       ``small_photos`` directories
+    :param workers: The number of threads reading the photos and of the
+                    processes generating thumbnails
+    :param regenerate_thumbnails: Whether to generate missing thumbnails
+    :param batch_size: The number of rooms whose photos are read at once
+    """
+
+    def __init__(self, photo_path, workers=4, regenerate_thumbnails=False, batch_size=100):
+        self.photo_path = photo_path
+        self.workers = workers
+        self.regenerate_thumbnails = regenerate_thumbnails
+        self.batch_size = batch_size
+        self.loaded = 0
+        self.missing = set()
+        self.regenerated = set()
+        self.thumbnail_size = None
+        self.bytes_read = 0
+        self.read_duration = 0
+        self._large = self._small = None
+        self._order = []
+        self._positions = {}
+        self._batch = {}
+        self._thread_pool = None
+        self._process_pool = None
+
+    def load(self, names):
+        """Find the photos of rooms.
+
+        The photos are only read when `get` is called, in batches of
+        rooms following the order of `names`.
+
+        :param names: The canonical names of the rooms, in the order in
+                      which their photos will be requested
+        """
+        names = list(OrderedDict.fromkeys(names))
+        self._large = self._find_photos('large_photos', names)
+        self._small = self._find_photos('small_photos', names)
+        if self.regenerate_thumbnails and any(name not in self._small for name in self._large):
+            # the workers must not inherit any connections from our pool (or the reading threads)
+            db.session.commit()
+            db.engine.dispose()
+            self._process_pool = Pool(self.workers)
+        self._thread_pool = ThreadPool(self.workers)
+        if self.regenerate_thumbnails:
+            self.thumbnail_size = self._get_thumbnail_size(self._small.values())
+            if self.thumbnail_size is None and self._process_pool is not None:
+                self._process_pool.close()
+                self._process_pool.join()
+                self._process_pool = None
+        for name in names:
+            if name in self._large and (name in self._small or self._process_pool is not None):
+                self._positions[name] = len(self._order)
+                self._order.append(name)
+            else:
+                self.missing.add(name)
+
+    def get(self, name):
+        """Get the large photo and the thumbnail of a room.
+
+        :param name: The canonical name of the room
+        :return: A ``(large_photo, small_photo)`` tuple or ``None``
+        """
+        if name not in self._batch:
+            pos = self._positions.get(name)
+            if pos is None:
+                return None
+            self._batch = self._read_batch(self._order[pos:pos + self.batch_size])
+        return self._batch.get(name)
+
+    def close(self):
+        self._batch = {}
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self._thread_pool = self._process_pool = None
+
+    def format_stats(self):
+        return ('Loaded photos of %[cyan]{}%[reset] rooms ({} thumbnails generated), read {:.1f} MiB in {:.1f}s '
+                '({:.1f} MiB/s)').format(self.loaded, len(self.regenerated), self.bytes_read / 1024 / 1024,
+                                         self.read_duration,
+                                         self.bytes_read / 1024 / 1024 / max(self.read_duration, 0.001))
+
+    def _find_photos(self, dirname, names):
+        """Get the paths of the existing photos of rooms.
+
+        :return: A dict mapping room names to paths
+        """
+        encoding = sys.getfilesystemencoding()
+        photo_path = self.photo_path.encode(encoding) if isinstance(self.photo_path, unicode) else self.photo_path
+        directory = os.path.join(photo_path, dirname.encode(encoding))
+        available = set()
+        try:
+            filenames = os.listdir(directory)
+        except OSError:
+            filenames = []
+        for filename in filenames:
+            if not filename.endswith(b'.jpg'):
+                continue
+            try:
+                # the room names are unicode while the directory contains bytes
+                available.add(filename[:-4].decode(encoding))
+            except UnicodeDecodeError:
+                # no room name can be encoded to it
+                continue
+        photos = {}
+        for name in names:
+            path = os.path.join(directory, (name + '.jpg').encode(encoding))
+            # names containing a slash point to a subdirectory
+            if name in available or (os.sep in name and os.path.isfile(path)):
+                photos[name] = path
+        return photos
+
+    def _read_batch(self, names):
+        start = time.time()
+        large = self._read_photos([self._large[name] for name in names])
+        small_names = [name for name in names if name in self._small]
+        small = dict(zip(small_names, self._read_photos([self._small[name] for name in small_names])))
+        self.bytes_read += sum(len(data) for data in large + small.values() if data)
+        self.read_duration += time.time() - start
+        large = dict(zip(names, large))
+        if self._process_pool is not None:
+            thumbnails = self._make_thumbnails({name: data for name, data in large.iteritems()
+                                                if data and not small.get(name)})
+            small.update(thumbnails)
+            self.regenerated.update(thumbnails)
+        photos = {}
+        for name in names:
+            if large[name] and small.get(name):
+                photos[name] = large[name], small[name]
+            else:
+                self.missing.add(name)
+        self.loaded += len(photos)
+        return photos
+
+    def _read_photos(self, paths):
+        return self._thread_pool.map(_read_photo, paths)
+
+    def _get_thumbnail_size(self, paths):
+        """Get the most common size of the existing thumbnails."""
+        sizes = Counter(size for size in self._thread_pool.map(_get_image_size, paths) if size is not None)
+        return sizes.most_common(1)[0][0] if sizes else None
+
+    def _make_thumbnails(self, photos):
+        names = sorted(photos)
+        results = self._process_pool.map(_make_thumbnail, [(photos[name], self.thumbnail_size) for name in names])
+        return {name: data for name, data in zip(names, results) if data}
@@ -0,0 +1,159 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+"""Scan a ZODB FileStorage before migrating it.
+
+The scan reads the data records of the storage sequentially and only
+looks at the class of each object and the OIDs it references, so it is
+much faster than loading the objects.  It results in a histogram of the
+legacy classes and an estimate of the work needed to migrate each
+conference, which the migration can use (``--prescan``) to weight its
+progress bars and to balance the parallel event shards.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import json
+import time
+from collections import Counter, deque
+
+import click
+from ZODB.FileStorage import FileIterator, FileStorage
+from ZODB.serialize import referencesf
+from ZODB.utils import get_pickle_metadata, u64
+
+from indico.util.console import cformat
+
+from indico_migrate.util import SHARED_LEGACY_CLASSES, UnbreakingDB
+
+
+click.disable_unicode_literals_warning = True
+
+
+class PrescanIndex(object):
+    """The result of scanning a ZODB storage.
+
+    :param classes: A dict mapping legacy class names to the number of
+                    objects of that class
+    :param conferences: A dict mapping conference IDs to the estimated
+                        amount of work needed to migrate them
+    """
+
+    def __init__(self, classes, conferences):
+        self.classes = classes
+        self.conferences = conferences
+
+    @classmethod
+    def load(cls, f):
+        data = json.load(f)
+        return cls(data['classes'], data['conferences'])
+
+    def save(self, f):
+        json.dump({'classes': self.classes, 'conferences': self.conferences}, f, indent=2, sort_keys=True)
+
+
+def _iter_current_records(path, index):
+    """Iterate over the current revision of all objects in a FileStorage."""
+    for txn in FileIterator(path):
+        for record in txn:
+            # older revisions of an object and undone creations are skipped
+            if record.data is not None and index.get(record.oid) == record.pos:
+                yield record
+
+
+def _count_objects(root_oid, classes, references):
+    """Count the objects belonging to a conference.
+
+    Objects shared with other conferences are not followed, just like
+    when prefetching the data of a conference.  The root itself is a
+    shared object but its references are always followed.
+    """
+    seen = {root_oid}
+    queue = deque([root_oid])
+    while queue:
+        oid = queue.popleft()
+        for ref in references.get(oid, ()):
+            if ref not in seen and classes.get(ref) not in SHARED_LEGACY_CLASSES:
+                seen.add(ref)
+                queue.append(ref)
+    return len(seen)
+
+
+def scan_storage(path, log=None):
+    """Scan the FileStorage at `path`.
+
+    :param path: The path of the ``Data.fs`` file
+    :param log: A function called with progress messages
+    :return: A `PrescanIndex`
+    """
+    storage = FileStorage(path, read_only=True)
+    try:
+        index = storage._index
+        classes = {}
+        references = {}
+        histogram = Counter()
+        start = time.time()
+        for n, record in enumerate(_iter_current_records(path, index), 1):
+            module, name = get_pickle_metadata(record.data)
+            oid = u64(record.oid)
+            classes[oid] = intern(name)
+            histogram['{}.{}'.format(module, name)] += 1
+            # conferences are shared objects too, but they are the roots the
+            # walk starts from so their references are always needed
+            if name not in SHARED_LEGACY_CLASSES or name == 'Conference':
+                references[oid] = tuple(u64(ref) for ref in referencesf(record.data))
+            if log and n % 100000 == 0:
+                log('Scanned {} of {} objects ({:.0f}s)'.format(n, len(index), time.time() - start))
+
+        conferences = {}
+        db = UnbreakingDB(storage)
+        try:
+            for conf_id, conf in db.open().root()['conferences'].iteritems():
+                conferences[conf_id] = _count_objects(u64(conf._p_oid), classes, references)
+        finally:
+            db.close()
+    finally:
+        storage.close()
+    return PrescanIndex(dict(histogram), conferences)
+
+
+@click.command()
+@click.argument('data-fs', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output', type=click.File('wb'))
+@click.option('--top', type=click.IntRange(0), default=25, show_default=True,
+              help="Number of classes and conferences to show")
+def main(data_fs, output, top):
+    """Scan a ZODB FileStorage and save the results to a JSON file.
+
+    The file can be passed to indico-migrate using `--prescan`.
+    """
+    prescan = scan_storage(data_fs, log=lambda msg: print(cformat('%[blue!]i%[reset] ') + msg))
+    prescan.save(output)
+    print(cformat('%[white!]{:<60} {:>10}').format('class', 'objects'))
+    for name, count in Counter(prescan.classes).most_common(top):
+        print('{:<60} {:>10}'.format(name, count))
+    print()
+    print(cformat('%[white!]{:<60} {:>10}').format('conference', 'objects'))
+    for conf_id, count in Counter(prescan.conferences).most_common(top):
+        print('{:<60} {:>10}'.format(conf_id, count))
+    total = sum(prescan.conferences.itervalues())
+    print(cformat('%[green!]{}%[reset] objects in %[green!]{}%[reset] conferences, '
+                  '%[cyan]{:.1f}%[reset] per conference on average')
+          .format(total, len(prescan.conferences), total / (len(prescan.conferences) or 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import cProfile
+import heapq
+import json
+import pstats
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from io import open
+
+
+class _StatsHolder(object):
+    """Wrap raw profiler stats so they can be added to `pstats.Stats`."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class _EventStepStats(object):
+    def __init__(self):
+        self.time = 0
+        self.calls = 0
+        self.slowest = []
+
+    def add(self, conf_id, duration, keep):
+        self.time += duration
+        self.calls += 1
+        if len(self.slowest) < keep:
+            heapq.heappush(self.slowest, (duration, conf_id))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, conf_id))
+
+    def merge(self, time_, calls, slowest, keep):
+        self.time += time_
+        self.calls += calls
+        self.slowest = heapq.nlargest(keep, self.slowest + [tuple(x) for x in slowest])
+        heapq.heapify(self.slowest)
+
+
+class MigrationProfiler(object):
+    """Collect timing information about the migration steps.
+
+    The time spent in each top-level step is recorded, as well as the
+    time spent in each event migration step (by `step_id`), together
+    with the conferences for which it took the longest.
+
+    :param slowest: The number of slowest conferences to keep per
+                    event migration step
+    :param python_profile: Whether to also collect cProfile data
+    """
+
+    def __init__(self, slowest=10, python_profile=False):
+        self.slowest = slowest
+        self.steps = OrderedDict()
+        self.event_steps = defaultdict(_EventStepStats)
+        self.cache = OrderedDict()
+        self.db_settings = OrderedDict()
+        self.python_profile = cProfile.Profile() if python_profile else None
+        self._extra_python_stats = []
+
+    def fork(self):
+        """Create an empty profiler with the same settings.
+
+        This is meant to be used in a child process, so the profiling
+        data inherited from the parent process is not collected twice.
+        """
+        if self.python_profile:
+            self.python_profile.disable()
+        return MigrationProfiler(self.slowest, self.python_profile is not None)
+
+    @contextmanager
+    def measure_step(self, name):
+        """Measure the time spent in a top-level migration step."""
+        if self.python_profile:
+            self.python_profile.enable()
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.steps[name] = self.steps.get(name, 0) + time.time() - start
+            if self.python_profile:
+                self.python_profile.disable()
+
+    def record_cache_stats(self, name, stats):
+        """Record the ZODB cache statistics of a top-level migration step."""
+        self.cache[name] = stats
+
+    def record_db_settings(self, settings):
+        """Record the database settings changed for the migration."""
+        self.db_settings = settings
+
+    @contextmanager
+    def measure_event_step(self, step_id, conf_id):
+        """Measure the time spent in an event migration step for one event."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.event_steps[step_id].add(conf_id, time.time() - start, self.slowest)
+
+    def export(self):
+        """Export the collected data, e.g. to send it to another process."""
+        python_stats = None
+        if self.python_profile:
+            self.python_profile.create_stats()
+            python_stats = self.python_profile.stats
+        return {
+            'event_steps': {step_id: (stats.time, stats.calls, stats.slowest)
+                            for step_id, stats in self.event_steps.iteritems()},
+            'python_stats': python_stats
+        }
+
+    def merge(self, data):
+        """Merge data exported by another profiler."""
+        for step_id, (time_, calls, slowest) in data['event_steps'].iteritems():
+            self.event_steps[step_id].merge(time_, calls, slowest, self.slowest)
+        if data['python_stats']:
+            self._extra_python_stats.append(data['python_stats'])
+
+    def get_report(self):
+        return {
+            'steps': self.steps,
+            'cache': self.cache,
+            'db_settings': self.db_settings,
+            'event_steps': OrderedDict((step_id, {
+                'time': stats.time,
+                'calls': stats.calls,
+                'slowest': [{'conf_id': conf_id, 'time': duration}
+                            for duration, conf_id in sorted(stats.slowest, reverse=True)]
+            }) for step_id, stats in sorted(self.event_steps.iteritems(), key=lambda x: x[1].time, reverse=True))
+        }
+
+    def format_report(self):
+        report = self.get_report()
+        lines = ['Migration steps', '']
+        for name, duration in report['steps'].iteritems():
+            lines.append('  {:<32} {:>12.3f}s'.format(name, duration))
+        lines += ['', 'ZODB cache', '',
+                  '  {:<32} {:>10} {:>10} {:>10} {:>8} {:>10}'.format(
+                      'step', 'loads', 'hits', 'misses', 'shrunk', 'peak RSS')]
+        for name, stats in report['cache'].iteritems():
+            lines.append('  {:<32} {:>10} {:>10} {:>10} {:>8} {:>8.1f}MB'.format(
+                name, stats['loads'], stats['storage_cache_hits'], stats['storage_cache_misses'],
+                stats.get('gcs', 0) + stats.get('minimizations', 0), stats['peak_rss'] / 1024 / 1024))
+        if report['db_settings']:
+            lines += ['', 'Database settings', '']
+            lines += ['  {:<32} {:>12} -> {}'.format(name, data['before'], data['after'])
+                      for name, data in report['db_settings'].iteritems()]
+        lines += ['', 'Event migration steps', '',
+                  '  {:<20} {:>12} {:>10} {:>12}'.format('step', 'total', 'calls', 'average')]
+        for step_id, stats in report['event_steps'].iteritems():
+            lines.append('  {:<20} {:>11.3f}s {:>10} {:>11.3f}s'.format(
+                step_id, stats['time'], stats['calls'], stats['time'] / (stats['calls'] or 1)))
+        lines += ['', 'Slowest conferences per event migration step']
+        for step_id, stats in report['event_steps'].iteritems():
+            lines += ['', '  {}'.format(step_id)]
+            lines += ['    {:<16} {:>11.3f}s'.format(entry['conf_id'], entry['time']) for entry in stats['slowest']]
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, path):
+        """Write the report to disk.
+
+        The text report is written to `path`, the JSON report to
+        ``<path>.json`` and, if enabled, the cProfile data (which can be
+        loaded with `pstats`) to ``<path>.prof``.
+
+        :return: The list of files which have been written
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.format_report())
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            f.write(unicode(json.dumps(self.get_report(), indent=2)))
+        written = [path, path + '.json']
+        if self.python_profile:
+            stats = pstats.Stats(self.python_profile)
+            for extra in self._extra_python_stats:
+                stats.add(_StatsHolder(extra))
+            stats.dump_stats(path + '.prof')
+            written.append(path + '.prof')
+        return written
@@ -19,12 +19,10 @@ from __future__ import division, unicode_literals
 
 import os
 import re
+from collections import deque
 from HTMLParser import HTMLParser
-from io import BytesIO
 from operator import attrgetter
 
-from PIL import Image
-
 from indico.core.db import db
 from indico.core.db.sqlalchemy.protection import ProtectionMode
 from indico.core.db.sqlalchemy.util.session import no_autoflush
@@ -34,9 +32,11 @@ from indico.modules.events.layout import theme_settings
 from indico.modules.networks.models.networks import IPNetworkGroup
 from indico.modules.users import User
 from indico.util.fs import secure_filename
-from indico.util.string import crc32, is_legacy_id, is_valid_mail, sanitize_email, strip_tags
+from indico.util.string import is_legacy_id, is_valid_mail, sanitize_email, strip_tags
 
 from indico_migrate.attachments import AttachmentMixin
+from indico_migrate.fileinfo import file_info
+from indico_migrate.images import ImageProcessor
 from indico_migrate.importer import TopLevelMigrationStep
 from indico_migrate.util import convert_to_unicode, get_archived_file, patch_default_group_provider, step_description
 
@@ -44,63 +44,113 @@ from indico_migrate.util import convert_to_unicode, get_archived_file, patch_def
 class CategoryImporter(AttachmentMixin, TopLevelMigrationStep):
     step_name = 'categories'
 
+    #: the number of categories migrated between two commits
+    commit_every = 1000
+
     def __init__(self, *args, **kwargs):
         self._set_config_options(**kwargs)
         self.system_user = User.get_system_user()
+        self.image_processor = ImageProcessor(kwargs.pop('image_workers', 0))
+        self.pending_icons = []
         super(CategoryImporter, self).__init__(*args, **kwargs)
         self.categ_id_counter = self.zodb_root['counters']['CATEGORY']._Counter__count
+        self.legacy_category_new_ids = {}
 
     @no_autoflush
     @step_description('Categories')
     def migrate(self):
+        self.image_processor.start()
         self.domain_mapping = {ipng.name.lower(): ipng for ipng in IPNetworkGroup.query}
-        with patch_default_group_provider(self.default_group_provider):
-            self.migrate_categories()
+        try:
+            with patch_default_group_provider(self.default_group_provider):
+                self.migrate_categories()
+        finally:
+            self.image_processor.stop()
+        if self.image_processor.submitted:
+            self.print_info(self.image_processor.format_stats(), always=True)
         self.fix_sequences('categories', {'categories'})
 
     def migrate_categories(self):
+        """Migrate the category tree breadth-first.
+
+        All categories of a level are migrated before their children, so
+        the session can be committed regularly instead of keeping the
+        whole tree in it until the end.  The data of committed categories
+        is expired, so their ACLs, attachments and icons can be freed.
+        Since the tree is not walked recursively, its depth is not limited
+        by the recursion limit.
+
+        Categories with a legacy ID still get their new IDs in the same
+        order as when the tree was migrated depth-first, so the same
+        legacy database always results in the same IDs and URLs.
+        """
         old_root = self.zodb_root['rootCategory']
         assert old_root.id == '0'
-        root = self._migrate_category(old_root, 1)
-        db.session.add(root)
+        self.legacy_category_new_ids = self._allocate_legacy_ids(old_root)
+        queue = deque([(old_root, 1, None)])
+        migrated = 0
+        while queue:
+            old_cat, position, parent_id = queue.popleft()
+            cat = self._migrate_category(old_cat, position)
+            # files which were prefetched but not used
+            file_info.discard(('category', old_cat.id))
+            cat.parent_id = parent_id
+            db.session.add(cat)
+            old_subcats = sorted(old_cat.subcategories.itervalues(), key=attrgetter('_order'))
+            for old_subcat in old_subcats:
+                # their files are hashed while we migrate the rest of this level
+                self.prefetch_attachments(old_subcat, group=('category', old_subcat.id))
+            queue.extend((old_subcat, i, cat.id) for i, old_subcat in enumerate(old_subcats, 1))
+            migrated += 1
+            if migrated % self.commit_every == 0:
+                self._apply_icons()
+                db.session.commit()
+        self._apply_icons()
         db.session.commit()
 
+    def _allocate_legacy_ids(self, old_root):
+        """Generate the new IDs of categories with a legacy ID.
+
+        The tree is walked depth-first (pre-order), which is the order in
+        which the IDs used to be generated while migrating it.
+        """
+        new_ids = {}
+        stack = [old_root]
+        while stack:
+            old_cat = stack.pop()
+            if is_legacy_id(old_cat.id):
+                new_ids[old_cat.id] = self.gen_categ_id()
+            # reversed so the first subcategory is popped next; categories with the same order keep theirs
+            stack.extend(reversed(sorted(old_cat.subcategories.itervalues(), key=attrgetter('_order'))))
+        return new_ids
+
     def _process_icon(self, cat, icon):
         path = get_archived_file(icon, self.archive_dirs)[1]
         if path is None:
             self.print_error('%[red!]Icon not found on disk; skipping it', event_id=cat.id)
             return
 
-        try:
-            icon_image = Image.open(path)
-        except IOError as e:
-            self.print_warning("Cannot open {}: {}".format(convert_to_unicode(path), e), event_id=cat.id)
-            return
+        # the icon is converted while we continue with the next categories
+        self.pending_icons.append((cat, icon, self.image_processor.submit(path, 'Icon', (16, 16))))
 
-        if icon_image.mode == 'CMYK':
-            self.print_warning("Icon is a CMYK {}; converting to RGB".format(icon_image.format), always=False,
-                               event_id=cat.id)
-            # this may result in wrong colors, but there's not much we can do...
-            icon_image = icon_image.convert('RGB')
-
-        if icon_image.size != (16, 16):
-            self.print_warning("Icon is {}x{}; resizing to 16x16".format(*icon_image.size), always=False,
-                               event_id=cat.id)
-            icon_image = icon_image.resize((16, 16), Image.ANTIALIAS)
-
-        icon_bytes = BytesIO()
-        icon_image.save(icon_bytes, 'PNG')
-        icon_bytes.seek(0)
-        icon_content = icon_bytes.read()
-        icon_filename = secure_filename(convert_to_unicode(icon.fileName), 'icon')
-        icon_filename = os.path.splitext(icon_filename)[0] + '.png'
-        cat.icon_metadata = {
-            'size': len(icon_content),
-            'hash': crc32(icon_content),
-            'filename': icon_filename,
-            'content_type': 'image/png'
-        }
-        cat.icon = icon_content
+    def _apply_icons(self):
+        for cat, icon, result in self.pending_icons:
+            data = result.get()
+            for warning in data['warnings']:
+                self.print_warning(warning, always=False, event_id=cat.id)
+            if data['error']:
+                self.print_warning(data['error'], event_id=cat.id)
+                continue
+            icon_filename = secure_filename(convert_to_unicode(icon.fileName), 'icon')
+            icon_filename = os.path.splitext(icon_filename)[0] + '.png'
+            cat.icon_metadata = {
+                'size': data['size'],
+                'hash': data['hash'],
+                'filename': icon_filename,
+                'content_type': data['content_type']
+            }
+            cat.icon = data['content']
+        del self.pending_icons[:]
 
     def process_principal(self, cat, legacy_principal, name, color, read_access=None, full_access=None, roles=None):
         principal = self.convert_principal(legacy_principal)
@@ -195,8 +245,8 @@ class CategoryImporter(AttachmentMixin, TopLevelMigrationStep):
         if is_legacy_id(old_cat.id):
             # if category has a legacy (non-numeric) ID, generate a new ID
             # and establish a mapping (for URL redirection)
-            new_id = self.gen_categ_id()
-            db.session.add(LegacyCategoryMapping(legacy_category_id=old_cat.id, category_id=new_id))
+            new_id = self.legacy_category_new_ids[old_cat.id]
+            self.bulk_writer(LegacyCategoryMapping).add(legacy_category_id=old_cat.id, category_id=new_id)
             self.print_success('%[white!]{:6s}%[reset] -> %[cyan]{}'.format(old_cat.id, new_id))
         else:
             new_id = int(old_cat.id)
@@ -216,9 +266,6 @@ class CategoryImporter(AttachmentMixin, TopLevelMigrationStep):
             self._process_icon(cat, old_cat._icon)
         self._process_protection(cat, old_cat)
         self.migrate_category_attachments(cat, old_cat)
-        cat.children = [(self._migrate_category(old_subcat, i))
-                        for i, old_subcat in enumerate(sorted(old_cat.subcategories.itervalues(),
-                                                              key=attrgetter('_order')), 1)]
         # add to user favorites
         for user in self.global_ns.user_favorite_categories[old_cat.id]:
             user.favorite_categories.add(cat)
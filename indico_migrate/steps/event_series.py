@@ -46,9 +46,22 @@ class EventSeriesImporter(TopLevelMigrationStep):
             if len(series) < 2:
                 self.print_warning('Skipping single-event series: {}'.format(sorted(series)))
                 continue
-            es = EventSeries(show_sequence_in_title=False)
+            # in a delta migration, only the events which have been migrated again are not in their series yet
+            existing = {events[id_].series_id for id_ in series}
+            if None not in existing and len(existing) == 1:
+                continue
+            existing.discard(None)
+            es = EventSeries.get(min(existing)) if existing else EventSeries(show_sequence_in_title=False)
+            extra = sorted(existing - {es.id})
+            if extra:
+                self.print_warning('Merging series {} into {}'.format(extra, es.id))
             for id_ in series:
                 events[id_].series = es
+            if extra:
+                db.session.flush()
+                for series_id in extra:
+                    if not Event.query.filter_by(series_id=series_id).has_rows():
+                        db.session.delete(EventSeries.get(series_id))
             if not self.quiet:
                 self.print_success(repr(series))
         (AttachmentFolder.query
@@ -92,6 +92,21 @@ class EventMigrationStep(Importer):
     def migrate(self):
         raise NotImplementedError
 
+    def prepare(self, conf):
+        """Start work which can be done before migrating a conference.
+
+        This is called for upcoming conferences while the ones before
+        them are still being migrated, so slow work which does not need
+        the new event (e.g. converting images) can run in the background.
+        """
+
+    def discard(self, conf):
+        """Forget what `prepare` started for a conference.
+
+        This is called after a conference has been migrated or skipped,
+        so nothing prepared for it is kept around.
+        """
+
     def setup(self):
         pass
 
@@ -0,0 +1,115 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from sqlalchemy.orm import load_only
+
+from indico.core.db import db
+from indico.modules.events.models.events import Event
+from indico.modules.events.models.legacy_mapping import LegacyEventMapping
+from indico.modules.events.surveys.models.surveys import Survey
+
+
+class EventCheckpoints(object):
+    """Keep track of the conferences which have already been committed.
+
+    Each row of the checkpoint table covers a range of conference IDs
+    (in the order in which they are migrated) whose events have all been
+    committed.  Rows are updated in the same transaction as the event
+    data, so they are always consistent with the contents of the database.
+
+    :param sort_key: A function returning the position of a conference ID
+                     in the migration order (BTree key order by default)
+    """
+
+    table = 'indico_migrate_event_checkpoints'
+
+    def __init__(self, sort_key=None):
+        self.sort_key = sort_key or (lambda conf_id: conf_id)
+        self.ranges = []
+
+    def load(self):
+        db.engine.execute(db.text('CREATE TABLE IF NOT EXISTS {} (range_start VARCHAR PRIMARY KEY, '
+                                  'last_key VARCHAR NOT NULL)'.format(self.table)))
+        self.ranges = [(start, last) for start, last in
+                       db.engine.execute(db.text('SELECT range_start, last_key FROM {}'.format(self.table)))]
+        return bool(self.ranges)
+
+    def drop(self):
+        db.engine.execute(db.text('DROP TABLE IF EXISTS {}'.format(self.table)))
+        self.ranges = []
+
+    def is_committed(self, conf_id):
+        key = self.sort_key(conf_id)
+        return any(self.sort_key(start) <= key <= self.sort_key(last) for start, last in self.ranges)
+
+    def committing_iterator(self, conferences, range_start, n=100):
+        """Iterate over `conferences`, committing every `n` items.
+
+        This works like `committing_iterator` but records the last
+        committed conference together with each commit.
+
+        :param conferences: An iterable of legacy conferences
+        :param range_start: The first key of the range being migrated
+        :param n: Number of items to commit after
+        """
+        last_key = None
+        for i, conf in enumerate(conferences, 1):
+            yield conf
+            last_key = conf.id
+            if i % n == 0:
+                self._record(range_start, last_key)
+                db.session.commit()
+        if last_key is not None:
+            self._record(range_start, last_key)
+        db.session.commit()
+
+    def _record(self, range_start, last_key):
+        params = {'range_start': range_start, 'last_key': last_key}
+        updated = db.session.execute(db.text('UPDATE {} SET last_key = :last_key WHERE range_start = :range_start'
+                                             .format(self.table)), params).rowcount
+        if not updated:
+            db.session.execute(db.text('INSERT INTO {} (range_start, last_key) VALUES (:range_start, :last_key)'
+                                       .format(self.table)), params)
+
+    def restore_lookups(self, importer):
+        """Rebuild the global lookups for the already-committed events."""
+        g = importer.global_ns
+        conferences = importer.zodb_root['conferences']
+        legacy_ids = dict(db.session.query(LegacyEventMapping.event_id, LegacyEventMapping.legacy_event_id))
+
+        def _conf_id(event_id):
+            return legacy_ids.get(event_id, unicode(event_id))
+
+        # entries of events which have been rolled back cannot be resolved anymore
+        for store in (g.legacy_event_ids, g.used_short_urls, g.legacy_survey_mapping):
+            for key, value in store.items():
+                if value is None:
+                    del store[key]
+
+        for event in Event.query.options(load_only('id', 'url_shortcut')):
+            conf_id = _conf_id(event.id)
+            if not self.is_committed(conf_id):
+                continue
+            g.legacy_event_ids[conf_id] = event
+            if event.url_shortcut:
+                g.used_short_urls.setdefault(event.url_shortcut.lower(), event)
+        for survey in Survey.query.options(load_only('id', 'event_id')):
+            conf_id = _conf_id(survey.event_id)
+            if self.is_committed(conf_id):
+                g.legacy_survey_mapping[conferences[conf_id]] = survey
+        return len(g.legacy_event_ids)
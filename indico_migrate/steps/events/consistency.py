@@ -0,0 +1,161 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+from indico.core.db import db
+from indico.modules.events.models.events import Event
+
+
+# the checks of `events.check_timetable_consistency`, each returning the IDs of the events violating it
+TIMETABLE_CHECKS = OrderedDict([
+    ('Top-level entry for contribution in a session', '''
+        SELECT DISTINCT te.event_id
+        FROM events.timetable_entries te
+        JOIN events.contributions c ON (c.id = te.contribution_id)
+        WHERE te.event_id BETWEEN :min_id AND :max_id AND te.parent_id IS NULL AND te.type = 2 AND
+              (c.session_id IS NOT NULL OR c.session_block_id IS NOT NULL)
+    '''),
+    ('Child entry for contribution in a session does not match the parent session', '''
+        SELECT DISTINCT te.event_id
+        FROM events.timetable_entries te
+        JOIN events.timetable_entries tep ON (tep.id = te.parent_id)
+        JOIN events.session_blocks sb ON (sb.id = tep.session_block_id)
+        JOIN events.contributions c ON (c.id = te.contribution_id)
+        WHERE te.event_id BETWEEN :min_id AND :max_id AND te.type = 2 AND
+              (COALESCE(c.session_id, -1) != COALESCE(sb.session_id, -1) OR
+               COALESCE(c.session_block_id, -1) != COALESCE(tep.session_block_id, -1))
+    '''),
+    ('Entry starts before its parent block', '''
+        SELECT DISTINCT te.event_id
+        FROM events.timetable_entries te
+        JOIN events.timetable_entries tep ON (tep.id = te.parent_id)
+        WHERE te.event_id BETWEEN :min_id AND :max_id AND tep.start_dt > te.start_dt
+    '''),
+    ('Entry ends after its parent block', '''
+        SELECT DISTINCT te.event_id
+        FROM events.timetable_entries te
+        JOIN events.timetable_entries tep ON (tep.id = te.parent_id)
+        JOIN events.session_blocks bl ON (bl.id = tep.session_block_id)
+        LEFT JOIN events.contributions c ON (c.id = te.contribution_id)
+        LEFT JOIN events.breaks b ON (b.id = te.break_id)
+        WHERE te.event_id BETWEEN :min_id AND :max_id AND te.type IN (2, 3) AND
+              (te.start_dt + COALESCE(c.duration, b.duration)) > (tep.start_dt + bl.duration)
+    '''),
+    ('Entry starts before the event', '''
+        SELECT DISTINCT te.event_id
+        FROM events.timetable_entries te
+        JOIN events.events e ON (e.id = te.event_id)
+        WHERE te.event_id BETWEEN :min_id AND :max_id AND te.start_dt < e.start_dt
+    '''),
+    ('Entry ends after the event', '''
+        SELECT DISTINCT te.event_id
+        FROM events.timetable_entries te
+        JOIN events.events e ON (e.id = te.event_id)
+        LEFT JOIN events.session_blocks bl ON (bl.id = te.session_block_id)
+        LEFT JOIN events.contributions c ON (c.id = te.contribution_id)
+        LEFT JOIN events.breaks b ON (b.id = te.break_id)
+        WHERE te.event_id BETWEEN :min_id AND :max_id AND
+              (te.start_dt + COALESCE(c.duration, b.duration, bl.duration)) > e.end_dt
+    '''),
+])
+
+
+class TimetableConsistencyCheck(object):
+    """Check the timetables of all events after migrating them.
+
+    The ``consistent_timetable`` triggers are disabled while the events
+    are migrated, so nothing checks the rows inserted during that time.
+    Instead of running the trigger function once per row, its checks
+    are run afterwards as a few queries covering all events.
+
+    :param importer: The `EventImporter` used to report the results
+    :param workers: The number of connections to use; each of them
+                    checks a separate range of event IDs
+    """
+
+    def __init__(self, importer, workers=1):
+        self.importer = importer
+        self.workers = workers
+
+    def run(self):
+        """Run all checks and report the events violating them.
+
+        :return: A dict mapping the description of each failed check to
+                 a sorted list of event IDs
+        """
+        min_id, max_id = db.session.query(db.func.min(Event.id), db.func.max(Event.id)).one()
+        if min_id is None:
+            return {}
+        ranges = self._split_range(min_id, max_id)
+        self.importer.print_info('Checking the timetables of events %[cyan]{}%[reset] - %[cyan]{}%[reset] using {} '
+                                 'connections'.format(min_id, max_id, len(ranges)), always=True)
+        start = time.time()
+        violations = self._run_parallel(ranges)
+        for detail, event_ids in violations.iteritems():
+            self.importer.print_warning('%[yellow!]{}%[reset] in %[cyan]{}%[reset] events: {}'
+                                        .format(detail, len(event_ids), ', '.join(map(unicode, event_ids))),
+                                        always=True)
+        if violations:
+            self.importer.print_warning('%[yellow!]Found %[cyan]{}%[yellow!] events with inconsistent timetables'
+                                        .format(len(set.union(*map(set, violations.itervalues())))), always=True)
+        else:
+            self.importer.print_success('All timetables are consistent ({:.1f}s)'.format(time.time() - start),
+                                        always=True)
+        return violations
+
+    def _split_range(self, min_id, max_id):
+        size = -(-(max_id - min_id + 1) // self.workers)
+        return [(start, min(start + size - 1, max_id)) for start in xrange(min_id, max_id + 1, size)]
+
+    def _run_parallel(self, ranges):
+        engine = db.engine
+        results = [None] * len(ranges)
+
+        def _worker(i, min_id, max_id):
+            found = {}
+            try:
+                with engine.connect() as conn:
+                    for detail, query in TIMETABLE_CHECKS.iteritems():
+                        found[detail] = {event_id for event_id, in conn.execute(db.text(query), min_id=min_id,
+                                                                                max_id=max_id)}
+            except Exception as exc:
+                results[i] = exc
+            else:
+                results[i] = found
+
+        threads = [threading.Thread(target=_worker, args=(i, min_id, max_id), name='timetable-check-{}'.format(i))
+                   for i, (min_id, max_id) in enumerate(ranges)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        violations = OrderedDict()
+        for detail in TIMETABLE_CHECKS:
+            event_ids = set()
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+                event_ids |= result[detail]
+            if event_ids:
+                violations[detail] = sorted(event_ids)
+        return violations
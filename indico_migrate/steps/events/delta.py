@@ -0,0 +1,357 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import json
+from collections import defaultdict
+
+from sqlalchemy import and_, exists, select, tuple_
+
+from indico.core.db import db
+from indico.modules.events.models.events import Event
+from indico.modules.events.models.legacy_mapping import LegacyEventMapping
+from indico.util.string import is_legacy_id
+
+
+class EventSerials(object):
+    """Keep track of the ZODB serials of the migrated conferences.
+
+    The serial of a conference changes whenever the conference object
+    itself is modified, which is what delta migrations rely on to find
+    the conferences which need to be migrated again.
+    """
+
+    table = 'indico_migrate_event_serials'
+
+    def __init__(self, zodb_root):
+        self.conferences = zodb_root['conferences']
+        self.storage = zodb_root._p_jar.db().storage
+
+    def get_current(self):
+        # getTid only reads the record header, so the conferences stay ghosts
+        return {conf_id: self.storage.getTid(conf._p_oid).encode('hex')
+                for conf_id, conf in self.conferences.iteritems()}
+
+    def load(self):
+        db.session.execute(db.text('CREATE TABLE IF NOT EXISTS {} (conf_id VARCHAR PRIMARY KEY, '
+                                   'serial VARCHAR NOT NULL)'.format(self.table)))
+        return dict(db.session.execute(db.text('SELECT conf_id, serial FROM {}'.format(self.table))))
+
+    def save(self, serials):
+        db.session.execute(db.text('CREATE TABLE IF NOT EXISTS {} (conf_id VARCHAR PRIMARY KEY, '
+                                   'serial VARCHAR NOT NULL)'.format(self.table)))
+        db.session.execute(db.text('DELETE FROM {}'.format(self.table)))
+        if serials:
+            db.session.execute(db.text('INSERT INTO {} (conf_id, serial) VALUES (:conf_id, :serial)'
+                                       .format(self.table)),
+                               [{'conf_id': conf_id, 'serial': serial} for conf_id, serial in serials.iteritems()])
+        db.session.commit()
+
+
+def record_delta_state(zodb_root):
+    """Record what later delta migrations compare the ZODB against.
+
+    This needs to happen at the very end of a migration, together with
+    saving the ``--delta-state`` file, so a failure in any step makes the
+    next delta migration start over instead of skipping what failed.
+    """
+    serials = EventSerials(zodb_root)
+    serials.save(serials.get_current())
+    known_ids = KnownLegacyIds(zodb_root)
+    known_ids.save(known_ids.get_current())
+
+
+class KnownLegacyIds(object):
+    """Keep track of the legacy users and categories which have been migrated.
+
+    Delta migrations only migrate events, so they cannot handle users or
+    categories which did not exist during the previous migration.
+    """
+
+    table = 'indico_migrate_known_ids'
+
+    def __init__(self, zodb_root):
+        self.zodb_root = zodb_root
+
+    def get_current(self):
+        return {'avatars': set(self.zodb_root['avatars'].keys()), 'categories': self._get_category_ids()}
+
+    def load(self):
+        self._create_table()
+        ids = defaultdict(set)
+        for kind, legacy_id in db.session.execute(db.text('SELECT kind, legacy_id FROM {}'.format(self.table))):
+            ids[kind].add(legacy_id)
+        return ids
+
+    def save(self, ids):
+        self._create_table()
+        db.session.execute(db.text('DELETE FROM {}'.format(self.table)))
+        rows = [{'kind': kind, 'legacy_id': legacy_id} for kind, legacy_ids in ids.iteritems()
+                for legacy_id in legacy_ids]
+        if rows:
+            db.session.execute(db.text('INSERT INTO {} (kind, legacy_id) VALUES (:kind, :legacy_id)'
+                                       .format(self.table)), rows)
+        db.session.commit()
+
+    def _create_table(self):
+        db.session.execute(db.text('CREATE TABLE IF NOT EXISTS {} (kind VARCHAR NOT NULL, legacy_id VARCHAR NOT NULL, '
+                                   'PRIMARY KEY (kind, legacy_id))'.format(self.table)))
+
+    def _get_category_ids(self):
+        # only categories reachable from the root are migrated
+        ids = set()
+        stack = [self.zodb_root['rootCategory']]
+        while stack:
+            category = stack.pop()
+            ids.add(category.id)
+            stack.extend(category.subcategories.itervalues())
+        return ids
+
+
+class NullifiedReferences(object):
+    """Remember the references which were set to NULL when deleting events.
+
+    Rows outside the events (e.g. room bookings) are not deleted together
+    with an event, but their reference to it is removed.  Since changed
+    conferences are migrated again with the same event ID, the references
+    can be restored afterwards.  They are stored in the database, in the
+    same transaction as the deletion, so they are not lost if the delta
+    migration fails and needs to be run again.
+    """
+
+    table = 'indico_migrate_nullified_refs'
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def add(self, constraint, condition):
+        """Remember the references of a foreign key before nullifying them.
+
+        :param constraint: The foreign key constraint
+        :param condition: The condition selecting the referencing rows
+        """
+        self._create_table()
+        child = constraint.table
+        pk = list(child.primary_key.columns)
+        columns = [element.parent for element in constraint.elements]
+        rows = [{'table_name': child.fullname, 'constraint_name': constraint.name,
+                 'pk': json.dumps({col.name: row[i] for i, col in enumerate(pk)}),
+                 'ref': json.dumps({col.name: row[len(pk) + i] for i, col in enumerate(columns)})}
+                for row in db.session.execute(select(pk + columns).where(condition))]
+        if rows:
+            db.session.execute(db.text('INSERT INTO {} (table_name, constraint_name, pk, ref) '
+                                       'VALUES (:table_name, :constraint_name, :pk, :ref)'.format(self.table)), rows)
+
+    def restore(self):
+        """Restore the references to rows which exist again.
+
+        References to rows which are still missing (e.g. the events of
+        deleted conferences) stay NULL.
+
+        :return: A dict mapping table names to the number of restored rows
+        """
+        self._create_table()
+        counts = defaultdict(int)
+        query = db.text('SELECT table_name, constraint_name, pk, ref FROM {}'.format(self.table))
+        for table_name, constraint_name, pk, ref in db.session.execute(query).fetchall():
+            child = self.metadata.tables[table_name]
+            constraint = next(fk for fk in child.foreign_key_constraints if fk.name == constraint_name)
+            pk = json.loads(pk)
+            ref = json.loads(ref)
+            referenced_exists = exists().where(and_(*(element.column == ref[element.parent.name]
+                                                      for element in constraint.elements)))
+            stmt = (child.update()
+                    .where(and_(referenced_exists, *(child.c[name] == value for name, value in pk.iteritems())))
+                    .values(ref))
+            counts[table_name] += db.session.execute(stmt).rowcount
+        db.session.execute(db.text('DELETE FROM {}'.format(self.table)))
+        return counts
+
+    def _create_table(self):
+        db.session.execute(db.text('CREATE TABLE IF NOT EXISTS {} (id SERIAL PRIMARY KEY, table_name VARCHAR NOT NULL, '
+                                   'constraint_name VARCHAR NOT NULL, pk VARCHAR NOT NULL, ref VARCHAR NOT NULL)'
+                                   .format(self.table)))
+
+
+class RowDeleter(object):
+    """Delete rows together with all rows depending on them.
+
+    The foreign keys of all tables known to SQLAlchemy are followed to
+    delete any rows referencing the deleted ones first.  References from
+    tables in `nullify_schemas` (e.g. bookings linked to an event) are
+    set to NULL instead of deleting the referencing row; they are
+    remembered in `nullified` so they can be restored later.
+    """
+
+    def __init__(self, metadata, nullify_schemas=frozenset({'roombooking'})):
+        self.nullify_schemas = nullify_schemas
+        self.nullified = NullifiedReferences(metadata)
+        self.references = defaultdict(list)
+        for table in metadata.tables.itervalues():
+            for constraint in table.foreign_key_constraints:
+                self.references[constraint.referred_table].append(constraint)
+
+    def delete(self, table, condition):
+        """Delete the rows of `table` matching `condition`.
+
+        :return: A dict mapping table names to the number of deleted rows
+        """
+        counts = defaultdict(int)
+        self._delete(table, condition, (), counts)
+        return counts
+
+    def _delete(self, table, condition, path, counts):
+        path += (table,)
+        for constraint in self.references[table]:
+            child = constraint.table
+            if child is table:
+                # self-referencing rows are deleted by the same statement
+                continue
+            columns = [element.parent for element in constraint.elements]
+            referenced = [element.column for element in constraint.elements]
+            if len(columns) == 1:
+                child_condition = columns[0].in_(select(referenced).where(condition))
+            else:
+                child_condition = tuple_(*columns).in_(select(referenced).where(condition))
+            nullable = all(col.nullable for col in columns)
+            if nullable and (child in path or child.schema in self.nullify_schemas):
+                if child not in path:
+                    self.nullified.add(constraint, child_condition)
+                db.session.execute(child.update().where(child_condition).values({col.name: None for col in columns}))
+            elif child in path:
+                raise RuntimeError('Cannot delete from {} due to a cycle of NOT NULL foreign keys'.format(child))
+            else:
+                self._delete(child, child_condition, path, counts)
+        counts[table.fullname] += db.session.execute(table.delete().where(condition)).rowcount
+
+
+class EventDelta(object):
+    """Determine and clean up the events to migrate in delta mode.
+
+    The conferences whose serial differs from the one recorded during
+    the previous run, as well as new ones, are migrated again; the events
+    of changed and deleted conferences are deleted beforehand, and so are
+    those a failed delta migration already created for new conferences.
+    Since only
+    events are migrated, the delta mode refuses to run if there are users
+    or categories which did not exist during the previous run.
+    """
+
+    def __init__(self, importer):
+        self.importer = importer
+        self.serials = EventSerials(importer.zodb_root)
+        self.known_ids = KnownLegacyIds(importer.zodb_root)
+        self.current_serials = None
+
+    def prepare(self):
+        previous = self.serials.load()
+        if not previous:
+            raise RuntimeError('No conference serials have been recorded; the delta mode requires a previous full '
+                               'migration using --delta-state')
+        self._check_new_objects()
+        current = self.load_current_serials()
+        new = current.viewkeys() - previous.viewkeys()
+        deleted = previous.viewkeys() - current.viewkeys()
+        changed = {conf_id for conf_id in current.viewkeys() & previous.viewkeys()
+                   if current[conf_id] != previous[conf_id]}
+        self.importer.print_info('Delta: %[green!]{}%[reset] new, %[yellow!]{}%[reset] changed, %[red!]{}%[reset] '
+                                 'deleted conferences'.format(len(new), len(changed), len(deleted)), always=True)
+
+        # a failed delta migration may already have committed some of the new conferences
+        event_ids = self._get_event_ids(new | changed | deleted)
+        self.importer.event_id_map = self._build_event_id_map(new, changed, event_ids)
+        self._delete_events(event_ids)
+        self._cleanup_lookups(new | changed | deleted)
+        db.session.commit()
+        self.importer.delta_ids = new | changed
+
+    def load_current_serials(self):
+        self.current_serials = self.serials.get_current()
+        return self.current_serials
+
+    def restore_references(self):
+        """Restore the references to the events which have been migrated again."""
+        counts = NullifiedReferences(db.Model.metadata).restore()
+        for name, count in sorted(counts.iteritems()):
+            if count:
+                self.importer.print_info('Restored %[cyan]{}%[reset] references from %[white!]{}%[reset]'
+                                         .format(count, name), always=True)
+
+    def _check_new_objects(self):
+        known = self.known_ids.load()
+        current = self.known_ids.get_current()
+        new = {kind: sorted(ids - known[kind]) for kind, ids in current.iteritems()}
+        if any(new.itervalues()):
+            details = '; '.join('{} new {} ({}{})'.format(len(ids), kind, ', '.join(ids[:10]),
+                                                          ', ...' if len(ids) > 10 else '')
+                                for kind, ids in sorted(new.iteritems()) if ids)
+            raise RuntimeError('The delta mode cannot migrate users or categories which did not exist during the '
+                               'previous migration: {}; run a full migration instead'.format(details))
+
+    def _get_event_ids(self, conf_ids):
+        event_ids = {conf_id: int(conf_id) for conf_id in conf_ids if not is_legacy_id(conf_id)}
+        legacy_ids = sorted(conf_id for conf_id in conf_ids if is_legacy_id(conf_id))
+        for i in xrange(0, len(legacy_ids), 10000):
+            query = (db.session.query(LegacyEventMapping.legacy_event_id, LegacyEventMapping.event_id)
+                     .filter(LegacyEventMapping.legacy_event_id.in_(legacy_ids[i:i + 10000])))
+            event_ids.update(query)
+        return event_ids
+
+    def _build_event_id_map(self, new, changed, event_ids):
+        """Assign event IDs to the conferences with legacy IDs.
+
+        Changed conferences keep the ID they had before, and so do new
+        ones which a failed delta migration already migrated; other new
+        ones get IDs which have not been used yet.
+        """
+        event_id_map = {conf_id: event_ids[conf_id] for conf_id in new | changed if conf_id in event_ids}
+        counter = self.importer.zodb_root['counters']['CONFERENCE']
+        next_id = max(counter._Counter__count, db.session.query(db.func.max(Event.id)).scalar() or 0) + 1
+        for conf_id in sorted(new | changed):
+            if is_legacy_id(conf_id) and conf_id not in event_id_map:
+                event_id_map[conf_id] = next_id
+                next_id += 1
+        return event_id_map
+
+    def _delete_events(self, event_ids):
+        ids = sorted(set(event_ids.viewvalues()))
+        if not ids:
+            return
+        deleter = RowDeleter(db.Model.metadata)
+        table = Event.__table__
+        for i in xrange(0, len(ids), 1000):
+            counts = deleter.delete(table, table.c.id.in_(ids[i:i + 1000]))
+            for name, count in sorted(counts.iteritems()):
+                if count:
+                    self.importer.print_info('Deleted %[cyan]{}%[reset] rows from %[white!]{}%[reset]'
+                                             .format(count, name))
+
+    def _cleanup_lookups(self, conf_ids):
+        g = self.importer.global_ns
+        deleted_events = {g.legacy_event_ids.pop(conf_id, None) for conf_id in conf_ids}
+        deleted_events.discard(None)
+        for url, event in g.used_short_urls.items():
+            if event is None or event in deleted_events:
+                del g.used_short_urls[url]
+        for conf, survey in g.legacy_survey_mapping.items():
+            if survey is None or conf.id in conf_ids:
+                del g.legacy_survey_mapping[conf]
+                if survey is not None and survey in db.session:
+                    db.session.expunge(survey)
+        for event in deleted_events:
+            if event in db.session:
+                db.session.expunge(event)
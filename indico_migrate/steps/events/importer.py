@@ -16,6 +16,7 @@
 
 from __future__ import unicode_literals
 
+from collections import deque
 from operator import attrgetter
 
 import pytz
@@ -27,10 +28,17 @@ from indico.modules.events.models.events import Event
 from indico.modules.events.models.settings import EventSetting
 from indico.modules.users import User
 from indico.util.string import is_legacy_id
-from indico.util.struct.iterables import committing_iterator
 
+from indico_migrate.bulk import bulk_writers
+from indico_migrate.fileinfo import file_info
 from indico_migrate.importer import TopLevelMigrationStep
 from indico_migrate.namespaces import SharedNamespace
+from indico_migrate.prescan import PrescanIndex
+from indico_migrate.steps.events.checkpoints import EventCheckpoints
+from indico_migrate.steps.events.consistency import TimetableConsistencyCheck
+from indico_migrate.steps.events.delta import EventDelta
+from indico_migrate.steps.events.prefetch import ConferencePrefetcher
+from indico_migrate.storage_order import ConferenceOrder, StorageConferenceOrder, get_record_index
 from indico_migrate.util import convert_to_unicode, step_description
 
 
@@ -91,20 +99,11 @@ class _EventContextBase(object):
 
     @property
     def lostandfound_category(self):
-        if self.importer.global_ns.lostandfound_category:
-            return self.importer.global_ns.lostandfound_category
-        root = Category.get_root()
-        category = Category(parent=root, default_event_themes=root.default_event_themes,
-                            timezone=root.timezone, title='Lost & Found',
-                            protection_mode=ProtectionMode.protected,
-                            description='Events that had no category in the old database')
-        db.session.add(category)
-        self.importer.global_ns.lostandfound_category = category
-        return self.importer.global_ns.lostandfound_category
+        return self.importer.get_lostandfound_category()
 
     def create_event(self):
         if is_legacy_id(self.conf.id):
-            event_id = int(self.gen_event_id())
+            event_id = int(self.gen_event_id(self.conf.id))
             self.is_legacy = True
         else:
             event_id = int(self.conf.id)
@@ -134,7 +133,11 @@ class _EventContextBase(object):
 
     def run_step(self, importer):
         importer.bind(self)
-        importer.run()
+        if self.importer.profiler is None:
+            importer.run()
+        else:
+            with self.importer.profiler.measure_event_step(importer.step_id, self.conf.id):
+                importer.run()
 
     def _fix_naive(self, dt):
         if dt.tzinfo is None:
@@ -145,15 +148,30 @@ class _EventContextBase(object):
             return dt
 
 
-def EventContextFactory(counter, _importer):
+def EventContextFactory(counter, _importer, conference_ids, event_id_map=None):
+    """Create an EventContext class bound to `_importer`.
+
+    :param counter: The legacy ``CONFERENCE`` counter, used to allocate
+                    new IDs for events with legacy IDs
+    :param _importer: The `EventImporter` which runs the migration
+    :param conference_ids: The sorted IDs of all conferences.  New IDs
+                           are allocated in this order, regardless of
+                           the order in which the events are migrated.
+    :param event_id_map: A dict containing the IDs to use for events
+                         with legacy IDs instead of allocating them
+    """
+    if event_id_map is None:
+        legacy_ids = (conf_id for conf_id in conference_ids if is_legacy_id(conf_id))
+        event_id_map = {conf_id: n for n, conf_id in enumerate(legacy_ids, counter._Counter__count + 1)}
+    _event_id_map = event_id_map
+
     class _EventContext(_EventContextBase):
-        event_id_counter = counter._Counter__count
+        event_id_map = _event_id_map
         importer = _importer
 
         @classmethod
-        def gen_event_id(cls):
-            cls.event_id_counter += 1
-            return cls.event_id_counter
+        def gen_event_id(cls, conf_id):
+            return cls.event_id_map[conf_id]
     return _EventContext
 
 
@@ -166,9 +184,38 @@ class EventImporter(TopLevelMigrationStep):
         self.system_user = User.get_system_user()
         self.migrate_broken_events = kwargs.get('migrate_broken_events')
         self.debug = kwargs.get('debug')
+        self.event_workers = kwargs.pop('event_workers', 1)
+        self.prefetch_events = kwargs.pop('prefetch_events', 0)
+        self.storage_order = kwargs.pop('storage_order', False)
+        self.pipeline_depth = kwargs.pop('pipeline_depth', 0)
+        self.timetable_check_workers = kwargs.pop('timetable_check_workers', 1)
+        self.image_workers = kwargs.get('image_workers', 0)
+        self.hash_workers = kwargs.get('hash_workers', 0)
+        prescan = kwargs.pop('prescan', None)
+        self.work_estimates = PrescanIndex.load(prescan).conferences if prescan else None
+        self.conference_order = None
+        self.zodb_uri = kwargs.get('zodb_uri')
+        self.checkpoints = EventCheckpoints()
+        self.delta = kwargs.pop('delta', False)
+        # the delta state is saved by `migrate` once all steps succeeded
+        kwargs.pop('delta_state', None)
+        self.delta_ids = None
+        self.event_id_map = None
         self.kwargs = kwargs
         self.kwargs['system_user'] = self.system_user
 
+    def get_lostandfound_category(self):
+        if self.global_ns.lostandfound_category:
+            return self.global_ns.lostandfound_category
+        root = Category.get_root()
+        category = Category(parent=root, default_event_themes=root.default_event_themes,
+                            timezone=root.timezone, title='Lost & Found',
+                            protection_mode=ProtectionMode.protected,
+                            description='Events that had no category in the old database')
+        db.session.add(category)
+        self.global_ns.lostandfound_category = category
+        return self.global_ns.lostandfound_category
+
     def has_data(self):
         return (EventSetting.query.filter(EventSetting.module.in_(['core', 'contact'])).has_rows() or
                 Event.query.filter_by(is_locked=True).has_rows())
@@ -180,7 +227,21 @@ class EventImporter(TopLevelMigrationStep):
         for table in tables:
             db.engine.execute(db.text('ALTER TABLE events.{} DISABLE TRIGGER consistent_timetable'.format(table)))
         try:
+            delta = EventDelta(self) if self.delta else None
+            if self.delta:
+                # the serials of a failed delta run have not been saved, so it simply starts over
+                self.checkpoints.drop()
+                delta.prepare()
+            self.conference_order = self._get_conference_order()
+            self.checkpoints.sort_key = self.conference_order.sort_key
+            if self.checkpoints.load():
+                self.print_warning('%[yellow!]Resuming the migration of events', always=True)
+                count = self.checkpoints.restore_lookups(self)
+                self.print_info('%[cyan]{}%[reset] events have already been migrated'.format(count), always=True)
             self.migrate_event_data()
+            if self.delta:
+                # e.g. bookings of the events which have been deleted and migrated again
+                delta.restore_references()
             db.session.commit()
         except:
             db.session.rollback()
@@ -189,40 +250,152 @@ class EventImporter(TopLevelMigrationStep):
             for table in tables:
                 db.engine.execute(db.text('ALTER TABLE events.{} ENABLE TRIGGER consistent_timetable'.format(table)))
         db.session.commit()
+        if self.timetable_check_workers:
+            # the triggers did not check anything we inserted
+            TimetableConsistencyCheck(self, self.timetable_check_workers).run()
+        self.checkpoints.drop()
+
+    def _get_conference_order(self):
+        conferences = self.zodb_root['conferences']
+        if not self.storage_order:
+            return ConferenceOrder(conferences)
+        index = get_record_index(self.zodb_root)
+        if index is None:
+            self.print_warning('%[yellow!]The storage has no record index; migrating events in ID order', always=True)
+            return ConferenceOrder(conferences)
+        self.print_info('Sorting conferences by their position in the storage', always=True)
+        return StorageConferenceOrder(conferences, index)
+
+    def get_event_weight(self, conf_id):
+        """Get the estimated amount of work needed to migrate a conference."""
+        if self.work_estimates is None:
+            return 1
+        return self.work_estimates.get(conf_id, 1)
+
+    def get_progress_count(self):
+        """Get the number of conferences to migrate."""
+        return len(self.zodb_root['conferences']) if self.delta_ids is None else len(self.delta_ids)
+
+    def get_progress_total(self):
+        """Get the estimated amount of work of all conferences to migrate."""
+        if self.work_estimates is None:
+            return self.get_progress_count()
+        conf_ids = self.zodb_root['conferences'].keys() if self.delta_ids is None else self.delta_ids
+        return sum(self.get_event_weight(conf_id) for conf_id in conf_ids)
 
     def migrate_event_data(self):
-        all_event_steps = _get_all_steps()
+        if self.event_workers > 1:
+            from indico_migrate.steps.events.parallel import ParallelEventMigration
+            ParallelEventMigration(self, self.event_workers).run()
+            return
 
-        importers = [importer(self.logger, self.app, self.sqlalchemy_uri, self.zodb_root, not self.quiet, self.dblog,
-                              self.default_group_provider, self.tz, **self.kwargs) for importer in all_event_steps]
+        importers = self.create_importers()
         for importer in importers:
             importer.setup()
+        try:
+            EventContext = EventContextFactory(self.zodb_root['counters']['CONFERENCE'], self,
+                                               self.zodb_root['conferences'].keys(), self.event_id_map)
+            self.migrate_events(self._iter_events(), importers, EventContext)
+        finally:
+            # e.g. the image workers must be stopped even if the migration failed
+            for importer in importers:
+                importer.teardown()
+        self.fix_sequences('events', {'events'})
 
-        EventContext = EventContextFactory(self.zodb_root['counters']['CONFERENCE'], self)
+    def create_importers(self):
+        return [importer(self.logger, self.app, self.sqlalchemy_uri, self.zodb_root, not self.quiet, self.dblog,
+                         self.default_group_provider, self.tz, **self.kwargs) for importer in _get_all_steps()]
 
-        for conf in committing_iterator(self._iter_events()):
-            context = EventContext(conf, self.debug)
-            try:
-                context.create_event()
-            except SkipEvent:
-                continue
-            for importer in importers:
-                with db.session.no_autoflush:
-                    context.run_step(importer)
+    def migrate_events(self, conferences, importers, EventContext, range_start=''):
+        if self.pipeline_depth:
+            bulk_writers.start_pipeline(self.pipeline_depth)
+        success = False
+        try:
+            conferences = self._iter_prepared(conferences, importers)
+            for conf in self.checkpoints.committing_iterator(conferences, range_start):
+                context = EventContext(conf, self.debug)
+                try:
+                    context.create_event()
+                except SkipEvent:
+                    self._discard_prepared(conf, importers)
+                    continue
+                for importer in importers:
+                    with db.session.no_autoflush:
+                        context.run_step(importer)
+                self._discard_prepared(conf, importers)
+                if self.pipeline_depth:
+                    # let the pipeline write the rows while we read the next conference
+                    bulk_writers.flush('conference {}'.format(conf.id))
+            success = True
+        finally:
+            if self.pipeline_depth:
+                bulk_writers.stop_pipeline(discard=not success)
 
+    def _discard_prepared(self, conf, importers):
+        """Forget what was prepared for a conference but not used."""
         for importer in importers:
-            importer.teardown()
-        self.fix_sequences('events', {'events'})
-
-    def _iter_events(self):
+            importer.discard(conf)
+        # files which were prefetched but not used by any step
+        file_info.discard(conf.id)
+
+    def _iter_prepared(self, conferences, importers):
+        """Let the importers prepare the upcoming conferences.
+
+        When images are converted or files are hashed in the background,
+        the importers are told about conferences before migrating them,
+        so the workers have something to do in the meantime.
+        """
+        window = 2 * max(self.image_workers, self.hash_workers)
+        pending = deque()
+        for conf in conferences:
+            for importer in importers:
+                importer.prepare(conf)
+            pending.append(conf)
+            if len(pending) > window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def get_pipeline_status(self):
+        """Get the number of batches waiting to be written by the pipeline."""
+        pipeline = bulk_writers.pipeline
+        return 'queue {}/{}'.format(pipeline.pending if pipeline is not None else 0, self.pipeline_depth)
+
+    def _iter_events(self, min_key=None, max_key=None):
+        """Iterate over the conferences to migrate.
+
+        :param min_key: The first conference ID to include
+        :param max_key: The last conference ID to include
+        """
         def _it():
-            for conf in self.zodb_root['conferences'].itervalues():
+            for conf_id, conf in self.conference_order.iteritems(min_key, max_key):
+                if self.checkpoints.is_committed(conf_id):
+                    continue
+                if self.delta_ids is not None and conf_id not in self.delta_ids:
+                    continue
+                yield conf
+
+        def _load(conferences):
+            for conf in conferences:
                 dir(conf)  # make zodb load attrs
                 yield conf
-        it = _it()
-        total = len(self.zodb_root['conferences'])
+
+        prefetcher = None
+        if self.prefetch_events:
+            prefetcher = ConferencePrefetcher(self.zodb_root._p_jar.db().storage, self.prefetch_events)
+            it = _load(prefetcher.iterate(_it()))
+        else:
+            it = _load(_it())
         if self.quiet:
-            it = self.logger.progress_iterator('Migrating Events', it, total, attrgetter('id'),
-                                               lambda x: getattr(x, 'title', ''))
+            it = self.logger.progress_iterator('Migrating Events', it, self.get_progress_total(), attrgetter('id'),
+                                               lambda x: getattr(x, 'title', ''),
+                                               get_weight=lambda x: self.get_event_weight(x.id),
+                                               get_status=self.get_pipeline_status if self.pipeline_depth else None,
+                                               count=self.get_progress_count())
         for old_event in self.flushing_iterator(it):
             yield old_event
+        if prefetcher is not None:
+            self.print_info('Prefetched %[cyan]{}%[reset] objects for %[cyan]{}%[reset] events'
+                            .format(prefetcher.loaded, prefetcher.prefetched), always=True)
+            if prefetcher.error:
+                self.print_warning('%[yellow!]Prefetching failed:%[reset]\n{}'.format(prefetcher.error), always=True)
@@ -18,9 +18,6 @@ from __future__ import unicode_literals
 
 import mimetypes
 import os
-from io import BytesIO
-
-from PIL import Image
 
 from indico.core.db import db
 from indico.modules.events.layout import layout_settings
@@ -31,6 +28,7 @@ from indico.util.date_time import now_utc
 from indico.util.fs import secure_filename
 from indico.util.string import crc32
 
+from indico_migrate.images import ImageProcessor
 from indico_migrate.steps.events import EventMigrationStep
 from indico_migrate.util import LocalFileImporterMixin, convert_to_unicode, get_archived_file
 
@@ -45,6 +43,12 @@ class EventImageImporter(LocalFileImporterMixin, EventMigrationStep):
         super(EventImageImporter, self).__init__(*args, **kwargs)
         self._set_config_options(**kwargs)
 
+    def prepare(self, conf):
+        # unlike `_iter_pictures` this must not complain about events without images
+        imgr = getattr(self.zodb_root['displayRegistery'].get(conf.id), '_imagesMngr', None)
+        if imgr:
+            self.prefetch_local_files((picture._localFile for picture in imgr._picList.itervalues()), group=conf.id)
+
     def migrate(self):
         for picture in self._iter_pictures(self.conf):
             local_file = picture._localFile
@@ -95,41 +99,48 @@ class EventLayoutImporter(EventMigrationStep):
         super(EventLayoutImporter, self).__init__(*args, **kwargs)
         self.default_styles = self.zodb_root['MaKaCInfo']['main']._styleMgr._defaultEventStylesheet
         self.archive_dirs = kwargs.pop('archive_dir')
+        self.image_processor = ImageProcessor(kwargs.pop('image_workers', 0))
+        self.pending_logos = {}
 
-    def _process_logo(self, logo):
-        path = get_archived_file(logo, self.archive_dirs)[1]
-        if path is None:
-            self.print_error('%[red!]Logo not found on disk; skipping it')
-            return
+    def setup(self):
+        self.image_processor.start()
 
-        try:
-            logo_image = Image.open(path)
-        except IOError as e:
-            self.print_warning("Cannot open {}: {}".format(convert_to_unicode(path), e))
+    def teardown(self):
+        self.image_processor.stop()
+        if self.image_processor.submitted:
+            self.print_info(self.image_processor.format_stats(), always=True)
+
+    def prepare(self, conf):
+        logo = getattr(conf, '_logo', None)
+        if not logo:
             return
+        path = get_archived_file(logo, self.archive_dirs)[1]
+        if path is not None:
+            self.pending_logos[conf.id] = self.image_processor.submit(path, 'Logo')
 
-        if logo_image.mode == 'CMYK':
-            self.print_warning("Logo is a CMYK {}; converting to RGB".format(logo_image.format))
-            # this may result in wrong colors, but there's not much we can do...
-            logo_image = logo_image.convert('RGB')
+    def discard(self, conf):
+        self.pending_logos.pop(conf.id, None)
 
-        logo_bytes = BytesIO()
-        try:
-            logo_image.save(logo_bytes, 'PNG')
-        except Exception as e:
-            self.print_warning("Cannot write PNG logo: {}".format(path, e))
+    def _process_logo(self, logo, result):
+        if result is None:
+            self.print_error('%[red!]Logo not found on disk; skipping it')
+            return
+
+        data = result.get()
+        for warning in data['warnings']:
+            self.print_warning(warning)
+        if data['error']:
+            self.print_warning(data['error'])
             return
-        logo_bytes.seek(0)
-        logo_content = logo_bytes.read()
         logo_filename = secure_filename(convert_to_unicode(logo.fileName), 'logo')
         logo_filename = os.path.splitext(logo_filename)[0] + '.png'
         self.event.logo_metadata = {
-            'size': len(logo_content),
-            'hash': crc32(logo_content),
+            'size': data['size'],
+            'hash': data['hash'],
             'filename': logo_filename,
-            'content_type': 'image/png'
+            'content_type': data['content_type']
         }
-        self.event.logo = logo_content
+        self.event.logo = data['content']
         if not self.quiet:
             self.print_success('- %[cyan][Logo] {}'.format(logo.fileName))
 
@@ -154,6 +165,7 @@ class EventLayoutImporter(EventMigrationStep):
     def migrate(self):
         dmgr = self.zodb_root['displayRegistery'][self.conf.id]
 
+        logo_result = self.pending_logos.pop(self.conf.id, None)
         style_mgr = getattr(dmgr, '_styleMngr', None) if self.event._type == EventType.conference else None
         custom_css = getattr(style_mgr, '_css', None) if self.event._type == EventType.conference else None
 
@@ -164,7 +176,7 @@ class EventLayoutImporter(EventMigrationStep):
             if not self.quiet:
                 self.print_success('- %[cyan]Layout settings')
             if logo:
-                self._process_logo(logo)
+                self._process_logo(logo, logo_result)
             if custom_css:
                 self._process_css(custom_css)
         else:
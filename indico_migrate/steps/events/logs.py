@@ -18,7 +18,6 @@ from __future__ import unicode_literals
 
 from datetime import datetime, timedelta
 
-from indico.core.db import db
 from indico.modules.events.logs import EventLogEntry, EventLogKind, EventLogRealm
 from indico.util.date_time import format_datetime, format_human_timedelta
 from indico.util.string import seems_html
@@ -47,16 +46,18 @@ class EventLogImporter(EventMigrationStep):
         if not hasattr(self.conf, '_logHandler'):
             self.print_error('Event has no log handler!')
             return
+        # events can have huge logs, so the entries are inserted using COPY
+        writer = self.bulk_writer(EventLogEntry)
         for item in self.conf._logHandler._logLists['emailLog']:
             entry = self._migrate_email_log(item)
-            db.session.add(entry)
+            writer.add(**entry)
             if not self.quiet:
-                self.print_success(str(entry))
+                self.print_success('%[cyan]{}%[reset] {}'.format(entry['realm'].name, entry['summary']))
         for item in self.conf._logHandler._logLists['actionLog']:
             entry = self._migrate_action_log(item)
-            db.session.add(entry)
+            writer.add(**entry)
             if not self.quiet:
-                self.print_success(str(entry))
+                self.print_success('%[cyan]{}%[reset] {}'.format(entry['realm'].name, entry['summary']))
 
     def _migrate_log(self, item):
         user = None
@@ -74,19 +75,18 @@ class EventLogImporter(EventMigrationStep):
             module = 'Timetable/Subcontribution'
         elif module.islower():
             module = module.title()
-        entry = EventLogEntry(event=self.event, logged_dt=self._naive_to_aware(item._logDate),
-                              module=module, user=user, kind=EventLogKind.other)
-        return entry
+        return {'event_id': self.event, 'logged_dt': self._naive_to_aware(item._logDate), 'module': module,
+                'user_id': user, 'kind': EventLogKind.other}
 
     def _migrate_email_log(self, item):
         info = item._logInfo
         entry = self._migrate_log(item)
-        entry.realm = EventLogRealm.emails
-        entry.type = 'email'
-        entry.summary = 'Sent email: {}'.format(convert_to_unicode(info['subject']).strip())
+        entry['realm'] = EventLogRealm.emails
+        entry['type'] = 'email'
+        entry['summary'] = 'Sent email: {}'.format(convert_to_unicode(info['subject']).strip())
         content_type = convert_to_unicode(info.get('contentType')) or (
             'text/html' if seems_html(info['body']) else 'text/plain')
-        entry.data = {
+        entry['data'] = {
             'from': convert_to_unicode(info['fromAddr']),
             'to': map(convert_to_unicode, set(info['toList'])),
             'cc': map(convert_to_unicode, set(info['ccList'])),
@@ -100,8 +100,9 @@ class EventLogImporter(EventMigrationStep):
     def _migrate_action_log(self, item):
         info = item._logInfo
         entry = self._migrate_log(item)
-        entry.realm = EventLogRealm.event
-        entry.type = 'simple'
-        entry.summary = convert_to_unicode(info['subject']).strip()
-        entry.data = {convert_to_unicode(k): _convert_data(self.conf, v) for k, v in info.iteritems() if k != 'subject'}
+        entry['realm'] = EventLogRealm.event
+        entry['type'] = 'simple'
+        entry['summary'] = convert_to_unicode(info['subject']).strip()
+        entry['data'] = {convert_to_unicode(k): _convert_data(self.conf, v)
+                         for k, v in info.iteritems() if k != 'subject'}
         return entry
@@ -240,7 +240,7 @@ class EventLegacyIdImporter(EventMigrationStep):
 
     def migrate(self):
         if self.is_legacy_event:
-            db.session.add(LegacyEventMapping(legacy_event_id=self.conf.id, event_id=self.event.id))
+            self.bulk_writer(LegacyEventMapping).add(legacy_event_id=self.conf.id, event_id=self.event.id)
             if not self.quiet:
                 self.print_success('-> %[cyan]{}'.format(self.event.id))
 
@@ -300,6 +300,15 @@ class EventAttachmentsImporter(AttachmentMixin, EventMigrationStep):
         self._set_config_options(**kwargs)
         super(EventAttachmentsImporter, self).__init__(*args, **kwargs)
 
+    def prepare(self, conf):
+        self.prefetch_attachments(conf, conf.id)
+        for old_session in conf.sessions.itervalues():
+            self.prefetch_attachments(old_session, conf.id)
+        for old_contrib in conf.contributions.itervalues():
+            self.prefetch_attachments(old_contrib, conf.id)
+            for old_subcontrib in old_contrib._subConts:
+                self.prefetch_attachments(old_subcontrib, conf.id)
+
     def migrate(self):
         self.migrate_event_attachments()
 
@@ -0,0 +1,281 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import division, unicode_literals
+
+import traceback
+from collections import namedtuple
+from math import ceil
+from multiprocessing import Process, Queue
+from Queue import Empty
+
+from indico.core.db import db
+from indico.modules.events.models.events import Event
+from indico.modules.events.surveys.models.surveys import Survey
+
+from indico_migrate.bulk import bulk_writers
+from indico_migrate.dedup import content_index
+from indico_migrate.fileinfo import file_info
+from indico_migrate.importer import Importer
+from indico_migrate.logger import QueueLogger
+from indico_migrate.steps.events.importer import EventContextFactory
+from indico_migrate.util import UnbreakingDB, get_storage
+
+
+EventShard = namedtuple('EventShard', ('index', 'min_key', 'max_key', 'size'))
+
+
+def split_into_shards(keys, n, get_weight=None):
+    """Split the ordered conference IDs in `keys` into `n` ID ranges.
+
+    :param keys: The conference IDs in the order they are migrated
+    :param n: The number of shards
+    :param get_weight: A function returning the estimated amount of work
+                       for a conference ID.  If specified, all shards get
+                       roughly the same amount of work instead of the same
+                       number of conferences.
+    """
+    shards = []
+    if get_weight is None:
+        size = int(ceil(len(keys) / n)) or 1
+        for i in xrange(0, len(keys), size):
+            chunk = keys[i:i + size]
+            shards.append(EventShard(len(shards), chunk[0], chunk[-1], len(chunk)))
+        return shards
+    total = sum(get_weight(key) for key in keys)
+    start = 0
+    done = 0
+    for i, key in enumerate(keys):
+        done += get_weight(key)
+        if done >= total * (len(shards) + 1) / n or i == len(keys) - 1:
+            chunk = keys[start:i + 1]
+            shards.append(EventShard(len(shards), chunk[0], chunk[-1], len(chunk)))
+            start = i + 1
+    return shards
+
+
+def _run_shard(migration, shard, queue):
+    try:
+        queue.put(('result', (shard.index, migration.migrate_shard(shard, queue))))
+    except Exception:
+        db.session.rollback()
+        queue.put(('error', (shard.index, traceback.format_exc())))
+
+
+class ParallelEventMigration(object):
+    """Migrate events using multiple worker processes.
+
+    The conferences are split into shards by ID range (in the order in
+    which they are migrated) and each shard is migrated in a separate
+    process using its own ZODB and database connections.  Everything
+    which depends on the data of all events is taken care of in a final
+    merge phase in the main process.
+    """
+
+    def __init__(self, importer, workers):
+        self.importer = importer
+        self.workers = workers
+
+    def run(self):
+        if not self.importer.zodb_uri:
+            raise RuntimeError('The ZODB URI is required to run parallel event workers')
+        get_weight = self.importer.get_event_weight if self.importer.work_estimates is not None else None
+        shards = split_into_shards(self.importer.conference_order.keys(), self.workers, get_weight)
+        for shard in shards:
+            self.importer.print_info('Shard %[cyan]{}%[reset]: %[white!]{}%[reset] - %[white!]{}%[reset] ({} events)'
+                                     .format(shard.index, shard.min_key, shard.max_key, shard.size), always=True)
+        self._prepare()
+        results = self._run_workers(shards, self.importer.get_progress_total())
+        self._merge(results)
+
+    def _prepare(self):
+        if self.importer.migrate_broken_events:
+            # create it now, otherwise each worker would create its own one
+            self.importer.get_lostandfound_category()
+        db.session.commit()
+        # the workers must not inherit any connections from our pool
+        db.engine.dispose()
+
+    def _run_workers(self, shards, total):
+        queue = Queue()
+        processes = {shard.index: Process(target=_run_shard, args=(self, shard, queue)) for shard in shards}
+        for process in processes.itervalues():
+            process.daemon = True
+            process.start()
+        results = {}
+        errors = {}
+        pending = {}
+        get_status = None
+        if self.importer.pipeline_depth:
+            def get_status():
+                return 'queue {}/{}'.format(sum(pending.itervalues()), self.importer.pipeline_depth * len(shards))
+        try:
+            it = self._iter_worker_messages(queue, processes, results, errors, pending)
+            if self.importer.quiet:
+                it = self.importer.logger.progress_iterator('Migrating Events', it, total, unicode, lambda x: '',
+                                                            get_weight=self.importer.get_event_weight,
+                                                            get_status=get_status,
+                                                            count=self.importer.get_progress_count())
+            for __ in it:
+                pass
+        finally:
+            for process in processes.itervalues():
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+        if errors:
+            for index, error in sorted(errors.iteritems()):
+                self.importer.print_error('%[red!]Shard {} failed:%[reset]\n{}'.format(index, error))
+            raise RuntimeError('{} of {} event shards failed'.format(len(errors), len(shards)))
+        return [results[shard.index] for shard in shards]
+
+    def _iter_worker_messages(self, queue, processes, results, errors, pending):
+        running = set(processes)
+        while running:
+            try:
+                msg_type, data = queue.get(timeout=1)
+            except Empty:
+                for index in list(running):
+                    if not processes[index].is_alive():
+                        errors[index] = 'Worker died unexpectedly (exit code {})'.format(processes[index].exitcode)
+                        running.discard(index)
+                continue
+            if msg_type == 'msg':
+                icon, msg, always, prefix, event_id = data
+                self.importer.logger.print_msg(icon, msg, always=always, prefix=prefix, event_id=event_id)
+            elif msg_type == 'progress':
+                index, conf_id, pending[index] = data
+                yield conf_id
+            elif msg_type == 'result':
+                results[data[0]] = data[1]
+                running.discard(data[0])
+            elif msg_type == 'error':
+                errors[data[0]] = data[1]
+                running.discard(data[0])
+                # no point in continuing with the other shards
+                break
+
+    def migrate_shard(self, shard, queue):
+        """Migrate the events of a shard; runs in the worker process."""
+        importer = self.importer
+        importer.logger = QueueLogger(queue, importer.quiet)
+        if importer.profiler is not None:
+            Importer._profiler = importer.profiler.fork()
+        Importer._cache_manager = importer.cache_manager.fork()
+        bulk_writers.reset()
+        file_info.reset()
+        content_index.fork()
+        importer.zodb_root = UnbreakingDB(get_storage(importer.zodb_uri, read_only=True, quiet=True)).open().root()
+        importer.conference_order = importer.conference_order.rebind(importer.zodb_root['conferences'])
+        importer.cache_manager.start_step(importer.zodb_root._p_jar)
+        # only keep track of what is created by this worker
+        importer.global_ns.legacy_event_ids.clear()
+        importer.global_ns.used_short_urls.clear()
+        importer.global_ns.legacy_survey_mapping.clear()
+
+        importers = importer.create_importers()
+        for step in importers:
+            step.setup()
+        EventContext = EventContextFactory(importer.zodb_root['counters']['CONFERENCE'], importer,
+                                           importer.zodb_root['conferences'].keys(), importer.event_id_map)
+        if importer.profiler is None:
+            importer.migrate_events(self._iter_shard(shard, queue), importers, EventContext,
+                                    range_start=shard.min_key)
+        else:
+            with importer.profiler.measure_step('EventImporter'):
+                importer.migrate_events(self._iter_shard(shard, queue), importers, EventContext,
+                                        range_start=shard.min_key)
+        db.session.commit()
+
+        g = importer.global_ns
+        return {
+            'legacy_event_ids': {conf_id: event.id for conf_id, event in g.legacy_event_ids.iteritems()},
+            'used_short_urls': {url: event.id for url, event in g.used_short_urls.iteritems()},
+            'legacy_survey_mapping': {conf.id: survey.id for conf, survey in g.legacy_survey_mapping.iteritems()},
+            'profile': importer.profiler.export() if importer.profiler is not None else None,
+            'cache_stats': importer.cache_manager.export(importer.zodb_root._p_jar),
+            'checksum_stats': file_info.checksum_cache.export() if file_info.checksum_cache is not None else None,
+            'content_stats': content_index.export()
+        }
+
+    def _iter_shard(self, shard, queue):
+        for conf in self.importer._iter_events(shard.min_key, shard.max_key):
+            conf_id = conf.id
+            yield conf
+            pipeline = bulk_writers.pipeline
+            queue.put(('progress', (shard.index, conf_id, pipeline.pending if pipeline is not None else 0)))
+
+    def _merge(self, results):
+        g = self.importer.global_ns
+        for result in results:
+            self.importer.cache_manager.merge(result['cache_stats'])
+            if result['checksum_stats'] is not None:
+                file_info.checksum_cache.merge(result['checksum_stats'])
+            content_index.merge(result['content_stats'])
+            if self.importer.profiler is not None:
+                self.importer.profiler.merge(result['profile'])
+        self._merge_short_urls(results)
+        event_ids = {conf_id: event_id for result in results for conf_id, event_id in
+                     result['legacy_event_ids'].iteritems()}
+        events = self._query_by_id(Event, event_ids.viewvalues())
+        g.legacy_event_ids.update((conf_id, events[event_id]) for conf_id, event_id in event_ids.iteritems())
+        survey_ids = {conf_id: survey_id for result in results for conf_id, survey_id in
+                      result['legacy_survey_mapping'].iteritems()}
+        surveys = self._query_by_id(Survey, survey_ids.viewvalues())
+        conferences = self.importer.zodb_root['conferences']
+        g.legacy_survey_mapping.update((conferences[conf_id], surveys[survey_id])
+                                       for conf_id, survey_id in survey_ids.iteritems())
+
+        lostandfound = g.lostandfound_category
+        if lostandfound is not None and not Event.query.filter_by(category_id=lostandfound.id).has_rows():
+            self.importer.print_info('Deleting the unused Lost & Found category')
+            db.session.delete(lostandfound)
+            g.lostandfound_category = None
+        db.session.commit()
+
+        for step in self.importer.create_importers():
+            step.teardown()
+        self.importer.fix_sequences('events', {'events'})
+
+    def _merge_short_urls(self, results):
+        """Discard shortcut URLs which collide across shards.
+
+        Collisions within a shard are already handled by the workers.
+        """
+        # start with the URLs of events which have been migrated before resuming
+        used_short_urls = {url: event.id for url, event in self.importer.global_ns.used_short_urls.iteritems()}
+        conflicts = set()
+        for result in results:
+            for url, event_id in sorted(result['used_short_urls'].iteritems()):
+                conflict = used_short_urls.get(url)
+                if conflict is not None:
+                    self.importer.print_error('%[red!]Shorturl %[reset]%[red]{}%[red!] collides with that of event '
+                                              '%[reset]%[red]{}%[red!]; discarding both'.format(url, conflict))
+                    conflicts |= {event_id, conflict}
+                else:
+                    used_short_urls[url] = event_id
+        if conflicts:
+            Event.query.filter(Event.id.in_(conflicts)).update({Event.url_shortcut: None}, synchronize_session=False)
+        events = self._query_by_id(Event, used_short_urls.viewvalues())
+        self.importer.global_ns.used_short_urls.update((url, events[event_id])
+                                                       for url, event_id in used_short_urls.iteritems())
+
+    def _query_by_id(self, model, ids, chunk_size=10000):
+        ids = sorted(set(ids))
+        objs = {}
+        for i in xrange(0, len(ids), chunk_size):
+            objs.update((obj.id, obj) for obj in model.query.filter(model.id.in_(ids[i:i + chunk_size])))
+        return objs
@@ -0,0 +1,133 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import threading
+import traceback
+from collections import deque
+from Queue import Queue
+
+from ZODB.POSException import POSKeyError
+from ZODB.serialize import referencesf
+from ZODB.utils import get_pickle_metadata
+
+from indico_migrate.util import SHARED_LEGACY_CLASSES
+
+
+class ConferencePrefetcher(object):
+    """Load the data of upcoming conferences in a background thread.
+
+    The records of all objects reachable from the next conferences are
+    loaded directly from the storage, which puts them into the ZEO client
+    cache before the event migration needs them.  The records are never
+    unpickled, so the main thread's connection is not touched at all.
+
+    Objects shared by many events (users, categories, other conferences,
+    ...) are loaded but their references are not followed.
+
+    :param storage: The ZODB storage containing the conferences
+    :param window: The number of conferences to prefetch in advance
+    :param max_objects: The maximum number of objects to load for a
+                        single conference
+    """
+
+    #: classes whose references are not followed
+    shared_classes = SHARED_LEGACY_CLASSES
+
+    def __init__(self, storage, window=10, max_objects=100000):
+        self.storage = storage
+        self.window = window
+        self.max_objects = max_objects
+        self.loaded = 0
+        self.prefetched = 0
+        self.error = None
+        # only available in newer ZEO versions, which can load many records in a single round trip
+        self._bulk_prefetch = getattr(storage, 'prefetch', None)
+        self._queue = Queue()
+        self._consumed = 0
+        self._stopped = False
+        self._thread = None
+
+    def iterate(self, conferences):
+        """Iterate over `conferences` while prefetching the following ones.
+
+        :param conferences: An iterable of legacy conferences.  They must
+                            not have been loaded yet, since their data is
+                            only needed to get their OIDs.
+        """
+        self._thread = threading.Thread(target=self._run, name='conference-prefetcher')
+        self._thread.daemon = True
+        self._thread.start()
+        pending = deque()
+        try:
+            for n, conf in enumerate(conferences):
+                pending.append(conf)
+                self._queue.put((n, conf._p_oid))
+                if len(pending) > self.window:
+                    yield self._next(pending)
+            while pending:
+                yield self._next(pending)
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped = True
+        self._queue.put((None, None))
+        self._thread.join()
+        self._thread = None
+
+    def _next(self, pending):
+        self._consumed += 1
+        return pending.popleft()
+
+    def _run(self):
+        try:
+            while True:
+                n, oid = self._queue.get()
+                if self._stopped or oid is None:
+                    break
+                elif n < self._consumed:
+                    # the migration already got there
+                    continue
+                self._walk(oid)
+                self.prefetched += 1
+        except Exception:
+            self.error = traceback.format_exc()
+
+    def _walk(self, root_oid):
+        seen = set()
+        level = [root_oid]
+        while level and not self._stopped and len(seen) < self.max_objects:
+            level = [oid for oid in level if oid not in seen]
+            if self._bulk_prefetch is not None and level:
+                self._bulk_prefetch(level, self.storage.lastTransaction())
+            next_level = []
+            for oid in level:
+                if oid in seen:
+                    continue
+                seen.add(oid)
+                try:
+                    data = self.storage.load(oid, '')[0]
+                except POSKeyError:
+                    continue
+                self.loaded += 1
+                if oid != root_oid and get_pickle_metadata(data)[1] in self.shared_classes:
+                    continue
+                referencesf(data, next_level)
+            level = next_level
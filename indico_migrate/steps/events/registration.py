@@ -612,13 +612,29 @@ class EventRegFormImporter(LocalFileImporterMixin, EventMigrationStep):
             registration.state = RegistrationState.unpaid
         # create the legacy mapping
         if hasattr(old_reg, '_randomId'):
-            registration.legacy_mapping = LegacyRegistrationMapping(
+            self.bulk_writer(LegacyRegistrationMapping).add(
                 event_id=self.event.id,
                 legacy_registrant_id=int(old_reg._id),
-                legacy_registrant_key=convert_to_unicode(old_reg._randomId)
+                legacy_registrant_key=convert_to_unicode(old_reg._randomId),
+                registration_id=registration
             )
+        self._bulk_insert_registration_data(registration)
         return registration
 
+    def _bulk_insert_registration_data(self, registration):
+        """Insert the data of a registration using COPY.
+
+        The data objects are only needed to calculate the price of the
+        registration, so afterwards they are removed from the session.
+        """
+        writer = self.bulk_writer(RegistrationData)
+        columns = [col.key for col in RegistrationData.__table__.c
+                   if col.key not in {'registration_id', 'field_data_id'}]
+        for data in registration.data:
+            writer.add(registration_id=registration, field_data_id=data.field_data,
+                       **{key: getattr(data, key) for key in columns})
+        registration.data = []
+
     def _fix_email(self, email):
         email = convert_to_unicode(email).lower()
         try:
@@ -233,7 +233,8 @@ class EventTimetableImporter(EventMigrationStep):
         if not self.quiet:
             self.print_info('%[cyan]Contribution%[reset] {}'.format(contrib.title))
         self.event_ns.legacy_contribution_map[old_contrib] = contrib
-        contrib.legacy_mapping = LegacyContributionMapping(event=self.event, legacy_contribution_id=old_contrib.id)
+        self.bulk_writer(LegacyContributionMapping).add(event_id=self.event.id, legacy_contribution_id=old_contrib.id,
+                                                        contribution_id=contrib)
         # contribution type
         if old_contrib._type is not None:
             try:
@@ -272,9 +273,10 @@ class EventTimetableImporter(EventMigrationStep):
         if not self.quiet:
             self.print_info('  %[cyan!]SubContribution%[reset] {}'.format(subcontrib.title))
         self.event_ns.legacy_subcontribution_map[old_subcontrib] = subcontrib
-        subcontrib.legacy_mapping = LegacySubContributionMapping(event=self.event,
-                                                                 legacy_contribution_id=old_contrib.id,
-                                                                 legacy_subcontribution_id=old_subcontrib.id)
+        self.bulk_writer(LegacySubContributionMapping).add(event_id=self.event.id,
+                                                           legacy_contribution_id=old_contrib.id,
+                                                           legacy_subcontribution_id=old_subcontrib.id,
+                                                           subcontribution_id=subcontrib)
         subcontrib.references = list(self._process_references(SubContributionReference, old_subcontrib))
         subcontrib.person_links = list(self._migrate_subcontribution_person_links(old_subcontrib))
         return subcontrib
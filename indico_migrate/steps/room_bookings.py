@@ -63,6 +63,9 @@ class RoomBookingsImporter(TopLevelMigrationStep):
 
     @step_description('Room Bookings')
     def migrate(self):
+        # occurrences and edit logs are by far the biggest tables, so they are inserted using COPY
+        occurrence_writer = self.bulk_writer(ReservationOccurrence)
+        edit_log_writer = self.bulk_writer(ReservationEditLog)
         i = 1
         for rid, v in self.rb_root['Reservations'].iteritems():
             room = Room.get(v.room.id)
@@ -112,22 +115,27 @@ class RoomBookingsImporter(TopLevelMigrationStep):
                             d = datetime.strptime(m.group(1), '%d %b %Y')
                             occurrence_rejection_reasons[d] = possible_rejection_reason[9:].strip('\'')
 
-                    el = ReservationEditLog(
+                    edit_log_writer.add(
+                        reservation_id=r.id,
                         timestamp=ts,
                         user_name=h._responsibleUser,
                         info=map(convert_to_unicode, h._info)
                     )
-                    r.edit_logs.append(el)
 
             notifications = getattr(v, 'startEndNotification', []) or []
             excluded_days = getattr(v, '_excludedDays', []) or []
-            ReservationOccurrence.create_series_for_reservation(r)
-            for occ in r.occurrences:
-                occ.notification_sent = occ.date in notifications
-                occ.is_rejected = r.is_rejected
-                occ.is_cancelled = r.is_cancelled or occ.date in excluded_days
-                occ.rejection_reason = (convert_to_unicode(occurrence_rejection_reasons[occ.date])
-                                        if occ.date in occurrence_rejection_reasons else None)
+            for start_dt in ReservationOccurrence.iter_start_time(r.start_dt, r.end_dt, r.repetition):
+                date = start_dt.date()
+                occurrence_writer.add(
+                    reservation_id=r.id,
+                    start_dt=start_dt,
+                    end_dt=datetime.combine(date, r.end_dt.time()),
+                    notification_sent=date in notifications,
+                    is_rejected=r.is_rejected,
+                    is_cancelled=r.is_cancelled or date in excluded_days,
+                    rejection_reason=(convert_to_unicode(occurrence_rejection_reasons[date])
+                                      if date in occurrence_rejection_reasons else None)
+                )
 
             event_id = getattr(v, '_ReservationBase__owner', None)
             if hasattr(event_id, '_Impersistant__obj'):  # Impersistant object
@@ -16,7 +16,6 @@
 
 from __future__ import unicode_literals
 
-import os
 from collections import defaultdict
 from itertools import ifilter
 
@@ -37,6 +36,7 @@ from indico.util.date_time import as_utc
 from indico.util.string import is_valid_mail
 
 from indico_migrate.importer import TopLevelMigrationStep
+from indico_migrate.photos import RoomPhotoLoader
 from indico_migrate.util import convert_to_unicode, step_description
 
 
@@ -54,6 +54,13 @@ def get_canonical_name_of(old_room):
     return '{}-{}'.format(old_room._locationName, generate_name(old_room))
 
 
+def _get_photo_name(old_room):
+    try:
+        return get_canonical_name_of(old_room)
+    except UnicodeDecodeError:
+        return None
+
+
 def get_room_id(guid):
     return int(guid.split('|')[1].strip())
 
@@ -63,13 +70,24 @@ class RoomsLocationsImporter(TopLevelMigrationStep):
 
     def __init__(self, *args, **kwargs):
         self.photo_path = kwargs.pop('photo_path')
+        self.photo_workers = kwargs.pop('photo_workers', 4)
+        self.regenerate_thumbnails = kwargs.pop('regenerate_thumbnails', False)
         self.rb_root = kwargs.get('rb_root')
+        self.photo_loader = None
         super(RoomsLocationsImporter, self).__init__(*args, **kwargs)
 
     def migrate(self):
+        if self.photo_path:
+            self.load_photos()
         self.migrate_settings()
         self.migrate_locations()
-        self.migrate_rooms()
+        try:
+            self.migrate_rooms()
+        finally:
+            if self.photo_loader:
+                self.photo_loader.close()
+        if self.photo_loader:
+            self.report_photos()
         self.migrate_blockings()
         db.session.commit()
         self.fix_sequences('roombooking')
@@ -90,6 +108,21 @@ class RoomsLocationsImporter(TopLevelMigrationStep):
         rb_settings.set('notification_before_days', opts['notificationBefore']._PluginOption__value)
         db.session.flush()
 
+    def load_photos(self):
+        self.photo_loader = RoomPhotoLoader(self.photo_path, self.photo_workers, self.regenerate_thumbnails)
+        # the photos are read while migrating the rooms, so they need to be in the same order
+        self.photo_loader.load(filter(None, (_get_photo_name(old_room)
+                                             for old_room in self.rb_root['Rooms'].itervalues())))
+        if self.regenerate_thumbnails and self.photo_loader.thumbnail_size is None:
+            self.print_warning('%[yellow!]There are no thumbnails to take the size of new ones from; no thumbnails '
+                               'will be generated')
+
+    def report_photos(self):
+        self.print_info(self.photo_loader.format_stats(), always=True)
+        if self.photo_loader.missing:
+            self.print_warning('%[yellow!]No photos for %[cyan]{}%[yellow!] rooms:%[reset] {}'
+                               .format(len(self.photo_loader.missing), ', '.join(sorted(self.photo_loader.missing))))
+
     @step_description('Room locations')
     def migrate_locations(self):
         default_location_name = self.zodb_root['DefaultRoomBookingLocation']
@@ -238,24 +271,11 @@ class RoomsLocationsImporter(TopLevelMigrationStep):
                 )
                 self.print_info('  %[blue!]Nonbookable:%[reset] {}'.format(r.nonbookable_periods[-1]))
 
-            if self.photo_path:
-                try:
-                    with open(os.path.join(self.photo_path, 'large_photos',
-                                           get_canonical_name_of(old_room) + '.jpg'), 'rb') as f:
-                        large_photo = f.read()
-                except Exception:
-                    large_photo = None
-
-                try:
-                    with open(os.path.join(self.photo_path, 'small_photos',
-                                           get_canonical_name_of(old_room) + '.jpg'), 'rb') as f:
-                        small_photo = f.read()
-                except Exception:
-                    small_photo = None
-
-                if large_photo and small_photo:
-                    r.photo = Photo(data=large_photo, thumbnail=small_photo)
-                    self.print_info('  %[blue!]Photos')
+            photos = self.photo_loader.get(_get_photo_name(old_room)) if self.photo_loader else None
+            if photos is not None:
+                large_photo, small_photo = photos
+                r.photo = Photo(data=large_photo, thumbnail=small_photo)
+                self.print_info('  %[blue!]Photos')
 
             new_eq = []
             for old_equipment in ifilter(None, old_room._equipment.split('`') + old_room.avaibleVC):
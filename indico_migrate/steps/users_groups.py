@@ -16,9 +16,10 @@
 
 from __future__ import unicode_literals
 
-from collections import defaultdict
+from collections import Counter
 from datetime import timedelta
-from operator import attrgetter
+from multiprocessing import Pool
+from operator import attrgetter, itemgetter
 from uuid import uuid4
 
 import pytz
@@ -30,14 +31,19 @@ from indico.modules.api import APIKey
 from indico.modules.auth import Identity
 from indico.modules.groups.models.groups import LocalGroup
 from indico.modules.users import User, user_settings
+from indico.modules.users.models.affiliations import UserAffiliation
+from indico.modules.users.models.emails import UserEmail
+from indico.modules.users.models.settings import UserSetting
 from indico.modules.users.models.users import UserTitle
 from indico.util.caching import memoize
 from indico.util.i18n import get_all_locales
+from indico.util.passwords import BCryptPassword
 from indico.util.string import is_valid_mail, sanitize_email
 from indico.util.struct.iterables import committing_iterator
 
-from indico_migrate.importer import TopLevelMigrationStep
-from indico_migrate.util import convert_to_unicode, step_description
+from indico_migrate.importer import Importer, TopLevelMigrationStep
+from indico_migrate.storage_order import get_record_index, iter_storage_order, sort_by_position
+from indico_migrate.util import UnbreakingDB, convert_to_unicode, get_storage, step_description
 
 
 USER_TITLE_MAP = {x.title: x for x in UserTitle}
@@ -50,6 +56,73 @@ SYNCED_FIELD_MAP = {
 }
 
 
+def resolve_merge_chains(merge_targets):
+    """Find the avatar each merged avatar has ultimately been merged into.
+
+    Every avatar is visited only once, no matter how long the chains of
+    merges are.
+
+    :param merge_targets: A dict mapping avatar IDs to the ID of the
+                          avatar they have been merged into
+    :return: A tuple ``(roots, chain_lengths, cycles)``.  `roots` maps
+             each merged avatar to the avatar at the end of its chain
+             (``None`` if the chain ends in a cycle), `chain_lengths`
+             maps it to the number of merges until that avatar, and
+             `cycles` is a list of the cycles found, each of them being
+             a list of avatar IDs.
+    """
+    roots = {}
+    chain_lengths = {}
+    cycles = []
+    in_cycle = set()
+    for start in merge_targets:
+        path = []
+        positions = {}
+        avatar_id = start
+        while avatar_id in merge_targets and avatar_id not in roots and avatar_id not in in_cycle:
+            if avatar_id in positions:
+                cycle = path[positions[avatar_id]:]
+                cycles.append(cycle)
+                in_cycle.update(cycle)
+                break
+            positions[avatar_id] = len(path)
+            path.append(avatar_id)
+            avatar_id = merge_targets[avatar_id]
+        if avatar_id in in_cycle:
+            root = length = None
+        elif avatar_id in roots:
+            root, length = roots[avatar_id], chain_lengths[avatar_id]
+        else:
+            root, length = avatar_id, 0
+        for avatar_id in reversed(path):
+            if avatar_id in in_cycle:
+                continue
+            if length is not None:
+                length += 1
+            roots[avatar_id] = root
+            chain_lengths[avatar_id] = length
+    for avatar_id in in_cycle:
+        roots[avatar_id] = chain_lengths[avatar_id] = None
+    return roots, chain_lengths, cycles
+
+
+# the importer used by the avatar worker processes
+_worker_importer = None
+
+
+def _init_avatar_worker(importer):
+    global _worker_importer
+    Importer._cache_manager = importer.cache_manager.fork()
+    importer.zodb_root = UnbreakingDB(get_storage(importer.zodb_uri, read_only=True, quiet=True)).open().root()
+    _worker_importer = importer
+
+
+def _convert_avatar_chunk(avatar_ids):
+    importer = _worker_importer
+    avatars = importer.zodb_root['avatars']
+    return [importer._convert_avatar(avatar) for avatar in importer.flushing_iterator(avatars[x] for x in avatar_ids)]
+
+
 @memoize
 def _get_all_locales():
     return set(get_all_locales())
@@ -62,10 +135,13 @@ class UserImporter(TopLevelMigrationStep):
         self.ldap_provider_name = kwargs.pop('ldap_provider_name')
         self.ignore_local_accounts = kwargs.pop('ignore_local_accounts')
         self.system_user_id = kwargs.pop('system_user_id')
+        self.storage_order = kwargs.pop('storage_order', False)
+        self.user_workers = kwargs.pop('user_workers', 1)
+        self.zodb_uri = kwargs.get('zodb_uri')
         super(UserImporter, self).__init__(*args, **kwargs)
 
     def migrate(self):
-        self.unresolved_merge_targets = defaultdict(set)
+        self.merge_targets = {}
         self.favorite_avatars = {}
         self.migrate_users()
         self.fix_sequences('users', {'users'})
@@ -97,62 +173,58 @@ class UserImporter(TopLevelMigrationStep):
 
     @step_description('Users')
     def migrate_users(self):
+        users = self._convert_users()
+        self._insert_users(users)
+        self._load_users()
+
+    def _convert_users(self):
+        """Create the users and resolve any collisions between them.
+
+        The users are not added to the session, so email collisions are
+        resolved in memory without any database queries.
+
+        :return: A list of ``(user, settings)`` tuples
+        """
         seen_identities = set()
+        users = []
 
-        for avatar in committing_iterator(self._iter_avatars(), 5000):
-            if getattr(avatar, '_mergeTo', None):
-                self.print_warning('Skipping {} - merged into {}'.format(avatar.id, avatar._mergeTo.id))
-                merged_user = self.global_ns.avatar_merged_user.get(avatar._mergeTo.id)
-                if merged_user:
-                    self.global_ns.avatar_merged_user[avatar.id] = merged_user
-                else:
-                    # if the merge target hasn't yet been migrated, keep track of it
-                    self.unresolved_merge_targets[avatar._mergeTo.id].add(avatar.id)
+        for record in self._iter_avatar_records():
+            if record['merge_target'] is not None:
+                self.print_warning('Skipping {} - merged into {}'.format(record['id'], record['merge_target']))
+                # the merge target may not have been migrated yet, so they are resolved at the end
+                self.merge_targets[record['id']] = record['merge_target']
                 continue
-            elif avatar.status == 'Not confirmed':
-                self.print_warning('Skipping {} - not activated'.format(avatar.id))
+            elif record['skip'] is not None:
+                self.print_warning('Skipping {} - {}'.format(record['id'], record['skip']))
                 continue
-            elif not avatar.name.strip() and not avatar.surName.strip():
-                links = {(obj, role): list(objs)
-                         for obj, x in avatar.linkedTo.iteritems()
-                         for role, objs in x.iteritems()
-                         if objs}
-                if not avatar.identities and not links:
-                    self.print_warning('Skipping {} - no names and no identities/links'.format(avatar.id))
-                    continue
 
-            user = self._user_from_avatar(avatar)
-            self._fix_collisions(user, avatar)
-            db.session.add(user)
-            settings = self._settings_from_avatar(avatar)
-            user_settings.set_multi(user, settings)
+            user = self._user_from_record(record)
+            self._fix_collisions(user, record)
+            users.append((user, record['settings']))
             # favorite users cannot be migrated here since the target user might not have been migrated yet
-            for old_categ in avatar.linkedTo['category']['favorite']:
-                if old_categ:
-                    self.global_ns.user_favorite_categories[old_categ.id].add(user)
-            db.session.flush()
+            for categ_id in record['favorite_categories']:
+                self.global_ns.user_favorite_categories[categ_id].add(user)
             self.print_success('%[white!]{:6d}%[reset] %[cyan]{}%[reset] [%[blue!]{}%[reset]] '
                                '{{%[cyan!]{}%[reset]}}'.format(user.id, user.full_name, user.email,
                                                                ', '.join(user.secondary_emails)))
             # migrate API keys
-            self._migrate_api_keys(avatar, user)
+            self._migrate_api_keys(record, user)
             # migrate identities of avatars
-            for old_identity in avatar.identities:
+            for data in record['identities']:
                 identity = None
-                username = convert_to_unicode(old_identity.login).strip().lower()
+                username = data['username']
 
                 if not username:
-                    self.print_warning("Empty username: {}. Skipping identity.".format(old_identity))
+                    self.print_warning("Empty username: {}. Skipping identity.".format(data['description']))
                     continue
 
                 provider = {
                     'LocalIdentity': 'indico',
                     'LDAPIdentity': self.ldap_provider_name
-                }.get(old_identity.__class__.__name__)
+                }.get(data['class_name'])
 
                 if provider is None:
-                    self.print_error("Unsupported provider: {}. Skipping identity.".format(
-                        old_identity.__class__.__name__))
+                    self.print_error("Unsupported provider: {}. Skipping identity.".format(data['class_name']))
                     continue
 
                 if (provider, username) in seen_identities:
@@ -160,18 +232,12 @@ class UserImporter(TopLevelMigrationStep):
                     continue
 
                 if provider == 'indico' and not self.ignore_local_accounts:
-                    identity = Identity(provider=provider, identifier=username)
-
-                    if not hasattr(old_identity, 'algorithm'):  # plaintext password
-                        if not old_identity.password:
-                            # password is empty, skip identity
-                            self.print_error("Identity '{}' has empty password. Skipping identity.".format(
-                                              old_identity.login))
-                            continue
-                        identity.password = old_identity.password
-                    else:
-                        assert old_identity.algorithm == 'bcrypt'
-                        identity.password_hash = old_identity.password
+                    if data['empty_password']:
+                        # password is empty, skip identity
+                        self.print_error("Identity '{}' has empty password. Skipping identity.".format(
+                                          data['login']))
+                        continue
+                    identity = Identity(provider=provider, identifier=username, password_hash=data['password_hash'])
 
                 elif provider == self.ldap_provider_name:
                     identity = Identity(provider=provider, identifier=username)
@@ -181,53 +247,108 @@ class UserImporter(TopLevelMigrationStep):
                     user.identities.add(identity)
                     seen_identities.add((provider, username))
 
-            if hasattr(avatar, 'personalInfo') and avatar.personalInfo._basket._users:
-                self.favorite_avatars[user.id] = avatar.personalInfo._basket._users
+            if record['favorite_avatars']:
+                self.favorite_avatars[user.id] = record['favorite_avatars']
 
             # Map old merged identities (no longer in AvatarHolder)
             # to newly created user
-            for merged_avatar in getattr(avatar, '_mergeFrom', ()):
-                if merged_avatar.id != avatar.id:
-                    self.global_ns.avatar_merged_user[merged_avatar.id] = user
-
-            self.global_ns.avatar_merged_user[avatar.id] = user
-            if avatar.id in self.unresolved_merge_targets:
-                del self.unresolved_merge_targets[avatar.id]
-                self._resolve_merge_targets(avatar.id, user)
-        db.session.flush()
-
-    def _resolve_merge_targets(self, avatar_id, user):
-        for source_av, target_av in self.unresolved_merge_targets.items():
-            if target_av == avatar_id:
-                self.global_ns.avatar_merged_user[source_av] = user
-                del self.unresolved_merge_targets[source_av]
-                self._resolve_merge_targets(source_av, user)
+            for merged_avatar_id in record['merged_from']:
+                self.global_ns.avatar_merged_user[merged_avatar_id] = user
+
+            self.global_ns.avatar_merged_user[record['id']] = user
+        self._resolve_merge_targets()
+        return users
+
+    def _insert_users(self, users):
+        """Insert the users created by `_convert_users` using ``COPY``."""
+        user_writer = self.bulk_writer(User)
+        writers = [self.bulk_writer(model) for model in (UserAffiliation, UserEmail, Identity, APIKey, UserSetting)]
+        it = enumerate(users, 1)
+        if self.quiet:
+            it = self.logger.progress_iterator('Inserting users', it, len(users), lambda x: unicode(x[1][0].id),
+                                               lambda x: '')
+        # the rows must not be written before the users they belong to
+        with db.session.no_autoflush:
+            for n, (user, settings) in it:
+                user_writer.add_object(user)
+                writers[0].add_object(user._affiliation, user_id=user.id)
+                for email in [user._primary_email] + list(user._secondary_emails):
+                    writers[1].add_object(email, user_id=user.id)
+                for identity in user.identities:
+                    writers[2].add_object(identity, user_id=user.id)
+                for api_key in filter(None, [user.api_key] + list(user.old_api_keys)):
+                    writers[3].add_object(api_key, user_id=user.id)
+                for name, value in settings.iteritems():
+                    writers[4].add(user_id=user.id, module=user_settings.module, name=name, value=value)
+                if n % 5000 == 0:
+                    for writer in [user_writer] + writers:
+                        writer.flush()
+            for writer in [user_writer] + writers:
+                writer.flush()
+        db.session.commit()
 
-    def _migrate_api_keys(self, avatar, user):
-        ak = getattr(avatar, 'apiKey', None)
-        if not ak:
+    def _load_users(self):
+        """Replace the users created by `_convert_users` with the inserted ones."""
+        users = {user.id: user for user in User.query}
+        g = self.global_ns
+        for mapping in (g.avatar_merged_user, g.users_by_primary_email, g.users_by_secondary_email):
+            for key, user in mapping.items():
+                mapping[key] = users[user.id]
+        for categ_id, category_users in g.user_favorite_categories.items():
+            g.user_favorite_categories[categ_id] = {users[user.id] for user in category_users}
+
+    def _resolve_merge_targets(self):
+        """Map all merged avatars to the user they have ultimately been merged into."""
+        roots, chain_lengths, cycles = resolve_merge_chains(self.merge_targets)
+        for cycle in cycles:
+            self.print_warning('%[yellow!]Merge cycle:%[reset] {}'.format(' -> '.join(cycle + cycle[:1])), always=True)
+        unresolved = 0
+        for avatar_id, root in roots.iteritems():
+            user = self.global_ns.avatar_merged_user.get(root) if root is not None else None
+            if user is not None:
+                self.global_ns.avatar_merged_user[avatar_id] = user
+            elif avatar_id not in self.global_ns.avatar_merged_user:
+                unresolved += 1
+                self.print_warning('Merged avatar {} has no target user (merged into {})'
+                                   .format(avatar_id, root if root is not None else 'a cycle'))
+        lengths = Counter(length for length in chain_lengths.itervalues() if length is not None)
+        self.print_info('Resolved %[cyan]{}%[reset] merged avatars (%[yellow]{}%[reset] unresolved); chain lengths: {}'
+                        .format(len(roots) - unresolved, unresolved,
+                                ', '.join('{}: {}'.format(length, n) for length, n in sorted(lengths.iteritems()))
+                                or 'none'), always=True)
+
+    def _migrate_api_keys(self, record, user):
+        if record['api_key'] is None:
             return
-        last_used_uri = None
-        if ak._lastPath and ak._lastQuery:
-            last_used_uri = '{}?{}'.format(convert_to_unicode(ak._lastPath), convert_to_unicode(ak._lastQuery))
-        elif ak._lastPath:
-            last_used_uri = convert_to_unicode(ak._lastPath)
-
-        api_key = APIKey(token=ak._key, secret=ak._signKey, is_blocked=ak._isBlocked,
-                         is_persistent_allowed=getattr(ak, '_persistentAllowed', False),
-                         created_dt=self._to_utc(ak._createdDT), last_used_dt=self._to_utc(ak._lastUsedDT),
-                         last_used_ip=ak._lastUsedIP, last_used_uri=last_used_uri,
-                         last_used_auth=ak._lastUseAuthenticated, use_count=ak._useCount)
+        data = dict(record['api_key'])
+        old_keys = data.pop('old_keys')
+        api_key = APIKey(**data)
         user.api_key = api_key
         self.print_info('%[blue!]<->%[reset]  %[yellow]{}%[reset]'.format(api_key))
 
-        for old_key in ak._oldKeys:
+        for old_key in old_keys:
             # We have no creation time so we use *something* older..
-            fake_created_dt = self._to_utc(ak._createdDT) - timedelta(hours=1)
+            fake_created_dt = data['created_dt'] - timedelta(hours=1)
             # We don't have anything besides the api key for old keys, so we use a random secret
             user.old_api_keys.append(APIKey(token=old_key, secret=unicode(uuid4()), created_dt=fake_created_dt,
                                             is_active=False))
 
+    def _api_key_data_from_avatar(self, avatar):
+        ak = getattr(avatar, 'apiKey', None)
+        if not ak:
+            return None
+        last_used_uri = None
+        if ak._lastPath and ak._lastQuery:
+            last_used_uri = '{}?{}'.format(convert_to_unicode(ak._lastPath), convert_to_unicode(ak._lastQuery))
+        elif ak._lastPath:
+            last_used_uri = convert_to_unicode(ak._lastPath)
+        return {'token': ak._key, 'secret': ak._signKey, 'is_blocked': ak._isBlocked,
+                'is_persistent_allowed': getattr(ak, '_persistentAllowed', False),
+                'created_dt': self._to_utc(ak._createdDT), 'last_used_dt': self._to_utc(ak._lastUsedDT),
+                'last_used_ip': ak._lastUsedIP, 'last_used_uri': last_used_uri,
+                'last_used_auth': ak._lastUseAuthenticated, 'use_count': ak._useCount,
+                'old_keys': list(ak._oldKeys)}
+
     @step_description('Favorite users')
     def migrate_favorite_users(self):
         users = {u.id: u for u in User.find(User.id.in_(set(self.favorite_avatars)))}
@@ -294,24 +415,73 @@ class UserImporter(TopLevelMigrationStep):
             db.session.add(group)
         db.session.flush()
 
-    def _user_from_avatar(self, avatar, **kwargs):
+    def _convert_avatar(self, avatar):
+        """Convert an avatar to a record containing only plain data.
+
+        Nothing done here depends on other avatars or on the database,
+        so it can run in a worker process.
+        """
+        record = {'id': avatar.id, 'merge_target': None, 'skip': None}
+        if getattr(avatar, '_mergeTo', None):
+            record['merge_target'] = avatar._mergeTo.id
+            return record
+        elif avatar.status == 'Not confirmed':
+            record['skip'] = 'not activated'
+            return record
+        elif not avatar.name.strip() and not avatar.surName.strip():
+            links = {(obj, role): list(objs)
+                     for obj, x in avatar.linkedTo.iteritems()
+                     for role, objs in x.iteritems()
+                     if objs}
+            if not avatar.identities and not links:
+                record['skip'] = 'no names and no identities/links'
+                return record
+        has_basket = hasattr(avatar, 'personalInfo') and avatar.personalInfo._basket._users
+        record.update(user=self._user_data_from_avatar(avatar),
+                      settings=self._settings_from_avatar(avatar),
+                      has_identities=bool(avatar.identities),
+                      identities=[self._identity_data_from_legacy(x) for x in avatar.identities],
+                      api_key=self._api_key_data_from_avatar(avatar),
+                      favorite_categories=[categ.id for categ in avatar.linkedTo['category']['favorite'] if categ],
+                      favorite_avatars=list(avatar.personalInfo._basket._users) if has_basket else None,
+                      merged_from=[x.id for x in getattr(avatar, '_mergeFrom', ()) if x.id != avatar.id])
+        return record
+
+    def _user_data_from_avatar(self, avatar):
         email = sanitize_email(convert_to_unicode(avatar.email).lower().strip())
         secondary_emails = {sanitize_email(convert_to_unicode(x).lower().strip()) for x in avatar.secondaryEmails}
         secondary_emails = {x for x in secondary_emails if x and is_valid_mail(x, False) and x != email}
+        return {'id': int(avatar.id),
+                'email': email,
+                'first_name': convert_to_unicode(avatar.name).strip() or 'UNKNOWN',
+                'last_name': convert_to_unicode(avatar.surName).strip() or 'UNKNOWN',
+                'title': USER_TITLE_MAP.get(avatar.title, UserTitle.none),
+                'phone': convert_to_unicode(avatar.telephone[0]).strip(),
+                'affiliation': convert_to_unicode(avatar.organisation[0]).strip(),
+                'address': convert_to_unicode(avatar.address[0]).strip(),
+                'secondary_emails': secondary_emails,
+                'is_blocked': avatar.status == 'disabled'}
+
+    def _identity_data_from_legacy(self, old_identity):
+        username = convert_to_unicode(old_identity.login).strip().lower()
+        data = {'description': '{}'.format(old_identity), 'class_name': old_identity.__class__.__name__,
+                'login': old_identity.login, 'username': username, 'password_hash': None, 'empty_password': False}
+        if username and data['class_name'] == 'LocalIdentity' and not self.ignore_local_accounts:
+            if not hasattr(old_identity, 'algorithm'):  # plaintext password
+                # hashing is slow, so it is done here instead of when creating the identity
+                if old_identity.password:
+                    data['password_hash'] = BCryptPassword.hash(old_identity.password)
+                else:
+                    data['empty_password'] = True
+            else:
+                assert old_identity.algorithm == 'bcrypt'
+                data['password_hash'] = old_identity.password
+        return data
+
+    def _user_from_record(self, record):
         # we handle deletion later. otherwise it might be set before secondary_emails which would
         # result in those emails not being marked as deleted
-        user = User(id=int(avatar.id),
-                    email=email,
-                    first_name=convert_to_unicode(avatar.name).strip() or 'UNKNOWN',
-                    last_name=convert_to_unicode(avatar.surName).strip() or 'UNKNOWN',
-                    title=USER_TITLE_MAP.get(avatar.title, UserTitle.none),
-                    phone=convert_to_unicode(avatar.telephone[0]).strip(),
-                    affiliation=convert_to_unicode(avatar.organisation[0]).strip(),
-                    address=convert_to_unicode(avatar.address[0]).strip(),
-                    secondary_emails=secondary_emails,
-                    is_blocked=avatar.status == 'disabled',
-                    is_deleted=False,
-                    **kwargs)
+        user = User(is_deleted=False, **record['user'])
         if not is_valid_mail(user.email):
             user.is_deleted = True
         return user
@@ -342,21 +512,20 @@ class UserImporter(TopLevelMigrationStep):
 
         return settings
 
-    def _fix_collisions(self, user, avatar):
+    def _fix_collisions(self, user, record):
         is_deleted = user.is_deleted
         # Mark both users as deleted if there's a primary email collision
         coll = self.global_ns.users_by_primary_email.get(user.email)
         if coll and not is_deleted:
-            if bool(avatar.identities) ^ bool(coll.identities):
+            if record['has_identities'] ^ bool(coll.identities):
                 # exactly one of them has identities - keep the one that does
-                to_delete = {coll if avatar.identities else user}
+                to_delete = {coll if record['has_identities'] else user}
             else:
                 to_delete = {user, coll}
             for u in to_delete:
                 self.print_log('%[magenta!]---%[reset] %[yellow!]Deleting {} - primary email collision%[reset] '
                                '[%[blue!]{}%[reset]]'.format(u.id, u.email))
                 u.is_deleted = True
-                db.session.flush()
         # if the user was already deleted we don't care about primary email collisions
         if not is_deleted:
             self.global_ns.users_by_primary_email[user.email] = user
@@ -368,7 +537,6 @@ class UserImporter(TopLevelMigrationStep):
                            '[%[blue!]{}%[reset]])'.format(coll, user.email))
             coll.secondary_emails.remove(user.email)
             del self.global_ns.users_by_secondary_email[user.email]
-            db.session.flush()
 
         # Remove email from both users if there's a collision
         for email in list(user.secondary_emails):
@@ -378,14 +546,12 @@ class UserImporter(TopLevelMigrationStep):
                 self.print_log('%[magenta!]---%[reset] %[yellow!]Removing colliding secondary email '
                                '(S/P from {}%[reset] [%[blue!]{}%[reset]])'.format(user, email))
                 user.secondary_emails.remove(email)
-                db.session.flush()
             # colliding with a secondary email
             coll = self.global_ns.users_by_secondary_email.get(email)
             if coll:
                 self.print_log('%[magenta!]---%[reset] %[yellow!]Removing colliding secondary email '
                                '(S/S from {}%[reset] [%[blue!]{}%[reset]])'.format(user, email))
                 user.secondary_emails.remove(email)
-                db.session.flush()
                 self.global_ns.users_by_secondary_email[email] = coll
             # if the user was already deleted we don't care about secondary email collisions
             if not is_deleted and email in user.secondary_emails:
@@ -397,9 +563,57 @@ class UserImporter(TopLevelMigrationStep):
         server_tz = get_timezone(getattr(self.zodb_root['MaKaCInfo']['main'], '_timezone', 'UTC'))
         return server_tz.localize(dt).astimezone(pytz.utc)
 
-    def _iter_avatars(self):
-        it = self.zodb_root['avatars'].itervalues()
+    def _iter_avatar_records(self):
+        """Iterate over the records of all avatars in key order.
+
+        With ``--storage-order``, the avatars are read in the order they
+        are stored in, but the records are still returned in key order.
+        """
+        index = get_record_index(self.zodb_root) if self.storage_order else None
+        if self.user_workers > 1:
+            # merged avatars may now come before their merge target, which is handled by migrate_users
+            avatar_ids = sort_by_position(self.zodb_root['avatars'], index) if index is not None else None
+            it = self._iter_records_parallel(avatar_ids)
+        else:
+            if index is not None:
+                it = iter_storage_order(self.zodb_root['avatars'], index)
+            else:
+                it = self.zodb_root['avatars'].itervalues()
+            it = (self._convert_avatar(avatar) for avatar in self.flushing_iterator(it))
         if self.quiet:
-            it = self.logger.progress_iterator('Migrating users', it, len(self.zodb_root['avatars']), attrgetter('id'),
-                                               lambda x: '')
+            it = self.logger.progress_iterator('Migrating users', it, len(self.zodb_root['avatars']),
+                                               itemgetter('id'), lambda x: '')
+        if index is not None:
+            # collisions are resolved based on the order of the users, which must not depend on how they were read
+            positions = {avatar_id: i for i, avatar_id in enumerate(self.zodb_root['avatars'].iterkeys())}
+            return iter(sorted(it, key=lambda record: positions[record['id']]))
         return it
+
+    def _iter_records_parallel(self, avatar_ids=None, chunk_size=500):
+        """Convert the avatars in worker processes.
+
+        Each worker converts chunks of avatars using its own ZODB
+        connection; the records are returned in the same order as the
+        avatar IDs.
+
+        :param avatar_ids: The IDs of the avatars in the order they are
+                           migrated (by default the key order)
+        :param chunk_size: The number of avatars converted at once
+        """
+        if not self.zodb_uri:
+            raise RuntimeError('The ZODB URI is required to run parallel user workers')
+        if avatar_ids is None:
+            avatar_ids = list(self.zodb_root['avatars'].keys())
+        chunks = [avatar_ids[i:i + chunk_size] for i in xrange(0, len(avatar_ids), chunk_size)]
+        # the workers must not inherit any connections from our pool
+        db.session.commit()
+        db.engine.dispose()
+        pool = Pool(self.user_workers, _init_avatar_worker, (self,))
+        try:
+            for records in pool.imap(_convert_avatar_chunk, chunks):
+                for record in records:
+                    yield record
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
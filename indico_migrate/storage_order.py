@@ -0,0 +1,108 @@
+# This file is part of Indico.
+# Copyright (C) 2002 - 2017 European Organization for Nuclear Research (CERN).
+#
+# Indico is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# Indico is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Indico; if not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+
+def get_record_index(zodb_root):
+    """Get the index mapping OIDs to file offsets of a FileStorage.
+
+    :return: The index or ``None`` if the storage is not a FileStorage
+             (e.g. when using a ZEO server).
+    """
+    return getattr(zodb_root._p_jar.db().storage, '_index', None)
+
+
+def sort_by_position(btree, index):
+    """Get the keys of `btree` sorted by the file offset of their values.
+
+    The values are not loaded since their OID is known without doing so.
+    Values which are not in the index (e.g. because they have been added
+    after the storage has been opened) are sorted after all others.
+
+    :param btree: A BTree containing persistent objects
+    :param index: The index of the FileStorage containing them
+    """
+    end = float('inf')
+    return [key for __, key in sorted((index.get(obj._p_oid, end), key) for key, obj in btree.iteritems())]
+
+
+def iter_storage_order(btree, index):
+    """Iterate over the values of `btree` in the order they are stored."""
+    for key in sort_by_position(btree, index):
+        yield btree[key]
+
+
+class ConferenceOrder(object):
+    """The order in which conferences are migrated.
+
+    By default this is the key order of the `conferences` BTree.  Both
+    the event checkpoints and the parallel event shards use ranges in
+    this order.
+
+    :param conferences: The `conferences` BTree
+    """
+
+    def __init__(self, conferences):
+        self.conferences = conferences
+
+    def keys(self):
+        return list(self.conferences.keys())
+
+    def sort_key(self, conf_id):
+        return conf_id
+
+    def iteritems(self, min_key=None, max_key=None):
+        """Iterate over the conferences between `min_key` and `max_key` (inclusive)."""
+        return self.conferences.iteritems(min=min_key, max=max_key)
+
+    def rebind(self, conferences):
+        """Get the same order for the `conferences` BTree of another connection."""
+        return ConferenceOrder(conferences)
+
+
+class StorageConferenceOrder(ConferenceOrder):
+    """Migrate conferences in the order they are stored in the FileStorage.
+
+    Reading the records sequentially is much faster than jumping around
+    in the file, especially on spinning disks and with a cold page cache.
+    The order only depends on the contents of the storage, so it is the
+    same when resuming a migration.
+
+    :param conferences: The `conferences` BTree
+    :param index: The index of the FileStorage
+    """
+
+    def __init__(self, conferences, index=None, _keys=None):
+        super(StorageConferenceOrder, self).__init__(conferences)
+        self._keys = _keys if _keys is not None else sort_by_position(conferences, index)
+        self._positions = {key: n for n, key in enumerate(self._keys)}
+
+    def keys(self):
+        return list(self._keys)
+
+    def sort_key(self, conf_id):
+        # the start of the first checkpoint range is an empty string
+        return self._positions.get(conf_id, -1)
+
+    def iteritems(self, min_key=None, max_key=None):
+        start = 0 if min_key is None else self._positions[min_key]
+        end = len(self._keys) if max_key is None else self._positions[max_key] + 1
+        for key in self._keys[start:end]:
+            yield key, self.conferences[key]
+
+    def rebind(self, conferences):
+        return StorageConferenceOrder(conferences, _keys=self._keys)
@@ -17,7 +17,6 @@
 from __future__ import unicode_literals
 
 import errno
-import hashlib
 import os
 import re
 import sys
@@ -29,7 +28,6 @@ from urlparse import urlparse
 from uuid import uuid4
 
 import click
-import yaml
 from colorclass import Color
 from termcolor import colored
 from ZEO.ClientStorage import ClientStorage
@@ -41,8 +39,16 @@ from indico.util.caching import memoize
 from indico.util.date_time import now_utc
 from indico.util.string import sanitize_email, strip_tags
 
+from indico_migrate.archive import archive_index
+from indico_migrate.dedup import content_index
+from indico_migrate.fileinfo import file_info
+from indico_migrate.namespaces import dump_restore_point
+
 
 WHITESPACE_RE = re.compile(r'\s+')
+# legacy classes whose objects are shared by many conferences
+SHARED_LEGACY_CLASSES = frozenset({'Avatar', 'Group', 'LDAPGroup', 'CERNGroup', 'Category', 'Conference',
+                                   'MaterialLocalRepository', 'MaKaCInfo'})
 
 _last_dt = None
 
@@ -86,25 +92,36 @@ class UnbreakingDB(DB):
         return find_global(modulename, globalname, Broken=NotBroken)
 
 
-def get_storage(zodb_uri):
+def get_storage(zodb_uri, read_only=False, quiet=False):
+    """Open the ZODB storage located at `zodb_uri`.
+
+    :param zodb_uri: A ``zeo://`` or ``file://`` URI
+    :param read_only: Open the storage in read-only mode.  This is
+                      needed to open a FileStorage which is already
+                      open (and thus locked) in another process.
+    :param quiet: Do not print anything to the console
+    """
     uri_parts = urlparse(str(zodb_uri))
 
-    print cformat2("%[green]Trying to open {}...").format(zodb_uri)
+    if not quiet:
+        print cformat2("%[green]Trying to open {}...").format(zodb_uri)
 
     if uri_parts.scheme == 'zeo':
-        if uri_parts.port is None:
+        if uri_parts.port is None and not quiet:
             print cformat2("%[yellow]No ZEO port specified. Assuming 9675")
 
         storage = ClientStorage((uri_parts.hostname, uri_parts.port or 9675),
                                 username=uri_parts.username,
                                 password=uri_parts.password,
-                                realm=uri_parts.path[1:])
+                                realm=uri_parts.path[1:],
+                                read_only=read_only)
 
     elif uri_parts.scheme in ('file', None):
-        storage = FileStorage.FileStorage(uri_parts.path)
+        storage = FileStorage.FileStorage(uri_parts.path, read_only=read_only)
     else:
         raise Exception("URI scheme not known: {}".format(uri_parts.scheme))
-    print cformat2("%[green]Done!")
+    if not quiet:
+        print cformat2("%[green]Done!")
     return storage
 
 
@@ -153,13 +170,14 @@ def get_archived_file(f, archive_paths):
         archive_paths = [archive_paths]
     archive_id = f._LocalFile__archivedId
     repo = f._LocalFile__repository
+    exists = archive_index.exists if archive_index.enabled else os.path.exists
     for archive_path in archive_paths:
         path = os.path.join(archive_path.encode('ascii'), repo._MaterialLocalRepository__files[archive_id])
-        if os.path.exists(path):
+        if exists(path):
             return f.fileName, path
         for mode, enc in (('strict', 'iso-8859-1'), ('replace', sys.getfilesystemencoding()), ('replace', 'ascii')):
             enc_path = path.decode('utf-8', mode).encode(enc, 'replace')
-            if os.path.exists(enc_path):
+            if exists(enc_path):
                 return f.fileName, enc_path
     return f.fileName, None
 
@@ -178,17 +196,6 @@ def patch_default_group_provider(provider_name):
         IndicoMultipass.default_group_provider = prop
 
 
-def get_file_md5(path, chunk_size=1024*1024):
-    checksum = hashlib.md5()
-    with open(path, 'rb') as fileobj:
-        while True:
-            chunk = fileobj.read(chunk_size)
-            if not chunk:
-                break
-            checksum.update(chunk)
-    return unicode(checksum.hexdigest())
-
-
 class LocalFileImporterMixin(object):
     """This mixin takes care of interpreting arcane LocalFile information,
        handling incorrectly encoded paths and other artifacts.
@@ -209,9 +216,15 @@ class LocalFileImporterMixin(object):
             raise click.exceptions.UsageError('Both or none of --symlink-target and --symlink-backend must be used.')
         return kwargs
 
-    def _get_local_file_info(self, resource, force_access=False):
+    def _find_local_file(self, resource):
+        """Find a legacy file in the archive dirs.
+
+        :return: A ``(archive_path, path)`` tuple; both are ``None`` if
+                 the file could not be found.
+        """
         archive_id = resource._LocalFile__archivedId
         repo_path = resource._LocalFile__repository._MaterialLocalRepository__files[archive_id]
+        exists = archive_index.exists if archive_index.enabled else os.path.exists
         for archive_path in map(bytes, self.archive_dirs):
             path = os.path.join(archive_path, repo_path)
             if any(ord(c) > 127 for c in repo_path):
@@ -222,43 +235,80 @@ class LocalFileImporterMixin(object):
                     except UnicodeDecodeError:
                         dec_path = path.decode('iso-8859-1', mode)
                     enc_path = dec_path.encode(enc, 'replace')
-                    if os.path.exists(enc_path):
+                    if exists(enc_path):
                         path = enc_path
                         break
                 else:
                     parent_path = os.path.dirname(path)
                     try:
-                        candidates = os.listdir(parent_path)
+                        candidates = (archive_index.listdir(parent_path) if archive_index.enabled
+                                      else os.listdir(parent_path))
                     except OSError as e:
                         if e.errno != errno.ENOENT:
                             raise
-                        return None, None, 0, ''
+                        return None, None
                     if len(candidates) != 1:
-                        return None, None, 0, ''
+                        return None, None
                     path = os.path.join(parent_path, candidates[0])
-                    if not os.path.exists(path):
-                        return None, None, 0, ''
+                    if not exists(path):
+                        return None, None
 
             assert path
-            try:
-                size = 0 if (self.avoid_storage_check and not force_access) else os.path.getsize(path)
-                md5 = '' if (self.avoid_storage_check and not force_access) else get_file_md5(path)
-            except OSError as e:
-                if e.errno != errno.ENOENT:
-                    raise
-                return None, None, 0, ''
-            rel_path = os.path.relpath(path, archive_path)
-            try:
-                rel_path = rel_path.decode('utf-8')
-            except UnicodeDecodeError:
-                if not self.symlink_target:
-                    return None, None, 0, ''
-                symlink_name = uuid4()
-                symlink = os.path.join(self.symlink_target, bytes(symlink_name))
-                os.symlink(path, symlink)
-                return self.symlink_backend, symlink_name, size, md5
+            return archive_path, path
+        return None, None
+
+    def prefetch_local_files(self, resources, force_access=False, group=None):
+        """Start getting the size and checksum of legacy files.
+
+        The files are hashed in the background, so their information is
+        usually available once `_get_local_file_info` needs it.
+
+        :param resources: An iterable of `LocalFile` objects
+        :param force_access: Whether to hash the files even if the storage
+                             is not supposed to be accessed
+        :param group: The group the files belong to, so they can be
+                      dropped in case they are never used
+        """
+        if not file_info.enabled or (self.avoid_storage_check and not force_access):
+            return
+        for resource in resources:
+            path = self._find_local_file(resource)[1]
+            if path is not None:
+                file_info.submit(path, group)
+
+    def _get_local_file_info(self, resource, force_access=False):
+        archive_path, path = self._find_local_file(resource)
+        if path is None:
+            return None, None, 0, ''
+        try:
+            if self.avoid_storage_check and not force_access:
+                size, md5 = 0, ''
             else:
-                return self.storage_backend, rel_path, size, md5
+                size, md5 = file_info.get(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None, None, 0, ''
+        canonical = content_index.find(md5, size) if (md5 and content_index.deduplicate) else None
+        if canonical is not None:
+            # no need to create another symlink either
+            content_index.add(md5, size, canonical)
+            return canonical[0], canonical[1], size, md5
+        rel_path = os.path.relpath(path, archive_path)
+        try:
+            rel_path = rel_path.decode('utf-8')
+        except UnicodeDecodeError:
+            if not self.symlink_target:
+                return None, None, 0, ''
+            symlink_name = uuid4()
+            symlink = os.path.join(self.symlink_target, bytes(symlink_name))
+            os.symlink(path, symlink)
+            location = self.symlink_backend, symlink_name
+        else:
+            location = self.storage_backend, rel_path
+        if md5:
+            content_index.add(md5, size, location)
+        return location[0], location[1], size, md5
 
 
 def strict_sanitize_email(email, fallback=None):
@@ -302,14 +352,14 @@ class MigrationStateManager(object):
     @classmethod
     def save_restore_point(cls, fd):
         ns_data = {ns.name: ns.serialize() for ns in cls._namespaces.viewvalues()}
-        yaml.dump({
+        dump_restore_point({
             'namespaces': ns_data,
             'steps': cls._steps
         }, fd)
 
     @classmethod
     def load_restore_point(cls, data):
-        cls._steps = data['steps']
+        cls._steps = list(data['steps'])
         for name, ns in cls._namespaces.viewitems():
             ns.load(data['namespaces'][name])
 
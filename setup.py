@@ -31,11 +31,13 @@ setup(
     install_requires=['indico>=2.0,<2.1.dev0',
                       'urwid==1.3.1',
                       'github3.py==0.9.6',
-                      'ZODB3==3.10.5'],
+                      'ZODB3==3.10.5',
+                      'msgpack>=0.5.6,<0.7'],
     entry_points={
         'console_scripts': [
             'indico-migrate = indico_migrate.cli:main',
-            'indico-html-sanitize = indico_migrate.html:main'
+            'indico-html-sanitize = indico_migrate.html:main',
+            'indico-migrate-prescan = indico_migrate.prescan:main'
         ]
     },
 )